@@ -74,7 +74,7 @@
   :group 'eaf-pdf-viewer)
 
 (defcustom eaf-pdf-store-history t
-  "If it is t, the pdf file path will be stored in eaf-config-location/pdf/history/log.txt for eaf-open-pdf-from-history to use"
+  "If it is t, the pdf file path will be stored in eaf-config-location/pdf/history/ for eaf-open-pdf-from-history to use"
   :type 'boolean
   :group 'eaf-pdf-viewer)
 
@@ -131,6 +131,33 @@ Non-nil means don't invert images."
   :type 'integer
   :group 'eaf-pdf-viewer)
 
+(defcustom eaf-pdf-reflow-font-size 11
+  "The font size used to layout reflowable document, such as EPUB, MOBI and FB2.
+Page layout of each font size is cached, so open document again is fast."
+  :type 'integer
+  :group 'eaf-pdf-viewer)
+
+(defcustom eaf-pdf-page-columns 1
+  "The number of pages shown side by side when scrolling, 2 is spread view.
+Command `toggle_page_columns' switches between single page and this number of pages,
+it uses 2 when this is 1."
+  :type 'integer
+  :group 'eaf-pdf-viewer)
+
+(defcustom eaf-pdf-raster-cache-size 0
+  "The size limit in MB of disk cache of rendered pages, 0 means disable disk cache.
+Rendered pages are saved under EAF config directory, recently viewed pages of big
+scanned document are loaded from disk when document is opened again."
+  :type 'integer
+  :group 'eaf-pdf-viewer)
+
+(defcustom eaf-pdf-render-processes 0
+  "The number of worker processes that render pages, 0 means render pages in EAF process.
+Worker processes render pages in view at same time, rendered pages are passed by shared memory.
+It's useful for big scanned documents on multi-core machine."
+  :type 'integer
+  :group 'eaf-pdf-viewer)
+
 (defcustom eaf-pdf-inline-text-annot-fontsize 8
   "The font size used by pdf inline text annot."
   :type 'integer
@@ -215,6 +242,9 @@ Non-nil means don't invert images."
     ("o" . "eaf-pdf-outline")
     ("O" . "eaf-pdf-outline-edit")
     ("T" . "toggle_trim_white_margin")
+    ("v" . "toggle_thumbnail_mode")
+    ("D" . "toggle_page_columns")
+    ("A" . "eaf-pdf-list-annots")
     ("C-t" . "toggle_last_position"))
   "The keybinding of EAF PDF Viewer."
   :type '(alist :key-type (string :tag "Key bindings (e.g. \"C-n\", \"<f4>\", etc.)")
@@ -479,15 +509,104 @@ The key is the annot id on PAGE."
 (defun eaf-pdf-get-document-annots ()
   "Return a map of page_index of annots.
 
-The key is the page_index."
+The key is the page_index, the value is a map of annotations on the page,
+same as `eaf-pdf-get-page-annots'."
   (eaf-call-sync "execute_function" eaf--buffer-id "get_document_annots"))
 
+(defvar eaf-pdf--document-annots-callbacks (make-hash-table :test 'equal)
+  "Map buffer id to callback of `eaf-pdf-get-document-annots-async'.")
+
+(defun eaf-pdf-get-document-annots-async (callback)
+  "Scan annotations of document in background, and call CALLBACK for each page.
+
+CALLBACK is called with PAGE-INDEX and a map of annotations on the page,
+the key is the annot id. PAGE-INDEX is -1 and map is nil when scan finished."
+  (puthash eaf--buffer-id callback eaf-pdf--document-annots-callbacks)
+  (eaf-call-async "execute_function" eaf--buffer-id "get_document_annots_async"))
+
+(defun eaf--pdf-receive-page-annots (buffer-id page-index annots)
+  "Dispatch ANNOTS of PAGE-INDEX to callback of BUFFER-ID."
+  (let ((callback (gethash buffer-id eaf-pdf--document-annots-callbacks)))
+    (when (< page-index 0)
+      (remhash buffer-id eaf-pdf--document-annots-callbacks))
+    (when callback
+      (funcall callback page-index
+               (unless (string-empty-p annots)
+                 (json-parse-string annots))))))
+
+(defun eaf--pdf-kill-new-from-file (file)
+  "Add text in FILE to kill ring, FILE is deleted after read.
+Python side write large selection to FILE, to avoid pass it through IPC."
+  (when (file-exists-p file)
+    (kill-new (with-temp-buffer
+                (insert-file-contents file)
+                (buffer-string)))
+    (delete-file file)
+    (message "[EAF] Copied %d characters of selection." (length (car kill-ring)))))
+
 (defun eaf-pdf-jump-to-annot (annot)
   "Jump to specifical pdf annot."
   (let ((rect (gethash "rect" annot))
         (page (gethash "page" annot)))
     (eaf-call-sync "execute_function_with_args" eaf--buffer-id "jump_to_rect" (format "%s" page) rect)))
 
+(defvar eaf-pdf-annots-mode-map
+  (let ((map (make-sparse-keymap)))
+    (define-key map (kbd "n") 'next-line)
+    (define-key map (kbd "p") 'previous-line)
+    (define-key map (kbd "RET") 'eaf-pdf-annots-jump)
+    map)
+  "Keymap used in `eaf-pdf-annots-mode'.")
+
+(define-derived-mode eaf-pdf-annots-mode special-mode "PDF Annots"
+  "EAF pdf annots list mode."
+  (toggle-truncate-lines 1))
+
+(defun eaf-pdf-list-annots ()
+  "List annotations of current PDF buffer.
+
+Annotations are scanned in background, pages are inserted when they are scanned."
+  (interactive)
+  (let ((pdf-buffer (current-buffer))
+        (annots-buffer (get-buffer-create (format "*Annots: %s*" (buffer-name)))))
+    (with-current-buffer annots-buffer
+      (let ((inhibit-read-only t))
+        (erase-buffer))
+      (eaf-pdf-annots-mode)
+      (setq-local eaf-pdf-outline-pdf-document pdf-buffer)
+      (setq mode-line-process ":scanning"))
+    (eaf-pdf-get-document-annots-async
+     (lambda (page-index annots)
+       (when (buffer-live-p annots-buffer)
+         (with-current-buffer annots-buffer
+           (if (< page-index 0)
+               (setq mode-line-process nil)
+             (eaf-pdf--insert-page-annots page-index annots))
+           (force-mode-line-update)))))
+    (pop-to-buffer annots-buffer)))
+
+(defun eaf-pdf--insert-page-annots (page-index annots)
+  "Insert line of each annot in ANNOTS of PAGE-INDEX, pages are scanned in order."
+  (let ((inhibit-read-only t))
+    (save-excursion
+      (goto-char (point-max))
+      (maphash (lambda (_id annot)
+                 (insert (propertize
+                          (format "P%-5d %-12s %s\n"
+                                  (1+ page-index)
+                                  (gethash "type_name" annot)
+                                  (replace-regexp-in-string "[\n\t ]+" " " (string-trim (gethash "text" annot ""))))
+                          'eaf-pdf-annot annot)))
+               annots))))
+
+(defun eaf-pdf-annots-jump ()
+  "Jump to annot of current line."
+  (interactive)
+  (let ((annot (get-text-property (point) 'eaf-pdf-annot)))
+    (when annot
+      (switch-to-buffer-other-window eaf-pdf-outline-pdf-document)
+      (eaf-pdf-jump-to-annot annot))))
+
 (defun eaf--pdf-viewer-bookmark ()
   "Restore EAF buffer according to pdf bookmark from the current file path or web URL."
   `((handler . eaf--bookmark-restore)
@@ -515,17 +634,37 @@ The key is the page_index."
                                              "/" ,page-total-number))
             (force-mode-line-update)))))))
 
+(defun eaf-pdf--history-file (name)
+  "Return path of NAME in pdf history directory."
+  (concat eaf-config-location
+          (file-name-as-directory "pdf")
+          (file-name-as-directory "history")
+          name))
+
+(defun eaf-pdf--read-history-lines (file)
+  (when (file-exists-p file)
+    (with-temp-buffer
+      (insert-file-contents file)
+      (split-string (buffer-string) "\n" t))))
+
+(defun eaf-pdf--read-history ()
+  "Return pdf history paths, most recently opened first.
+
+Python side append open record to open.log with timestamp, and compact
+it to log.txt periodically, so read both of them without rewriting."
+  (let ((recent (mapcar (lambda (line)
+                          (if (string-match "\\`[0-9]+\t\\(.*\\)\\'" line)
+                              (match-string 1 line)
+                            line))
+                        (reverse (eaf-pdf--read-history-lines (eaf-pdf--history-file "open.log")))))
+        (compacted (eaf-pdf--read-history-lines (eaf-pdf--history-file "log.txt"))))
+    (delete-dups (append recent compacted))))
+
 (defun eaf-open-pdf-from-history ()
   "A wrapper around `eaf-open' that provides pdf history candidates.
 This function works best if paired with a fuzzy search package."
   (interactive)
-  (let* ((pdf-history-file-path
-          (concat eaf-config-location
-                  (file-name-as-directory "pdf")
-                  (file-name-as-directory "history")
-                  "log.txt"))
-         (history-pattern "^\\(.+\\)\\.pdf$")
-         (history-file-exists (file-exists-p pdf-history-file-path))
+  (let* ((history-pattern "^\\(.+\\)\\.pdf$")
          (eaf-files-opened (mapcar (lambda (buf)
                                      (buffer-local-value 'eaf--buffer-url buf))
                                    (eaf--get-eaf-buffers)))
@@ -534,39 +673,27 @@ This function works best if paired with a fuzzy search package."
                        (cl-remove-if (lambda (x)
                                        (or (null x)
                                            (member x eaf-files-opened)))
-                                     (if history-file-exists
-                                         (mapcar
-                                          (lambda (h) (when (string-match history-pattern h)
-                                                        (if (file-exists-p h)
-                                                            (format "%s" h))))
-                                          (with-temp-buffer (insert-file-contents pdf-history-file-path)
-                                                            (split-string (buffer-string) "\n" t)))
-                                       (make-directory (file-name-directory pdf-history-file-path) t)
-                                       (with-temp-file pdf-history-file-path ""))))))
+                                     (mapcar
+                                      (lambda (h) (when (string-match history-pattern h)
+                                                    (if (file-exists-p h)
+                                                        (format "%s" h))))
+                                      (eaf-pdf--read-history))))))
     (if history-pdf (eaf-open history-pdf))))
 
 (defun eaf-pdf-delete-invalid-file-record-from-history ()
-  " delete invalid file record from eaf pdf history file"
+  " delete invalid file record from eaf pdf history file
+
+Python side do the cleanup under history lock, so it don't race with
+open records of pdf buffers."
   (interactive)
-  (let* ((pdf-history-file-path
-          (concat eaf-config-location
-                  (file-name-as-directory "pdf")
-                  (file-name-as-directory "history")
-                  "log.txt"))
-         (history-pattern "^\\(.+\\)\\.pdf$")
-         (history-file-exists (file-exists-p pdf-history-file-path))
-         file-content)
-    (when history-file-exists
-      (setq file-content (with-temp-buffer
-                           (insert-file-contents pdf-history-file-path)
-                           (buffer-string)))
-      (dolist (each-file (split-string file-content "\n" t))
-        (unless (file-exists-p each-file)
-          (setq file-content (replace-regexp-in-string (rx--to-expr (format "%s\n"  each-file)) "" file-content))
-          (message "delete %s record from history" each-file)))
-      (with-temp-file pdf-history-file-path
-        (insert file-content))
-      )))
+  (with-temp-buffer
+    (if (zerop (call-process eaf-python-command nil t nil
+                             (concat (file-name-directory eaf-pdf-viewer-module-path) "eaf_pdf_history.py")
+                             "remove-missing"
+                             (eaf-pdf--history-file "")))
+        (dolist (each-file (split-string (buffer-string) "\n" t))
+          (message "delete %s record from history" each-file))
+      (message "[EAF/pdf] Failed to clean history: %s" (string-trim (buffer-string))))))
 
 (defun eaf-pdf-delete-pages (page-num)
   " Delete pdf pages
@@ -678,6 +805,16 @@ This function works best if paired with a fuzzy search package."
     (message "Can not found %s" eaf-pdf-synctex-path)
     nil))
 
+(defun eaf-pdf--get-native-synctex-info (pdf-buffer tex-file line-num)
+  "Get synctex info of `tex-file' and `line-num' from synctex index of `pdf-buffer'.
+Return nil if not found, then caller should fallback to synctex tool."
+  (when pdf-buffer
+    (let ((synctex-info (eaf-call-sync "execute_function_with_args"
+                                       (buffer-local-value 'eaf--buffer-id pdf-buffer)
+                                       "get_synctex_info" tex-file (format "%s" line-num))))
+      (unless (or (null synctex-info) (string-empty-p synctex-info))
+        synctex-info))))
+
 (defun eaf-pdf-jump-to-page (url page-num)
   (let* ((pdf-url (expand-file-name url))
          (opened-buffer (eaf-pdf--find-buffer pdf-url))
@@ -697,7 +834,8 @@ This function works best if paired with a fuzzy search package."
          (tex-file (buffer-file-name tex-buffer))
          (line-num (progn (set-buffer tex-buffer) (line-number-at-pos)))
          (opened-buffer (eaf-pdf--find-buffer pdf-url))
-         (synctex-info (eaf-pdf--get-synctex-info tex-file line-num pdf-url)))
+         (synctex-info (or (eaf-pdf--get-native-synctex-info opened-buffer tex-file line-num)
+                           (eaf-pdf--get-synctex-info tex-file line-num pdf-url))))
 
     (when (and (one-window-p) (not opened-buffer))
       ;; If the window is sole, then split window
@@ -713,17 +851,21 @@ This function works best if paired with a fuzzy search package."
       (eaf-call-sync "execute_function_with_args" eaf--buffer-id
 		             "jump_to_page_synctex" (format "%s" synctex-info)))))
 
+(defun eaf-pdf-synctex-open-tex (tex-file line-num)
+  "Open `tex-file' in other window and go to `line-num'."
+  (let ((buffer (get-buffer (file-name-nondirectory tex-file))))
+    (if buffer
+        (switch-to-buffer-other-window buffer)
+      (find-file-other-window tex-file))
+    (goto-line line-num)))
+
 (defun eaf-pdf-synctex-backward-edit (pdf-file page-num x y)
   "Edit the Tex file corresponding to (`page-num', `x' , `y') of the `pdf-file'."
   (let* ((tex-and-line (eaf-pdf--get-tex-and-line pdf-file page-num x y))
          (tex-file (nth 0 tex-and-line))
          (line-num (nth 1 tex-and-line)))
     (if (and tex-file line-num)
-        (let ((buffer (get-buffer (file-name-nondirectory tex-file))))
-          (if buffer
-              (switch-to-buffer-other-window buffer)
-            (find-file-other-window tex-file))
-          (goto-line line-num))
+        (eaf-pdf-synctex-open-tex tex-file line-num)
       (eaf-pdf-extract-page-text))))
 
 (defun eaf-pdf-outline-edit-buffer-confirm ()
@@ -755,6 +897,34 @@ This function works best if paired with a fuzzy search package."
       (when line-num
         (goto-line line-num)))))
 
+(defun eaf-pdf-extract-pages-text (start-page end-page)
+  "Display the text from START-PAGE to END-PAGE in a new buffer, pages are separated by form feed."
+  (interactive
+   (let ((current-page (string-to-number (eaf-call-sync "execute_function" eaf--buffer-id "current_page"))))
+     (list (read-number "Start page: " current-page)
+           (read-number "End page: " current-page))))
+  (eaf-pdf-extract-page-text
+   (eaf-call-sync "execute_function_with_args" eaf--buffer-id "get_pages_text"
+                  (format "%s" start-page) (format "%s" end-page))))
+
+(defun eaf-pdf-back-references ()
+  "Jump to a page that links to current page."
+  (interactive)
+  (let* ((result (eaf-call-sync "execute_function" eaf--buffer-id "get_back_references"))
+         (pages (split-string result " " t)))
+    (cond ((equal result "building")
+           (message "[EAF] Link graph is building, please try again later."))
+          (pages
+           (eaf-call-sync "execute_function_with_args" eaf--buffer-id "jump_to_page_with_num"
+                          (completing-read "Jump to page that links here: " pages nil t)))
+          (t
+           (message "[EAF] No page links to current page.")))))
+
+(defun eaf-pdf-show-startup-timing ()
+  "Show startup timing breakdown of current pdf buffer."
+  (interactive)
+  (message "%s" (eaf-call-sync "execute_function" eaf--buffer-id "get_startup_timing")))
+
 (defun eaf-pdf-rebuild-full-text-cache ()
   (interactive)
   (eaf-call-async
@@ -866,6 +1036,47 @@ This function works best if paired with a fuzzy search package."
         (eaf-call-async "execute_function" eaf-buffer-id "search_text_forward" ))))))
 
 
+;;;; Config change notification
+(defvar eaf-pdf--config-variables
+  '(eaf-buffer-background-color
+    eaf-marker-letters
+    user-full-name
+    eaf-pdf-store-history
+    eaf-pdf-dark-mode
+    eaf-pdf-dark-exclude-image
+    eaf-pdf-default-zoom
+    eaf-pdf-zoom-step
+    eaf-pdf-scroll-ratio
+    eaf-pdf-text-highlight-annot-color
+    eaf-pdf-text-underline-annot-color
+    eaf-pdf-inline-text-annot-color
+    eaf-pdf-inline-text-annot-fontsize
+    eaf-pdf-show-progress-on-page
+    eaf-pdf-marker-fontsize
+    eaf-pdf-click-to-copy
+    eaf-pdf-notify-file-changed
+    eaf-pdf-reflow-font-size
+    eaf-pdf-page-columns
+    eaf-pdf-raster-cache-size
+    eaf-pdf-render-processes)
+  "Variables that pdf viewer buffers keep in their config snapshot.")
+
+(defun eaf-pdf--notify-config-change (symbol _newval operation _where)
+  "Notify pdf viewer buffers to refresh SYMBOL in their config snapshot."
+  (when (memq operation '(set makunbound))
+    ;; Watcher is called before SYMBOL changed, notify after it.
+    (run-at-time 0 nil #'eaf-pdf--refresh-config (symbol-name symbol))))
+
+(defun eaf-pdf--refresh-config (var-name)
+  (dolist (buffer (eaf--get-eaf-buffers))
+    (with-current-buffer buffer
+      (when (string= eaf--buffer-app-name "pdf-viewer")
+        (eaf-call-async "execute_function_with_args" eaf--buffer-id "refresh_emacs_config" var-name)))))
+
+(when (fboundp 'add-variable-watcher)
+  (dolist (var eaf-pdf--config-variables)
+    (add-variable-watcher var #'eaf-pdf--notify-config-change)))
+
 ;;;; Register as module for EAF
 (add-to-list 'eaf-app-binding-alist '("pdf-viewer" . eaf-pdf-viewer-keybinding))
 
@@ -61,14 +61,156 @@ class AnnotAction():
 
         return annot_action
 
-    @staticmethod
-    def find_annot_of_annot_action(page, annot_action):
-        annot = page.first_annot
 
-        while annot:
-            if (annot.info["id"] == annot_action.annot_id):
-                return annot
-            else:
-                annot = annot.next
+class AnnotIndex():
+    '''
+    Document-wide annot index, map annot id to (page_index, xref, rect, type).
+    Annots without id (no /NM entry) are not indexed, they can't be found by id.
+
+    The index is built lazily on the first lookup, then kept current by
+    add/delete/move paths, so by-id operations don't walk the annot list of pages.
+    '''
+    def __init__(self, document):
+        self.document = document
+        self._entries = None
+
+    def reset(self, document=None):
+        if document is not None:
+            self.document = document
+        self._entries = None
+
+    def _build(self):
+        entries = {}
+        if self.document.is_pdf:
+            for page_index in range(self.document.page_count):
+                if not page_has_annots(self.document, page_index):
+                    continue
+                for annot in self.document[page_index].annots():
+                    if annot.info["id"]:
+                        entries[annot.info["id"]] = (page_index, annot.xref, annot.rect, annot.type[0])
+        self._entries = entries
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._build()
+        return self._entries
+
+    def get(self, annot_id):
+        if not annot_id:
+            return None
+        return self.entries.get(annot_id)
+
+    def add(self, page_index, annot):
+        # Don't build the index only for add, it will be built with this annot later.
+        if self._entries is not None and annot.info["id"]:
+            self._entries[annot.info["id"]] = (page_index, annot.xref, annot.rect, annot.type[0])
+
+    def update(self, annot):
+        if self._entries is not None and annot.info["id"] in self._entries:
+            page_index, xref, _, annot_type = self._entries[annot.info["id"]]
+            self._entries[annot.info["id"]] = (page_index, xref, annot.rect, annot_type)
+
+    def remove(self, annot_id):
+        if self._entries is not None:
+            self._entries.pop(annot_id, None)
+
+    def find(self, annot_id, page=None):
+        '''
+        Return the annot of annot_id, page is optional, it avoid load page again if caller has it.
+        '''
+        entry = self.get(annot_id)
+        if entry is None:
+            return None
+
+        page_index, xref, _, _ = entry
+        if page is None or page.number != page_index:
+            page = self.document[page_index]
+
+        annot = page.load_annot(xref)
+        if annot is None or annot.info["id"] != annot_id:
+            # Xref is stale (e.g. file changed outside), rebuild index next time.
+            self._entries = None
+            return None
+
+        annot.parent = page
+        return annot
+
 
-        return None
+def page_has_annots(document, page_index):
+    '''
+    Check /Annots array of page object, avoid load page that don't have any annot.
+    '''
+    if not document.is_pdf:
+        return False
+
+    try:
+        annots_type, annots_value = document.xref_get_key(document.page_xref(page_index), "Annots")
+    except Exception:
+        # PyMuPDF before 1.18.7 don't have xref_get_key, load page to check.
+        return document[page_index].first_annot is not None
+
+    if annots_type == "null":
+        return False
+    elif annots_type == "array":
+        return annots_value.strip("[] ") != ""
+    else:
+        # /Annots is indirect object, need load page to check.
+        return True
+
+
+def get_page_annots_info(document, page_index):
+    '''
+    Return dict of annot id to annot info on page_index.
+
+    Work on raw fitz.Document, text under annots are extracted with one textpage per page.
+    '''
+    result = {}
+    if not page_has_annots(document, page_index):
+        return result
+
+    page = document[page_index]
+    textpage = None
+    for annot in page.annots():
+        annot_type = annot.type
+        if len(annot_type) != 2:
+            continue
+
+        rect = annot.rect
+        if textpage is None:
+            try:
+                textpage = page.get_textpage()
+            except Exception:
+                textpage = False
+
+        if textpage:
+            text = page.get_textbox(rect, textpage=textpage)
+        else:
+            text = page.get_textbox(rect)
+
+        result[annot.info["id"]] = {
+            "info": annot.info,
+            "page": page_index,
+            "type_int": annot_type[0],
+            "type_name": annot_type[1],
+            "rect": "%s:%s:%s:%s" %(rect.x0, rect.y0, rect.x1, rect.y1),
+            "text": text,
+        }
+    return result
+
+
+class AnnotActionBatch():
+    '''
+    Group annot actions of one operation (e.g. highlight a selection across pages),
+    undo/redo them as one action.
+    '''
+    def __init__(self, annot_actions):
+        self.annot_actions = annot_actions
+        self.page_index = annot_actions[0].page_index
+        self.action_type = "Batch"
+
+    @staticmethod
+    def unpack(annot_action):
+        if isinstance(annot_action, AnnotActionBatch):
+            return annot_action.annot_actions
+        return [annot_action]
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Render without display, must set before Qt is loaded.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# hack: add current dir path to sys.path for relative path import other modules.
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Document of worker process, opened by _init_worker.
+_worker_document = None
+
+
+def parse_page_ranges(text, page_count):
+    '''
+    Parse page ranges like "1-10,15,20-" (1-based, inclusive) to sorted page indexes.
+    '''
+    if not text:
+        return list(range(page_count))
+
+    page_indexes = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        start = int(start) if start else 1
+        end = (int(end) if end else page_count) if sep else start
+        page_indexes.update(range(max(start, 1) - 1, min(end, page_count)))
+    return sorted(page_indexes)
+
+def open_pdf_document(url, reflow_font_size=None, layout_cache_dir=None):
+    from eaf_pdf_document import PdfDocument, acquire_shared_document
+
+    if layout_cache_dir is None:
+        layout_cache_dir = os.path.join(tempfile.gettempdir(), "eaf-pdf-layout")
+    return PdfDocument(acquire_shared_document(url, reflow_font_size, layout_cache_dir))
+
+def _init_worker(url, reflow_font_size, layout_cache_dir, ready=None):
+    global _worker_document
+    _worker_document = open_pdf_document(url, reflow_font_size, layout_cache_dir)
+    if ready is not None:
+        ready.wait()
+
+def _render_page(args):
+    '''
+    Render one page same as pdf viewer, write it to output_dir if it's not None.
+    Return (page_index, width, height).
+    '''
+    import fitz
+    from eaf_pdf_page import PdfPage
+
+    (page_index, scale, rotation, invert, invert_image, clip, output_dir, output_format) = args
+    document = _worker_document
+    page = PdfPage(document.load_page(page_index), page_index, document.is_pdf,
+                   fitz.Rect(clip) if clip is not None else None)
+    if document.is_pdf:
+        page.set_rotation(rotation)
+    # get_qimage is get_qpixmap without QPixmap, QPixmap need QGuiApplication.
+    image = page.get_qimage(scale, invert, invert_image)
+
+    if output_dir is not None:
+        _save_image(image, document.shared_document.url, page_index, output_dir, output_format)
+
+    return page_index, image.width(), image.height()
+
+def _save_image(image, url, page_index, output_dir, output_format):
+    name = os.path.splitext(os.path.basename(url))[0]
+    if output_format == "png":
+        image.save(os.path.join(output_dir, "{}-{:04d}.png".format(name, page_index + 1)), "PNG")
+    else:
+        # Raw RGBA8888 rows without padding, size is in file name.
+        path = os.path.join(output_dir, "{}-{:04d}-{}x{}.rgba".format(
+            name, page_index + 1, image.width(), image.height()))
+        row_size = image.width() * 4
+        with open(path, "wb") as f:
+            for y in range(image.height()):
+                f.write(image.constScanLine(y).asstring(row_size))
+
+def _render_shared_memory(document, url, page_indexes, jobs, render_args, output_dir, output_format):
+    '''
+    Render pages with ProcessRenderer, pixmaps of workers are read from shared memory.
+    Return seconds of rendering.
+    '''
+    from eaf_pdf_process_render import ProcessRenderer
+
+    renderer = ProcessRenderer(url, jobs)
+    try:
+        page_widths, page_heights = document.get_all_widths_heights()
+        reflow_layout = document.reflow_layout
+        renderer.reset((max(page_widths, default=0), max(page_heights, default=0)),
+                       reflow_layout.get_layout_args() if reflow_layout is not None else None)
+        # Process startup is not counted in pages/sec.
+        renderer.wait_ready(60)
+
+        start_time = time.perf_counter()
+        # Only request pages that have free slot, rendered pages are not dropped before taken.
+        next_index = min(renderer.slot_count, len(page_indexes))
+        renderer.request(page_indexes[:next_index], *render_args, replace=False)
+        for (i, page_index) in enumerate(page_indexes):
+            key = (page_index,) + render_args
+            renderer.wait([key], 60)
+            image = renderer.take(key)
+            if image is None:
+                raise RuntimeError("Failed to render page {}".format(page_index + 1))
+            if output_dir is not None:
+                _save_image(image, url, page_index, output_dir, output_format)
+            renderer.release(key)
+
+            if next_index < len(page_indexes):
+                renderer.request([page_indexes[next_index]], *render_args, replace=False)
+                next_index += 1
+        return time.perf_counter() - start_time
+    finally:
+        renderer.stop()
+
+def render_pages(url, page_ranges=None, jobs=None, scale=1.0, rotation=0, invert=False, invert_image=False,
+                 trim=False, output_dir=None, output_format="png", reflow_font_size=None, layout_cache_dir=None,
+                 shared_memory=False):
+    '''
+    Render page_ranges of url in jobs processes, return (page_count, seconds).
+    Options are same as pdf viewer: scale is zoom * device pixel ratio,
+    invert is dark mode, invert_image is dark mode without excluding images.
+    If shared_memory is True, render with ProcessRenderer of pdf viewer, images are written in parent process.
+    '''
+    document = open_pdf_document(url, reflow_font_size, layout_cache_dir)
+
+    page_count = document.page_count
+    reflow_layout = document.reflow_layout
+    if reflow_layout is not None and not reflow_layout.is_ready:
+        # Count all pages once, workers read page counts from layout cache.
+        counted = threading.Event()
+        reflow_layout.count_pages(counted.set)
+        counted.wait()
+        if reflow_layout.is_ready:
+            page_count = document.page_count
+        else:
+            # Counting failed, let MuPDF lay out whole book.
+            page_count = document.document.page_count
+
+    page_indexes = parse_page_ranges(page_ranges, page_count)
+
+    clip = None
+    if trim:
+        # Same as viewer, trim clip is union of content rect of pages.
+        document.toggle_trim_margin()
+        for page_index in page_indexes:
+            document[page_index]
+        page_clip = document.get_page_clip()
+        clip = tuple(page_clip) if page_clip is not None else None
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    tasks = [(page_index, scale, rotation, invert, invert_image, clip, output_dir, output_format)
+             for page_index in page_indexes]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks) or 1))
+    init_args = (url, reflow_font_size, layout_cache_dir)
+
+    if shared_memory:
+        render_args = (scale, rotation, invert, invert_image, clip)
+        seconds = _render_shared_memory(document, url, page_indexes, jobs, render_args, output_dir, output_format)
+        return len(tasks), seconds
+    elif jobs == 1:
+        _init_worker(*init_args)
+        start_time = time.perf_counter()
+        for task in tasks:
+            _render_page(task)
+    else:
+        # Spawn worker, fork is not safe with MuPDF and Qt state of parent.
+        context = multiprocessing.get_context("spawn")
+        # Wait all workers opened document, process startup is not counted in pages/sec.
+        ready = context.Barrier(jobs + 1)
+        with context.Pool(jobs, initializer=_init_worker, initargs=init_args + (ready,)) as pool:
+            ready.wait(timeout=60)
+            start_time = time.perf_counter()
+            for _ in pool.imap_unordered(_render_page, tasks, chunksize=max(1, len(tasks) // (jobs * 8))):
+                pass
+    return len(tasks), time.perf_counter() - start_time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render pages with EAF pdf viewer pipeline, and report pages per second.",
+        epilog="EAF directory must be in PYTHONPATH. Without --output, pages are rendered and dropped, for benchmark.")
+    parser.add_argument("file", help="PDF or other document that MuPDF can open")
+    parser.add_argument("-p", "--pages", help="page ranges, e.g. 1-10,15,20- (default all pages)")
+    parser.add_argument("-o", "--output", help="output directory")
+    parser.add_argument("-f", "--format", choices=["png", "rgba"], default="png", help="output format (default png)")
+    parser.add_argument("-j", "--jobs", type=int, help="number of render processes (default cpu count)")
+    parser.add_argument("--scale", type=float, default=1.0, help="zoom scale (default 1.0)")
+    parser.add_argument("--dpr", type=float, default=1.0, help="device pixel ratio of HiDPI screen (default 1.0)")
+    parser.add_argument("--rotation", type=int, default=0, choices=[0, 90, 180, 270])
+    parser.add_argument("--invert", action="store_true", help="dark mode")
+    parser.add_argument("--invert-image", action="store_true", help="invert images too in dark mode")
+    parser.add_argument("--trim", action="store_true", help="trim white margin")
+    parser.add_argument("--reflow-font-size", type=int, help="font size of reflowable document")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="render with process backend of pdf viewer, pages are passed by shared memory")
+    args = parser.parse_args(argv)
+
+    page_count, seconds = render_pages(
+        args.file, args.pages, args.jobs, args.scale * args.dpr, args.rotation, args.invert, args.invert_image,
+        args.trim, args.output, args.format, args.reflow_font_size, shared_memory=args.shared_memory)
+
+    print("Rendered {} pages in {:.2f}s, {:.1f} pages/sec".format(
+        page_count, seconds, page_count / seconds if seconds > 0 else 0.0))
+
+if __name__ == "__main__":
+    main()
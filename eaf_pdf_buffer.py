@@ -19,6 +19,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+_module_import_start_time = time.perf_counter()
+
 from PyQt6.QtGui import QColor
 from PyQt6.QtCore import QTimer,  QObject
 from core.buffer import Buffer    # type: ignore
@@ -31,9 +34,14 @@ import threading
 import sys
 sys.path.append(os.path.dirname(__file__))
 
+from eaf_pdf_annot import get_page_annots_info
+from eaf_pdf_config import EmacsConfig
+from eaf_pdf_document import release_shared_document
+from eaf_pdf_history import OpenHistory
 from eaf_pdf_widget import PdfViewerWidget
-from eaf_pdf_utils import use_new_doc_name
-from bisect import bisect_left
+from eaf_pdf_utils import StartupTimer
+
+_module_import_duration = (time.perf_counter() - _module_import_start_time) * 1000
 
 class SynctexInfo():
     def __init__(self, info):
@@ -122,7 +130,12 @@ class AppBuffer(Buffer):
     def __init__(self, buffer_id, url, arguments):
         Buffer.__init__(self, buffer_id, url, arguments, False)
 
-        (buffer_background_color, self.store_history, self.pdf_dark_mode) = get_emacs_vars([
+        self.startup_timer = StartupTimer()
+
+        # Load Emacs variables once, widget read them from snapshot.
+        self.emacs_config = EmacsConfig()
+        self.startup_timer.mark("emacs config")
+        (buffer_background_color, self.store_history, self.pdf_dark_mode) = self.emacs_config.get_vars([
              "eaf-buffer-background-color",
              "eaf-pdf-store-history",
              "eaf-pdf-dark-mode"])
@@ -133,12 +146,13 @@ class AppBuffer(Buffer):
         self.add_widget(PdfViewerWidget(url, QColor(buffer_background_color), self, buffer_id, self.synctex_info))
         self.buffer_widget.translate_double_click_word.connect(translate_text)
 
-        # Use thread to avoid slow down open speed.
-        threading.Thread(target=self.record_open_history).start()
+        # Use thread to avoid slow down open speed, and start it after first paint.
+        self.buffer_widget.defer_after_first_paint(lambda: threading.Thread(target=self.record_open_history).start())
         
         file_name = os.path.basename(self.url)
         self.cache_file_name = os.path.join(get_emacs_config_dir(), "pdf", "cache", file_name + ".txt")
         self._is_caching = False
+        self._is_scanning_annots = False
 
         self.build_all_methods(self.buffer_widget)
         self.search_adapter = SearchAdapter(self.buffer_widget)
@@ -157,32 +171,17 @@ class AppBuffer(Buffer):
         self.buffer_widget.page_cache_pixmap_dict.clear()
         self.buffer_widget.update()
 
+    @PostGui()
+    def refresh_emacs_config(self, var_name):
+        self.emacs_config.refresh([var_name])
+        (self.store_history, self.pdf_dark_mode) = self.emacs_config.get_vars([
+             "eaf-pdf-store-history",
+             "eaf-pdf-dark-mode"])
+
     def record_open_history(self):
         if self.store_history:
-            # Make sure file created.
-            history_file = os.path.join(get_emacs_config_dir(), "pdf", "history", "log.txt")
-
-            touch(history_file)
-
-            # Read history.
-            lines = []
-            with open(history_file, "r") as f:
-                lines = f.readlines()
-
-            # Filter empty line and \n char that end of filename.
-            lines = list(filter(lambda line: line != "\n", lines))
-            lines = list(map(lambda line: line.replace("\n", ""), lines))
-
-            # Make sure current file is at top of history file.
-            if self.url in lines:
-                lines.remove(self.url)
-            lines.insert(0, self.url)
-
-            # Record history.
-            with open(history_file, "w") as f:
-                for line in lines:
-                    f.write(line)
-                    f.write("\n")
+            history = OpenHistory(os.path.join(get_emacs_config_dir(), "pdf", "history"))
+            history.record(self.url)
 
     def cache_reverse_index(self, force=False):
         """
@@ -209,6 +208,17 @@ class AppBuffer(Buffer):
         self._is_caching = False
 
     def destroy_buffer(self):
+        self.buffer_widget.deferred_startup_timer.stop()
+        self.buffer_widget.background_renderer.stop()
+        self.buffer_widget.preview_renderer.stop()
+        self.buffer_widget.thumbnail_cache.stop()
+        if self.buffer_widget.shared_document is not None:
+            self.buffer_widget.shared_document.remove_reload_callback(self.buffer_widget.load_document)
+            self.buffer_widget.shared_document.remove_relayout_callback(self.buffer_widget.handle_reflow_relayout)
+            self.buffer_widget.shared_document.remove_page_count_callback(self.buffer_widget.handle_page_count_changed)
+            self.buffer_widget.shared_document.remove_rendered_callback(self.buffer_widget.handle_process_rendered)
+            release_shared_document(self.buffer_widget.shared_document)
+
         if self.delete_temp_file:
             if os.path.exists(self.url):
                 os.remove(self.url)
@@ -299,6 +309,10 @@ class AppBuffer(Buffer):
         if read_mode == "fit_to_presentation":
             QTimer().singleShot(10, self.enable_fullscreen)
 
+        # Render restored viewport in background, first paint will use it.
+        self.buffer_widget.prerender_session_pages()
+        self.startup_timer.mark("restore session")
+
         self.buffer_widget.update()
 
     def jump_to_page(self):
@@ -307,6 +321,15 @@ class AppBuffer(Buffer):
     def jump_to_page_with_num(self, num):
         self.buffer_widget.jump_to_page(int(num))
 
+    def get_synctex_info(self, tex_file, line_num):
+        '''
+        Return "page:x:y" of line_num in tex_file from synctex index, empty string if not found.
+        '''
+        result = self.buffer_widget.synctex_index.forward(tex_file, int(line_num))
+        if result is None:
+            return ""
+        return "{}:{}:{}".format(*result)
+
     def jump_to_page_synctex(self, info):
         self.buffer_widget.synctex_info.update(info)
         synctex = self.buffer_widget.synctex_info
@@ -386,9 +409,8 @@ class AppBuffer(Buffer):
             self.edit_annot_text()
 
     def copy_select(self):
-        content = self.buffer_widget.get_select()
-        if content:
-            eval_in_emacs('kill-new', [content])
+        if self.buffer_widget.is_select_mode:
+            self.buffer_widget.copy_select()
 
     def get_select(self):
         return self.buffer_widget.get_select()
@@ -399,10 +421,26 @@ class AppBuffer(Buffer):
     def current_page(self):
         return str(self.buffer_widget.start_page_index + 1)
 
+    def get_back_references(self):
+        '''
+        Return pages (1-based) that link to current page, separated by space.
+        Return "building" if link graph is not ready yet.
+        '''
+        pages = self.buffer_widget.get_back_references(self.buffer_widget.current_page_index1 - 1)
+        if pages is None:
+            return "building"
+        return " ".join(str(page_index + 1) for page_index in pages)
+
     def get_page_text(self, page_index=None):
         page_index = page_index if page_index is not None else self.buffer_widget.current_page_index1 - 1
-        page = self.buffer_widget.document[page_index]
-        return page.get_text()
+        return self.buffer_widget.document.page_text_cache.get(int(page_index))
+
+    def get_pages_text(self, start_page, end_page):
+        '''
+        Return text of pages from start_page to end_page (1-based, inclusive), pages are separated by form feed.
+        '''
+        texts = self.buffer_widget.document.page_text_cache.get_range(int(start_page) - 1, int(end_page))
+        return "\f\n".join(texts)
 
     def current_percent(self):
         return str(self.buffer_widget.current_percent())
@@ -448,19 +486,16 @@ class AppBuffer(Buffer):
             self.buffer_widget.annot_handler("move")
 
     def edit_annot_by_id(self, page_index, annot_id):
-        page = self.buffer_widget.document[int(page_index)]
-        annot = self.buffer_widget.find_annot_by_id(page, annot_id)
+        annot = self.buffer_widget.find_annot_by_id(annot_id, page_index)
         self.buffer_widget.annot_handler("edit", annot)
 
     def move_annot_by_id(self, page_index, annot_id):
         message_to_emacs("Move text annot: left-click mouse to choose a target position.")
-        page = self.buffer_widget.document[int(page_index)]
-        annot = self.buffer_widget.find_annot_by_id(page, annot_id)
+        annot = self.buffer_widget.find_annot_by_id(annot_id, page_index)
         self.buffer_widget.annot_handler("move", annot)
 
     def delete_annot_by_id(self, page_index, annot_id):
-        page = self.buffer_widget.document[int(page_index)]
-        annot = self.buffer_widget.find_annot_by_id(page, annot_id)
+        annot = self.buffer_widget.find_annot_by_id(annot_id, page_index)
         self.buffer_widget.annot_handler("delete", annot)
 
     def set_focus_text(self, new_text):
@@ -478,14 +513,7 @@ class AppBuffer(Buffer):
             self.buffer_widget.annot_inline_text_annot(new_text)
 
     def get_toc(self):
-        result = ""
-        if use_new_doc_name:
-            toc = self.buffer_widget.document.get_toc()
-        else:
-            toc = self.buffer_widget.document.getToC()
-        for line in toc:
-            result += "{0}{1} {2}\n".format("".join("    " * (line[0] - 1)), line[1], line[2])
-        return result
+        return self.buffer_widget.document.toc_model.get_outline_text()
 
     def get_page_annots(self, page_index):
         '''
@@ -493,38 +521,55 @@ class AppBuffer(Buffer):
         '''
         import json
 
-        if self.buffer_widget.document[page_index].first_annot is None:
+        # Notes: annots need the pymupdf above 1.16.4 version.
+        result = get_page_annots_info(self.buffer_widget.document.document, int(page_index))
+        if not result:
             return None
 
-        # Notes: annots need the pymupdf above 1.16.4 version.
-        annots = self.buffer_widget.get_annots(int(page_index))
-        result = {}
-        for annot in annots:
-            id = annot.info["id"]
-            rect = annot.rect
-            type = annot.type
-            if len(type) != 2:
-                continue
-            result[id] = {
-                "info": annot.info,
-                "page": page_index,
-                "type_int": type[0],
-                "type_name": type[1],
-                "rect": "%s:%s:%s:%s" %(rect.x0, rect.y0, rect.x1, rect.y1),
-                "text": annot.parent.get_textbox(rect),
-            }
         return json.dumps(result)
 
     def get_document_annots(self):
         import json
 
+        # Encode all pages once, Emacs parse one JSON object.
+        document = self.buffer_widget.document.document
         annots = {}
-        for page_index in range(self.buffer_widget.page_total_number):
-            annot = self.get_page_annots(page_index)
-            if annot:
-                annots[page_index] = annot
+        for page_index in range(document.page_count):
+            result = get_page_annots_info(document, page_index)
+            if result:
+                annots[page_index] = result
         return json.dumps(annots)
 
+    def get_document_annots_async(self):
+        '''
+        Scan annotations in background, send result to Emacs page by page.
+        '''
+        if not self._is_scanning_annots:
+            self._is_scanning_annots = True
+            threading.Thread(target=self._stream_document_annots, args=(self.url,)).start()
+        return ""
+
+    def _stream_document_annots(self, url):
+        import json
+
+        document = None
+        try:
+            # Use standalone document in thread, fitz document is not thread safe.
+            document = fitz.open(url)
+            for page_index in range(document.page_count):
+                result = get_page_annots_info(document, page_index)
+                if result:
+                    eval_in_emacs("eaf--pdf-receive-page-annots", [self.buffer_id, page_index, json.dumps(result)])
+        except Exception:
+            import traceback
+            traceback.print_exc()
+        finally:
+            if document is not None:
+                document.close()
+            # -1 as scan finish signal.
+            eval_in_emacs("eaf--pdf-receive-page-annots", [self.buffer_id, -1, ""])
+            self._is_scanning_annots = False
+
     def jump_to_rect(self, page_index, rect):
         arr = rect.split(":")
         if len(arr) != 4:
@@ -558,36 +603,21 @@ class AppBuffer(Buffer):
         return list(map(lambda x: x.lower(), self.buffer_widget.jump_link_key_cache_dict.keys()))
 
     def get_toc_to_edit (self):
-        result = ""
-        if use_new_doc_name:
-            toc = self.buffer_widget.document.get_toc()
-        else:
-            toc = self.buffer_widget.document.getToC()
-        for line in toc:
-            result += "{0} {1} {2}\n".format("".join("*" * line[0]), line[1], line[2])
-        return result
+        return self.buffer_widget.document.toc_model.get_edit_text()
 
     def get_toc_for_search (self):
-        doc = self.buffer_widget.document
-        toc = doc.get_toc() if use_new_doc_name else doc.getToC()
-        toc_list = []
-        toc_pages = []
-        for line in toc:
-            toc_list.append(f"{line[2]}:{line[0]*' '}{line[1]}")
-            toc_pages.append(line[2])
+        toc_model = self.buffer_widget.document.toc_model
         page = self.buffer_widget.start_page_index + 1
-        index = 0
-        if len(toc_pages) >= 100:
-            index = bisect_left(toc_pages, page)
-        else:
-            for i in range(len(toc_pages)): 
-                if page < toc_pages[i]:
-                    index = i-1
-                    break
-        return toc_list, index
+        return toc_model.get_search_list(), toc_model.find_section(page)
     
     def edit_outline_confirm(self, payload):
         self.buffer_widget.edit_outline_confirm(payload)
 
     def get_progress(self):
         return self.buffer_widget.get_page_progress()
+
+    def get_startup_timing(self):
+        return "module import: {:.1f}ms, {}".format(_module_import_duration, self.startup_timer.report())
+
+    def get_ipc_stats(self):
+        return self.buffer_widget.emacs_call_batcher.get_stats()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from core.utils import get_emacs_vars
+
+
+class EmacsConfig():
+    '''
+    Snapshot of Emacs variables used by pdf viewer, load once per buffer.
+
+    Emacs notify buffer to refresh when variable changed (see `eaf-pdf--config-variables'),
+    so paint and mouse event never need to query Emacs.
+    '''
+    var_names = [
+        "eaf-buffer-background-color",
+        "eaf-marker-letters",
+        "user-full-name",
+        "eaf-pdf-store-history",
+        "eaf-pdf-dark-mode",
+        "eaf-pdf-dark-exclude-image",
+        "eaf-pdf-default-zoom",
+        "eaf-pdf-zoom-step",
+        "eaf-pdf-scroll-ratio",
+        "eaf-pdf-text-highlight-annot-color",
+        "eaf-pdf-text-underline-annot-color",
+        "eaf-pdf-inline-text-annot-color",
+        "eaf-pdf-inline-text-annot-fontsize",
+        "eaf-pdf-show-progress-on-page",
+        "eaf-pdf-marker-fontsize",
+        "eaf-pdf-click-to-copy",
+        "eaf-pdf-notify-file-changed",
+        "eaf-pdf-reflow-font-size",
+        "eaf-pdf-page-columns",
+        "eaf-pdf-raster-cache-size",
+        "eaf-pdf-render-processes"
+    ]
+
+    def __init__(self):
+        self._values = dict(zip(self.var_names, get_emacs_vars(self.var_names)))
+        self._watchers = []
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def get_vars(self, names):
+        return [self._values[name] for name in names]
+
+    def watch(self, callback):
+        self._watchers.append(callback)
+
+    def refresh(self, names=None):
+        names = [name for name in (names or self.var_names) if name in self._values]
+        if not names:
+            return
+
+        self._values.update(zip(names, get_emacs_vars(names)))
+        for callback in self._watchers:
+            callback(names)
@@ -20,21 +20,452 @@
 
 import functools
 import os
+import sys
+import threading
+from collections import OrderedDict
 import fitz
-from core.utils import PostGui, get_emacs_vars, message_to_emacs
+from core.utils import PostGui, get_emacs_config_dir, get_emacs_vars, message_to_emacs
+from eaf_pdf_annot import AnnotIndex
 from eaf_pdf_page import PdfPage
+from eaf_pdf_process_render import ProcessRenderer
+from eaf_pdf_reflow import ReflowLayout
+from eaf_pdf_links import LinkGraph
+from eaf_pdf_toc import TocModel
+from eaf_pdf_utils import get_file_fingerprint
 
-class PdfDocument(fitz.Document):
-    def __init__(self, document):
+# Process-wide registry of shared documents, key is returned by get_document_key.
+_shared_documents = {}
+
+def get_document_key(url):
+    '''
+    Canonical path and file identity, different path (symlink, relative path) of same file get same key.
+    '''
+    path = os.path.realpath(url)
+    try:
+        stat = os.stat(path)
+        return (os.path.normcase(path), stat.st_dev, stat.st_ino)
+    except OSError:
+        return (os.path.normcase(path), None, None)
+
+def acquire_shared_document(url, reflow_font_size=None, layout_cache_dir=None, raster_cache=None):
+    key = get_document_key(url)
+    shared_document = _shared_documents.get(key)
+    if shared_document is None:
+        shared_document = SharedDocument(key, url, reflow_font_size, layout_cache_dir)
+        _shared_documents[key] = shared_document
+    if raster_cache is not None:
+        shared_document.raster_cache = raster_cache
+
+    shared_document.ref_count += 1
+    return shared_document
+
+def release_shared_document(shared_document):
+    shared_document.ref_count -= 1
+    if shared_document.ref_count <= 0:
+        _shared_documents.pop(shared_document.key, None)
+        shared_document.close()
+
+def open_document(url):
+    '''
+    Open standalone fitz document for worker thread.
+    Reflowable document use same layout as shared document, so page index are same.
+    '''
+    document = fitz.open(url)
+    if document.is_reflowable:
+        shared_document = _shared_documents.get(get_document_key(url))
+        if shared_document is not None and shared_document.reflow_layout is not None:
+            document.layout(**shared_document.reflow_layout.get_layout_args())
+    return document
+
+class PageTextCache():
+    '''
+    LRU cache of page plain text, bounded by total size of cached text.
+    Text is extracted from raw fitz page, don't need build PdfPage.
+    Page of reflowable document is loaded by location, MuPDF don't lay out whole book.
+    '''
+    max_bytes = 8 * 1024 * 1024
+
+    def __init__(self, document, reflow_layout=None):
         self.document = document
+        self.reflow_layout = reflow_layout
+        self.texts = OrderedDict()
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+
+    def reset(self, document=None):
+        with self.lock:
+            if document is not None:
+                self.document = document
+            self.texts.clear()
+            self.cache_bytes = 0
+
+    def get(self, page_index):
+        with self.lock:
+            text = self.texts.get(page_index)
+            if text is not None:
+                self.texts.move_to_end(page_index)
+                return text
+
+            if self.reflow_layout is not None:
+                text = self.reflow_layout.load_page(page_index).get_text()
+            else:
+                text = self.document[page_index].get_text()
+            self.texts[page_index] = text
+            self.cache_bytes += sys.getsizeof(text)
+            while self.cache_bytes > self.max_bytes and len(self.texts) > 1:
+                _, old_text = self.texts.popitem(last=False)
+                self.cache_bytes -= sys.getsizeof(old_text)
+            return text
+
+    def get_range(self, start_index, end_index):
+        '''Return text list of pages in [start_index, end_index), stop at end of document.'''
+        texts = []
+        for page_index in range(max(start_index, 0), end_index):
+            # Page count of reflowable document is unknown before all chapters counted.
+            try:
+                texts.append(self.get(page_index))
+            except IndexError:
+                break
+        return texts
+
+
+class PageRawdictCache():
+    '''
+    LRU cache of page text geometry (rawdict) shared by PdfPage, bounded by page count.
+    Rawdict of one page is large, keep only pages around recent views.
+    '''
+    max_pages = 64
+
+    def __init__(self):
+        self.rawdicts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.rawdicts
+
+    def __getitem__(self, key):
+        with self.lock:
+            self.rawdicts.move_to_end(key)
+            return self.rawdicts[key]
+
+    def __setitem__(self, key, rawdict):
+        with self.lock:
+            self.rawdicts[key] = rawdict
+            self.rawdicts.move_to_end(key)
+            while len(self.rawdicts) > self.max_pages:
+                self.rawdicts.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.rawdicts.clear()
+
+
+class SharedDocument():
+    '''
+    fitz document, page text geometry and rendered pixmaps shared by all buffers that show same file.
+
+    Pixmap cache key is (page_index, scale, rotation, inverted, inverted_image, clip),
+    only pixmap without transient marks (search, link, hovered annot) is cached.
+    If raster_cache is set, pixmaps are saved on disk too, keyed by file fingerprint,
+    so they are loaded from disk after document reloaded or opened again.
+    '''
+    max_pixmaps = 32
+
+    def __init__(self, key, url, reflow_font_size=None, layout_cache_dir=None):
+        self.key = key
+        self.url = url
+        self.document = fitz.open(url)
+        self.reflow_layout = None
+        if self.document.is_reflowable:
+            if layout_cache_dir is None:
+                layout_cache_dir = os.path.join(get_emacs_config_dir(), "pdf", "layout")
+            self.reflow_layout = ReflowLayout(url, self.document, layout_cache_dir, reflow_font_size)
+        self.annot_index = AnnotIndex(self.document)
+        self.toc_model = TocModel(self.document)
+        self.link_graph = LinkGraph(url)
+        self.page_text_cache = PageTextCache(self.document, self.reflow_layout)
+        self.ref_count = 0
+
+        self.text_cache = PageRawdictCache()
+        self.pixmap_cache = OrderedDict()
+        self.raster_cache = None
+        self.raster_fingerprint = None
+        # Render pages in worker processes when eaf-pdf-render-processes > 0, see update_process_renderer.
+        self.process_renderer = None
+        self.process_render_page_size = None
+
+        self.reload_callbacks = []
+        self.relayout_callbacks = {}    # callback -> function that return page index to keep
+        self.page_count_callbacks = []
+        self.rendered_callbacks = []
+        self.file_changed_wacher = None
+        self.file_changed_timer = None
+
+    def get_pixmap(self, key):
+        from PyQt6.QtGui import QPixmap
+
+        qpixmap = self.pixmap_cache.get(key)
+        if qpixmap is None:
+            image = self.get_raster(key)
+            if image is None:
+                return None
+            qpixmap = QPixmap.fromImage(image)
+            self.cache_pixmap(key, qpixmap, save_raster=False)
+
+        self.pixmap_cache.move_to_end(key)
+        # QPixmap copy is implicitly shared, paint on it won't change pixmap of other buffers.
+        return QPixmap(qpixmap)
+
+    def cache_pixmap(self, key, qpixmap, save_raster=True):
+        from PyQt6.QtGui import QPixmap
+
+        self.pixmap_cache[key] = QPixmap(qpixmap)
+        self.pixmap_cache.move_to_end(key)
+        while len(self.pixmap_cache) > self.max_pixmaps:
+            self.pixmap_cache.popitem(last=False)
+
+        if save_raster and self.raster_cache is not None:
+            fingerprint = self.get_raster_fingerprint()
+            if fingerprint is not None:
+                self.raster_cache.put(fingerprint, key[0], self.get_raster_options(key), qpixmap.toImage())
+
+    def get_raster(self, key):
+        if self.raster_cache is None:
+            return None
+
+        fingerprint = self.get_raster_fingerprint()
+        if fingerprint is None:
+            return None
+        return self.raster_cache.get(fingerprint, key[0], self.get_raster_options(key))
+
+    def get_raster_fingerprint(self):
+        # File content changed after reload or annot saved, compute fingerprint again.
+        if self.raster_fingerprint is None:
+            try:
+                self.raster_fingerprint = get_file_fingerprint(self.url)
+            except OSError:
+                return None
+        return self.raster_fingerprint
+
+    def get_raster_options(self, key):
+        options = key[1:]
+        if self.reflow_layout is not None:
+            options += tuple(self.reflow_layout.get_layout_args().values())
+        return options
+
+    def remove_pixmaps(self, page_indexes=None):
+        # Pixmaps are removed after annot saved to file, rasters of old file are not used anymore.
+        self.raster_fingerprint = None
+        if page_indexes is None:
+            self.pixmap_cache.clear()
+            return
+
+        for key in list(self.pixmap_cache.keys()):
+            if key[0] in page_indexes:
+                self.pixmap_cache.pop(key)
+
+    def add_reload_callback(self, callback):
+        if callback not in self.reload_callbacks:
+            self.reload_callbacks.append(callback)
+
+    def remove_reload_callback(self, callback):
+        if callback in self.reload_callbacks:
+            self.reload_callbacks.remove(callback)
+
+    def add_relayout_callback(self, callback, get_page_index):
+        self.relayout_callbacks[callback] = get_page_index
+
+    def remove_relayout_callback(self, callback):
+        self.relayout_callbacks.pop(callback, None)
+
+    def add_rendered_callback(self, callback):
+        if callback not in self.rendered_callbacks:
+            self.rendered_callbacks.append(callback)
+
+    def remove_rendered_callback(self, callback):
+        if callback in self.rendered_callbacks:
+            self.rendered_callbacks.remove(callback)
+
+    def update_process_renderer(self, process_count, page_size):
+        '''
+        Start or stop worker processes with process_count, workers are shared by all buffers of document,
+        buffer that opened later don't drop pages that rendering for other buffers.
+        page_size is max (width, height) of pages.
+        '''
+        if self.process_renderer is not None and self.process_renderer.process_count != process_count:
+            self.process_renderer.stop()
+            self.process_renderer = None
+        if not process_count or process_count <= 0:
+            return
+
+        if self.process_renderer is None:
+            self.process_renderer = ProcessRenderer(self.url, process_count, on_rendered=self.handle_process_rendered)
+        elif page_size == self.process_render_page_size:
+            return
+        self.process_render_page_size = page_size
+        self.reset_process_renderer()
+
+    def reset_process_renderer(self):
+        '''Workers open document again, call it when document changed.'''
+        if self.process_renderer is not None:
+            self.process_renderer.reset(
+                self.process_render_page_size,
+                self.reflow_layout.get_layout_args() if self.reflow_layout is not None else None)
+
+    def handle_process_rendered(self, key):
+        # Called in result thread of worker pool, callbacks post to GUI thread themselves.
+        for callback in list(self.rendered_callbacks):
+            callback(key)
+
+    def add_page_count_callback(self, callback):
+        if callback not in self.page_count_callbacks:
+            self.page_count_callbacks.append(callback)
+
+    def remove_page_count_callback(self, callback):
+        if callback in self.page_count_callbacks:
+            self.page_count_callbacks.remove(callback)
+
+    def reset_document(self, document):
+        self.document = document
+        self.annot_index.reset(self.document)
+        self.toc_model.reset(self.document)
+        self.link_graph.reset()
+        self.reset_process_renderer()
+        self.page_text_cache.reset(self.document)
+        self.text_cache.clear()
+        self.pixmap_cache.clear()
+        self.raster_fingerprint = None
+
+    def reload_document(self, url):
+        try:
+            document = fitz.open(url)
+            if self.reflow_layout is not None:
+                self.reflow_layout.apply(document)
+            self.reset_document(document)
+
+            for callback in list(self.reload_callbacks):
+                callback(url)
+            if self.file_changed_timer is not None:
+                self.file_changed_timer.stop()
+        except Exception:
+            if os.path.exists(url) and self.file_changed_timer is not None:
+                self.file_changed_timer.start()
+                print("Failed to reload PDF file: " + url)
+
+    def watch_file(self):
+        '''
+        Refresh content with PDF file changed, one watcher for all buffers that show this file.
+        '''
+        from PyQt6.QtCore import QFileSystemWatcher
+
+        if self.file_changed_wacher is not None:
+            return
+
+        self.file_changed_wacher = QFileSystemWatcher()
+        self.file_changed_wacher.addPath(self.url)
+        self.file_changed_wacher.fileChanged.connect(self.handle_file_changed)
+
+    @PostGui()
+    def handle_file_changed(self, path):
+        '''
+        Use the QFileSystemWatcher watch file changed. If the watch file have been remove or rename,
+        this watch will auto remove.
+        '''
+        from PyQt6.QtCore import QTimer
+        if path in self.file_changed_wacher.files():
+            if self.file_changed_timer is None:
+                self.file_changed_timer = QTimer()
+                self.file_changed_timer.setInterval(500)
+                self.file_changed_timer.setSingleShot(True)
+                self.file_changed_timer.timeout.connect(functools.partial(self.reload_document, path))
+            self.file_changed_timer.start()
+
+            notify, = get_emacs_vars(["eaf-pdf-notify-file-changed"])
+            if notify:
+                message_to_emacs("Detected that {} has been changed. Refreshing buffer...".format(path))
+
+    def count_reflow_pages(self):
+        '''Count pages of reflowable document in background, update page count of buffers when finished.'''
+        if self.reflow_layout is not None:
+            self.reflow_layout.count_pages(self.handle_reflow_pages_counted)
+
+    @PostGui()
+    def handle_reflow_pages_counted(self):
+        if not self.reflow_layout.is_ready:
+            return
+        # Pages before counted chapters are not changed, buffers don't need load document again.
+        for callback in list(self.page_count_callbacks):
+            callback()
+
+    def relayout(self, font_size):
+        '''
+        Layout reflowable document with new font size,
+        relayout callback get dict that map page index of its buffer from old layout to new layout.
+        '''
+        if self.reflow_layout is None or font_size == self.reflow_layout.font_size:
+            return
+
+        # Only bookmark pages that buffers show, other pages are not laid out.
+        page_indexes = set(get_page_index() for get_page_index in self.relayout_callbacks.values())
+        page_map = self.reflow_layout.relayout(font_size, page_indexes)
+        self.reset_document(self.document)
+        for callback in list(self.relayout_callbacks):
+            callback(page_map)
+        self.count_reflow_pages()
+
+    def close(self):
+        self.reload_callbacks = []
+        self.relayout_callbacks = {}
+        self.page_count_callbacks = []
+        self.rendered_callbacks = []
+        if self.file_changed_wacher is not None:
+            self.file_changed_wacher.removePaths(self.file_changed_wacher.files())
+            self.file_changed_wacher = None
+        if self.file_changed_timer is not None:
+            self.file_changed_timer.stop()
+        self.text_cache.clear()
+        self.pixmap_cache.clear()
+        self.page_text_cache.reset()
+        # Stop building link graph.
+        self.link_graph.reset()
+        if self.process_renderer is not None:
+            self.process_renderer.stop()
+            self.process_renderer = None
+
+
+class PdfDocument(fitz.Document):
+    def __init__(self, shared_document):
+        self.shared_document = shared_document
+        self.document = shared_document.document
         self._is_trim_margin = False
         self._page_cache_dict = {}
         self._document_page_clip = None
         self._document_page_change = lambda rect: None
+        self.annot_index = shared_document.annot_index
+        self.reflow_layout = shared_document.reflow_layout
+        self.toc_model = shared_document.toc_model
+        self.link_graph = shared_document.link_graph
+        self.page_text_cache = shared_document.page_text_cache
+
+        # Private document to render transient marks when document is shared, see get_mark_page.
+        self._private_document = None
+        self._private_page_cache_dict = {}
 
     def __getattr__(self, attr):
         return getattr(self.document, attr)
 
+    @property
+    def page_count(self):
+        if self.reflow_layout is not None:
+            return self.reflow_layout.page_count
+        return self.document.page_count
+
+    def load_page(self, index):
+        if self.reflow_layout is not None:
+            return self.reflow_layout.load_page(index)
+        return self.document[index]
+
     def __getitem__(self, index):
         if index in self._page_cache_dict:
             page = self._page_cache_dict[index]
@@ -44,7 +475,8 @@ class PdfDocument(fitz.Document):
             if page.cropbox == self._document_page_clip:
                 return page
 
-        page = PdfPage(self.document[index], index, self.document.is_pdf)
+        fitz_page = self.load_page(index)
+        page = PdfPage(fitz_page, index, self.document.is_pdf, text_cache=self.shared_document.text_cache)
 
         # udpate the page clip
         new_rect_clip = self.computer_page_clip(page.get_tight_margin_rect(), self._document_page_clip)
@@ -54,7 +486,8 @@ class PdfDocument(fitz.Document):
                 self._document_page_change(new_rect_clip)
 
         if self._is_trim_margin:
-            return PdfPage(self.document[index], index, self.document.is_pdf, self._document_page_clip)
+            return PdfPage(fitz_page, index, self.document.is_pdf, self._document_page_clip,
+                           self.shared_document.text_cache)
 
         return page
 
@@ -74,59 +507,49 @@ class PdfDocument(fitz.Document):
             dr = fitz.Rect(x0, y0, x1, y1)
         return dr
 
-    def reload_document(self, url):
-        self._page_cache_dict = {}
-        try:
-            self.document = fitz.open(url)
-
-            if self.watch_callback is not None:
-                self.watch_callback(url)
-            self.file_changed_timer.stop()
-        except Exception:
-            self.watch_callback = None
-
-            if os.path.exists(url):
-                self.file_changed_timer.start()
-                print("Failed to reload PDF file: " + url)
-
     def cache_page(self, index, page):
+        if self._private_page_cache_dict.get(index) is page:
+            return
         self._page_cache_dict[index] = page
 
     def remove_cache(self, index):
-        self._page_cache_dict.pop(index)
+        self._page_cache_dict.pop(index, None)
 
     def reset_cache(self):
         self._page_cache_dict.clear()
+        self.reset_private_document()
 
-    def watch_file(self, path, callback):
+    def get_mark_page(self, index):
         '''
-        Refresh content with PDF file changed.
+        Page to render transient marks (search, link, jump tips) on.
+        Marks are annotations, use private document when other buffers share this document,
+        so marks don't show up in other buffers.
         '''
-        from PyQt6.QtCore import QFileSystemWatcher
+        if self.shared_document.ref_count <= 1:
+            return self[index]
 
-        self.watch_callback = callback
-        self.file_changed_wacher = QFileSystemWatcher()
-        self.file_changed_wacher.addPath(path)
-        self.file_changed_wacher.fileChanged.connect(self.handle_file_changed)
+        if self._private_document is None:
+            self._private_document = open_document(self.shared_document.url)
+            self._private_page_cache_dict = {}
 
-    @PostGui()
-    def handle_file_changed(self, path):
-        '''
-        Use the QFileSystemWatcher watch file changed. If the watch file have been remove or rename,
-        this watch will auto remove.
-        '''
-        from PyQt6.QtCore import QTimer
-        if path in self.file_changed_wacher.files():
-            self.file_changed_timer = QTimer()
-            self.file_changed_timer.setInterval(500)
-            self.file_changed_timer.setSingleShot(True)
-            reload_callback = functools.partial(self.reload_document, path)
-            self.file_changed_timer.timeout.connect(reload_callback)
-            self.file_changed_timer.start()
+        page = self._private_page_cache_dict.get(index)
+        if page is None:
+            page = PdfPage(self._private_document[index], index, self.is_pdf, self.get_page_clip(),
+                           self.shared_document.text_cache)
+            self._private_page_cache_dict[index] = page
+        return page
 
-            notify, = get_emacs_vars(["eaf-pdf-notify-file-changed"])
-            if notify:
-                message_to_emacs("Detected that {} has been changed. Refreshing buffer...".format(path))
+    def reset_private_document(self):
+        self._private_document = None
+        self._private_page_cache_dict = {}
+
+    def watch_file(self, callback):
+        self.shared_document.add_reload_callback(callback)
+        self.shared_document.watch_file()
+
+    def get_page_clip(self):
+        '''Page clip when trim margin, else None.'''
+        return self._document_page_clip if self._is_trim_margin else None
 
     def toggle_trim_margin(self):
         self._is_trim_margin = not self._is_trim_margin
@@ -149,7 +572,7 @@ class PdfDocument(fitz.Document):
         
     def get_all_widths_heights(self):
         heights = []
-        page_cnts = self.document.page_count
+        page_cnts = self.page_count
         if not self.document.is_pdf:
             height = self[0].clip.height
             width = self[0].clip.width
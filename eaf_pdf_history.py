@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+from contextlib import contextmanager
+
+
+def lock_file(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+def unlock_file(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+class OpenHistory():
+    '''
+    Open history of pdf files.
+
+    Open record is appended to open.log with timestamp, it's compacted to log.txt
+    (deduplicated path list, most recently opened first) when open.log is large enough.
+    Both files are accessed with file lock, multiple buffers can record at same time.
+    '''
+    compact_threshold = 16 * 1024
+
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        self.mru_file = os.path.join(history_dir, "log.txt")
+        self.append_file = os.path.join(history_dir, "open.log")
+        self.lock_file = os.path.join(history_dir, "log.lock")
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.history_dir, exist_ok=True)
+        with open(self.lock_file, "a+") as f:
+            lock_file(f)
+            try:
+                yield
+            finally:
+                unlock_file(f)
+
+    def record(self, path):
+        with self._locked():
+            with open(self.append_file, "a", encoding="utf-8") as f:
+                f.write("{}\t{}\n".format(int(time.time()), path))
+
+            if os.path.getsize(self.append_file) > self.compact_threshold:
+                self._compact()
+
+    def read(self):
+        with self._locked():
+            return self._read()
+
+    def compact(self):
+        with self._locked():
+            self._compact()
+
+    def remove_missing(self):
+        '''Remove records of files that not exist anymore, return removed paths.'''
+        with self._locked():
+            (valid_paths, removed_paths) = ([], [])
+            for path in self._read():
+                (valid_paths if os.path.exists(path) else removed_paths).append(path)
+            self._write_mru(valid_paths)
+            open(self.append_file, "w").close()
+            return removed_paths
+
+    def _read(self):
+        paths = []
+        # Newest record is at end of open.log.
+        for line in reversed(read_lines(self.append_file)):
+            timestamp, tab, path = line.partition("\t")
+            paths.append(path if tab else line)
+        paths.extend(read_lines(self.mru_file))
+
+        return list(dict.fromkeys(paths))
+
+    def _compact(self):
+        self._write_mru(self._read())
+        open(self.append_file, "w").close()
+
+    def _write_mru(self, paths):
+        temp_file = self.mru_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            for path in paths:
+                f.write(path)
+                f.write("\n")
+        os.replace(temp_file, self.mru_file)
+
+
+if __name__ == "__main__":
+    # Called by Emacs to clean history under same lock, print removed paths.
+    import sys
+
+    if len(sys.argv) == 3 and sys.argv[1] == "remove-missing":
+        for path in OpenHistory(sys.argv[2]).remove_missing():
+            print(path)
+    else:
+        print("Usage: eaf_pdf_history.py remove-missing HISTORY_DIR", file=sys.stderr)
+        sys.exit(1)
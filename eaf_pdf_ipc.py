@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from core.utils import eval_in_emacs
+from PyQt6.QtCore import QObject, QTimer
+
+
+class EmacsCallBatcher(QObject):
+    '''
+    Coalesce eval_in_emacs calls that send in every frame (e.g. position update when smooth scrolling).
+
+    post: only the latest args of same function are sent, flush at most once every flush_interval.
+    throttle: send at once, call of same function in flush_interval after that is delayed,
+    only the latest one is sent when flush_interval passed, so last call is never lost.
+    '''
+    def __init__(self, parent=None, flush_interval=50):
+        super().__init__(parent)
+        self.flush_interval = flush_interval
+        self.pending_calls = {}
+        self.last_sent_args = {}
+        self.last_sent_time = {}
+
+        self.sent_count = 0
+        self.merged_count = 0
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(flush_interval)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)    # type: ignore
+
+    def post(self, func, args, skip_unchanged=False):
+        if func in self.pending_calls:
+            self.merged_count += 1
+        self.pending_calls[func] = (args, skip_unchanged)
+
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(self.flush_interval)
+
+    def throttle(self, func, args):
+        elapsed = (time.time() - self.last_sent_time.get(func, 0)) * 1000
+        if elapsed < self.flush_interval:
+            if func in self.pending_calls:
+                self.merged_count += 1
+            self.pending_calls[func] = (args, False)
+            if not self.flush_timer.isActive():
+                self.flush_timer.start(int(self.flush_interval - elapsed) + 1)
+            return
+
+        self.pending_calls.pop(func, None)
+        self.send(func, args)
+
+    def send(self, func, args):
+        eval_in_emacs(func, args)
+        self.last_sent_args[func] = args
+        self.last_sent_time[func] = time.time()
+        self.sent_count += 1
+
+    def flush(self):
+        pending_calls, self.pending_calls = self.pending_calls, {}
+        for func, (args, skip_unchanged) in pending_calls.items():
+            if skip_unchanged and self.last_sent_args.get(func) == args:
+                self.merged_count += 1
+                continue
+            self.send(func, args)
+
+    def get_stats(self):
+        return "Emacs calls sent: {}, merged: {}".format(self.sent_count, self.merged_count)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_right
+
+
+class PageLayout():
+    '''
+    Geometry of continuous scroll with several pages in a row, e.g. two columns for spread view.
+
+    Input page sizes are PDF points, output coordinates are render pixels at scale:
+    y is offset from top of document, x is offset from left of row.
+    Pages in row are top aligned and separated by padding, rows are separated by padding too.
+    '''
+    def __init__(self, page_widths, page_heights, columns, scale, padding):
+        self.page_count = len(page_heights)
+        self.columns = max(1, columns)
+        self.scale = scale
+        self.padding = padding
+
+        self.page_xs = []
+        self.page_render_widths = [width * scale for width in page_widths]
+        self.page_render_heights = [height * scale for height in page_heights]
+        self.row_widths = []
+        self.row_heights = []
+        self.row_tops = []
+
+        top = 0
+        for first_index in range(0, self.page_count, self.columns):
+            x = 0
+            row_height = 0
+            for index in range(first_index, min(first_index + self.columns, self.page_count)):
+                if index > first_index:
+                    x += padding
+                self.page_xs.append(x)
+                x += self.page_render_widths[index]
+                row_height = max(row_height, self.page_render_heights[index])
+            self.row_tops.append(top)
+            self.row_widths.append(x)
+            self.row_heights.append(row_height)
+            top += row_height + padding
+
+        self.max_row_width = max(self.row_widths, default=0)
+
+    def total_height(self):
+        '''Height of all rows, without padding after last row.'''
+        if not self.row_tops:
+            return 0
+        return self.row_tops[-1] + self.row_heights[-1]
+
+    def row_of_page(self, page_index):
+        return page_index // self.columns
+
+    def row_at(self, y):
+        '''Return row index at offset y, padding after row belongs to row.'''
+        return max(0, min(bisect_right(self.row_tops, y) - 1, len(self.row_tops) - 1))
+
+    def row_pages(self, row):
+        first_index = row * self.columns
+        return range(first_index, min(first_index + self.columns, self.page_count))
+
+    def page_top(self, page_index):
+        return self.row_tops[self.row_of_page(page_index)]
+
+    def page_x(self, page_index):
+        return self.page_xs[page_index]
+
+    def visible_pages(self, top, height):
+        '''Return range of page index in rows between offset top and top + height.'''
+        if not self.row_tops:
+            return range(0)
+        first_row = self.row_at(top)
+        last_row = self.row_at(top + height)
+        return range(first_row * self.columns, self.row_pages(last_row).stop)
+
+    def page_at(self, x, y):
+        '''
+        Return (page_index, x, y) of point in row coordinates, x and y are relative to page top-left.
+        Return None if point is on padding or outside pages.
+        '''
+        if not self.row_tops:
+            return None
+        row = self.row_at(y)
+        page_y = y - self.row_tops[row]
+        for index in self.row_pages(row):
+            page_x = x - self.page_xs[index]
+            if 0 <= page_x <= self.page_render_widths[index] and page_y <= self.page_render_heights[index]:
+                return index, page_x, page_y
+        return None
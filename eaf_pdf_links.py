@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import fitz
+
+
+class LinkGraph():
+    '''
+    Internal links of whole document, built in a worker thread with standalone document.
+    It's shared by all buffers that show same file, see SharedDocument.
+
+    links: page_index -> list of (from_rect, target_page, target_point)
+    back_refs: target_page -> list of (source_page, from_rect), answer "what links here".
+    '''
+    def __init__(self, url):
+        self.url = url
+        self.links = {}
+        self.back_refs = {}
+        self.is_ready = False
+
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.thread = None
+
+    def build(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._build, args=(self.generation,), daemon=True)
+            self.thread.start()
+
+    def reset(self):
+        '''
+        Drop graph and build it again, call it when document changed.
+        '''
+        with self.lock:
+            self.generation += 1
+            self.links = {}
+            self.back_refs = {}
+            self.is_ready = False
+            self.thread = None
+
+    def _build(self, generation):
+        links = {}
+        back_refs = {}
+        try:
+            # Import here, eaf_pdf_document import this module.
+            from eaf_pdf_document import open_document
+
+            # fitz document is not thread safe, use standalone document.
+            document = open_document(self.url)
+            for page_index in range(document.page_count):
+                if generation != self.generation:
+                    return
+
+                for link in document[page_index].get_links():
+                    target_page = link.get("page", -1)
+                    if link.get("kind") not in (fitz.LINK_GOTO, fitz.LINK_NAMED) or target_page is None or target_page < 0:
+                        continue
+
+                    from_rect = tuple(link["from"])
+                    target_point = tuple(link["to"]) if link.get("to") is not None else None
+                    links.setdefault(page_index, []).append((from_rect, target_page, target_point))
+                    back_refs.setdefault(target_page, []).append((page_index, from_rect))
+            document.close()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            return
+
+        with self.lock:
+            if generation == self.generation:
+                self.links = links
+                self.back_refs = back_refs
+                self.is_ready = True
+
+    def get_links(self, page_index):
+        return self.links.get(page_index, [])
+
+    def get_back_references(self, page_index):
+        '''
+        Return sorted source pages that link to page_index, empty list if graph is not ready.
+        '''
+        return sorted(set(source_page for source_page, from_rect in self.back_refs.get(page_index, [])))
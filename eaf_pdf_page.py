@@ -19,10 +19,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import bisect
+from array import array
+
 import fitz
 fitz.TOOLS.unset_quad_corrections(True)
-from core.utils import get_emacs_vars
-from eaf_pdf_utils import generate_random_key, support_hit_max
+from eaf_pdf_utils import support_hit_max
 from PyQt6.QtCore import QRect, QRectF
 from PyQt6.QtGui import QColor, QCursor, QImage, QPainter, QPixmap
 from PyQt6.QtWidgets import QToolTip
@@ -70,22 +72,43 @@ def get_page_image_bbox(page):
     else:
         return page.getImageBbox
 
+def write_select_text(get_page, select_ranges, output):
+    '''
+    Write text of select_ranges, list of (page_index, start, end), to file-like output.
+    Text is written line by line, never build whole selection in memory.
+    '''
+    is_first_line = True
+    for page_index, start, end in select_ranges:
+        for text in get_page(page_index).iter_range_line_texts(start, end):
+            if not is_first_line:
+                output.write("\n")
+            output.write(text)
+            is_first_line = False
+
 class PdfPage(fitz.Page):
-    def __init__(self, page, page_index, is_pdf, clip=None):
+    def __init__(self, page, page_index, is_pdf, clip=None, text_cache=None):
         self.page = page
         self.page_index = page_index
         self.is_pdf = is_pdf
         self.clip = clip or page.cropbox
+        # Text rawdict shared by buffers that show same document.
+        self.text_cache = text_cache
 
         self._mark_link_annot_list = []
         self._mark_search_annot_list = []
-        self._mark_jump_annot_list = []
         self._links = None
         self._annots = None
 
-        self._page_rawdict = self._init_page_rawdict()
+        # Text rawdict and tight margin are computed when first used,
+        # page that only need render (e.g. render in background) don't pay for them.
+        self._page_rawdict_cache = None
         # self._page_char_rect_list = self._init_page_char_rect_list()
-        self._tight_margin_rect = self._init_tight_margin()
+        self._tight_margin_rect_cache = None
+        self._line_list = None
+        self._line_key_list = None
+        self._word_texts = None
+        self._word_boxes = None
+        self._word_grid = None
         
         self.hierarchy = ["", "blocks", "lines", "spans", "chars"]
         
@@ -94,6 +117,24 @@ class PdfPage(fitz.Page):
     def __getattr__(self, attr):
         return getattr(self.page, attr)
 
+    @property
+    def _page_rawdict(self):
+        if self._page_rawdict_cache is None:
+            if self.text_cache is None:
+                self._page_rawdict_cache = self._init_page_rawdict()
+            else:
+                key = (self.page_index, tuple(self.clip), self.page.rotation)
+                if key not in self.text_cache:
+                    self.text_cache[key] = self._init_page_rawdict()
+                self._page_rawdict_cache = self.text_cache[key]
+        return self._page_rawdict_cache
+
+    @property
+    def _tight_margin_rect(self):
+        if self._tight_margin_rect_cache is None:
+            self._tight_margin_rect_cache = self._init_tight_margin()
+        return self._tight_margin_rect_cache
+
     def _init_page_rawdict(self):
         if self.is_pdf:
             try:
@@ -281,6 +322,150 @@ class PdfPage(fitz.Page):
         if child_name in structs[end_idx]:
             self._get_obj_from_range(structs[end_idx][child_name], [0] * remain_level, end[1:], collections)
     
+    def _init_line_list(self):
+        '''Text lines in rawdict order, item is ((block_index, line_index), line).'''
+        self._line_list = []
+        for block_index, block in enumerate(self._page_rawdict["blocks"]):
+            for line_index, line in enumerate(block.get("lines", [])):
+                self._line_list.append(((block_index, line_index), line))
+        self._line_key_list = [key for key, line in self._line_list]
+
+    word_grid_size = 32
+
+    def _init_word_index(self):
+        '''
+        Words split by whitespace from text lines, box of word i is _word_boxes[4*i : 4*i+4].
+        _word_grid map grid cell to word indexes, find word at point only check words near it.
+        '''
+        if self._line_list is None:
+            self._init_line_list()
+
+        self._word_texts = []
+        self._word_boxes = array("d")
+        self._word_grid = {}
+
+        def add_word(chars):
+            word_index = len(self._word_texts)
+            x0 = min(char["bbox"][0] for char in chars)
+            y0 = min(char["bbox"][1] for char in chars)
+            x1 = max(char["bbox"][2] for char in chars)
+            y1 = max(char["bbox"][3] for char in chars)
+            self._word_texts.append("".join(char["c"] for char in chars))
+            self._word_boxes.extend((x0, y0, x1, y1))
+
+            size = self.word_grid_size
+            for cx in range(int(x0 // size), int(x1 // size) + 1):
+                for cy in range(int(y0 // size), int(y1 // size) + 1):
+                    self._word_grid.setdefault((cx, cy), []).append(word_index)
+
+        for key, line in self._line_list:
+            chars = []
+            for span in line["spans"]:
+                for char in span["chars"]:
+                    if char["c"].isspace():
+                        if chars:
+                            add_word(chars)
+                        chars = []
+                    else:
+                        chars.append(char)
+            if chars:
+                add_word(chars)
+
+    def get_word_at_point(self, x, y, offset=10):
+        '''Return first word intersect with rect (x, y, x + offset, y + offset), None if not found.'''
+        if self._word_grid is None:
+            self._init_word_index()
+
+        rect = (x, y, x + offset, y + offset)
+        size = self.word_grid_size
+        word_indexes = set()
+        for cx in range(int(rect[0] // size), int(rect[2] // size) + 1):
+            for cy in range(int(rect[1] // size), int(rect[3] // size) + 1):
+                word_indexes.update(self._word_grid.get((cx, cy), []))
+
+        for word_index in sorted(word_indexes):
+            if self._is_intersects(self._word_boxes[4 * word_index : 4 * word_index + 4], rect):
+                return self._word_texts[word_index]
+        return None
+
+    def _iter_range_lines(self, start, end):
+        '''
+        Yield (line, chars) of lines between start and end, which are 4-tuple like get_obj_from_range.
+        chars is None when whole line is selected, else list of selected chars.
+        '''
+        if self._line_list is None:
+            self._init_line_list()
+        if not self._line_list:
+            return
+
+        if -1 in start:
+            start, end = end, start
+        start = tuple(start)
+        end = None if -1 in end else tuple(end)
+
+        first = bisect.bisect_left(self._line_key_list, start[:2])
+        last = len(self._line_list) if end is None else bisect.bisect_right(self._line_key_list, end[:2])
+
+        for index in range(first, last):
+            key, line = self._line_list[index]
+            is_start_line = key == start[:2]
+            is_end_line = end is not None and key == end[:2]
+            if not is_start_line and not is_end_line:
+                yield line, None
+                continue
+
+            chars = []
+            for span_index, span in enumerate(line["spans"]):
+                for char_index, char in enumerate(span["chars"]):
+                    if is_start_line and (span_index, char_index) < start[2:]:
+                        continue
+                    if is_end_line and (span_index, char_index) > end[2:]:
+                        continue
+                    chars.append(char)
+            yield line, chars
+
+    def iter_range_line_texts(self, start, end):
+        '''Yield text of lines between start and end.'''
+        for line, chars in self._iter_range_lines(start, end):
+            if chars is None:
+                yield "".join(char["c"] for span in line["spans"] for char in span["chars"])
+            elif chars:
+                yield "".join(char["c"] for char in chars)
+
+    def get_range_line_rects(self, start, end):
+        '''
+        Return rects of visual lines between start and end.
+        Lines fully selected use line bbox, only first and last line walk chars,
+        so dragging selection just pay for changed lines.
+        '''
+        bbox_list = []
+        for line, chars in self._iter_range_lines(start, end):
+            if chars is None:
+                bbox_list.append(line["bbox"])
+            elif chars:
+                bbox_list.append((min(c["bbox"][0] for c in chars), min(c["bbox"][1] for c in chars),
+                                  max(c["bbox"][2] for c in chars), max(c["bbox"][3] for c in chars)))
+
+        if not bbox_list:
+            return []
+
+        # Merge lines at same height to one visual line.
+        rectify = lambda x0, y0, x1, y1: fitz.Rect(x0-1, y0-1, x1+1, y1+1)
+        line_rect_list = []
+        line_x0, line_y0, line_x1, line_y1 = bbox_list[0]
+        for x0, y0, x1, y1 in bbox_list[1:]:
+            if abs(y0-line_y0) < 3 or abs(y1-line_y1) < 3 or \
+                abs((y0+y1) / 2 - (line_y0 + line_y1)/2) < 3:
+                line_x0 = min(line_x0, x0)
+                line_y0 = min(line_y0, y0)
+                line_x1 = max(line_x1, x1)
+                line_y1 = max(line_y1, y1)
+            else:
+                line_rect_list.append(rectify(line_x0, line_y0, line_x1, line_y1))
+                line_x0, line_y0, line_x1, line_y1 = x0, y0, x1, y1
+        line_rect_list.append(rectify(line_x0, line_y0, line_x1, line_y1))
+        return line_rect_list
+
     def parse_obj_list(self, obj_list):
         """
         obj_list is a list of objects in the page rawdict.
@@ -327,6 +512,24 @@ class PdfPage(fitz.Page):
             self.page_height = self.page.cropbox.height
 
     def get_qpixmap(self, scale, invert, invert_image=False):
+        qpixmap = QPixmap.fromImage(self.get_qimage(scale, invert, invert_image))
+
+        if self.get_annots():
+            qpixmap = self.draw_annots(qpixmap, scale)
+
+        return qpixmap
+
+    def get_qimage(self, scale, invert, invert_image=False):
+        '''
+        Render page to QImage, it don't touch QPixmap, so it can be called in non-GUI thread.
+        '''
+        pixmap = self.render_pixmap(scale, invert, invert_image)
+        return QImage(pixmap.samples, pixmap.width, pixmap.height, pixmap.stride, QImage.Format.Format_RGBA8888)
+
+    def render_pixmap(self, scale, invert, invert_image=False):
+        '''
+        Render page to fitz pixmap with RGBA samples, e.g. for copy samples to shared memory.
+        '''
         if self.is_pdf:
             try:
                 set_page_crop_box(self.page)(self.clip)
@@ -348,13 +551,7 @@ class PdfPage(fitz.Page):
         if not invert_image and invert:
             pixmap = self.with_invert_exclude_image(scale, pixmap)
 
-        img = QImage(pixmap.samples, pixmap.width, pixmap.height, pixmap.stride, QImage.Format.Format_RGBA8888)
-        qpixmap = QPixmap.fromImage(img)
-
-        if self.get_annots():
-            qpixmap = self.draw_annots(qpixmap, scale)
-
-        return qpixmap
+        return pixmap
 
     def draw_annots(self, pixmap, scale):
         if self.hovered_annot is None:
@@ -504,29 +701,6 @@ class PdfPage(fitz.Page):
         self._mark_search_annot_list.clear()
         self._annots = None
 
-    def mark_jump_link_tips(self, letters):
-        fontsize, = get_emacs_vars(["eaf-pdf-marker-fontsize"])
-        cache_dict = {}
-        if self.page.first_link:
-            links = self.page.get_links()
-            key_list = generate_random_key(len(links), letters)
-            for index, link in enumerate(links):
-                key = key_list[index]
-                link_rect = link["from"]
-                annot_rect = fitz.Rect(link_rect.top_left, link_rect.x0 + fontsize/1.2 * len(key), link_rect.y0 + fontsize)
-                annot = self.page.add_freetext_annot(annot_rect, str(key), fontsize=fontsize, fontname="Helv", \
-                                                     text_color=[0.0, 0.0, 0.0], fill_color=[255/255.0, 197/255.0, 36/255.0], \
-                                                     align = 1)
-                annot.parent = self.page
-                self._mark_jump_annot_list.append(annot)
-                cache_dict[key] = link
-        return cache_dict
-
-    def cleanup_jump_link_tips(self):
-        for annot in self._mark_jump_annot_list:
-            self.page.delete_annot(annot)
-        self._mark_jump_annot_list = []
-
     def get_links(self):
         if self._links is None:
             self._links = self.page.get_links()
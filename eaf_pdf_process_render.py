@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import fitz
+from PyQt6 import sip
+from PyQt6.QtGui import QImage
+
+# State of worker process, document is opened again when generation changed.
+_worker_url = None
+_worker_document = None
+_worker_generation = -1
+# Shared memory slots attached in worker process, key is slot index.
+_worker_memories = {}
+
+def _init_worker(url, ready_count):
+    global _worker_url
+    _worker_url = url
+    # Import page module before ready, first render don't pay for it.
+    import eaf_pdf_page
+    with ready_count.get_lock():
+        ready_count.value += 1
+
+def _get_worker_document(generation, layout_args):
+    global _worker_document, _worker_generation
+    if _worker_document is None or _worker_generation != generation:
+        _worker_document = fitz.open(_worker_url)
+        if layout_args is not None:
+            _worker_document.layout(**layout_args)
+        _worker_generation = generation
+    return _worker_document
+
+def _attach_slot(slot_index, slot_name):
+    memory = _worker_memories.get(slot_index)
+    if memory is None or memory.name != slot_name:
+        # GUI replaced slot with bigger one, unmap old slot.
+        if memory is not None:
+            memory.close()
+        memory = shared_memory.SharedMemory(name=slot_name)
+        _worker_memories[slot_index] = memory
+    return memory
+
+def _render_to_slot(slot_index, slot_name, slot_size, key, generation, layout_args):
+    '''
+    Render page of key and copy samples to shared memory slot.
+    Return (width, height, stride, size), samples are not copied if size is bigger than slot_size.
+    '''
+    from eaf_pdf_page import PdfPage
+
+    (page_index, scale, rotation, invert, invert_image, clip) = key
+    document = _get_worker_document(generation, layout_args)
+    page = PdfPage(document[page_index], page_index, document.is_pdf, fitz.Rect(clip) if clip is not None else None)
+    if document.is_pdf:
+        page.set_rotation(rotation)
+    pixmap = page.render_pixmap(scale, invert, invert_image)
+
+    size = pixmap.stride * pixmap.height
+    if size <= slot_size:
+        _attach_slot(slot_index, slot_name).buf[:size] = pixmap.samples_mv
+    return pixmap.width, pixmap.height, pixmap.stride, size
+
+
+class ProcessRenderer():
+    '''
+    Render pages in worker processes, not limited by GIL and fitz thread safety.
+
+    Every worker open standalone document, samples are copied to shared memory slot that created by GUI process,
+    take(key) return QImage that refer to slot memory, no copy between processes.
+    Number of slots is bounded, a slot is used by rendering page or rendered image that is not released,
+    oldest rendered image that is not taken is dropped when a new page need slot.
+    Render key is (page_index, scale, rotation, inverted, inverted_image, clip),
+    on_rendered(key) is called in result thread of pool.
+    '''
+    def __init__(self, url, process_count=None, slot_count=None, on_rendered=None):
+        import multiprocessing
+
+        self.url = url
+        self.on_rendered = on_rendered
+        self.process_count = max(1, process_count or os.cpu_count() or 1)
+        self.slot_count = max(self.process_count, slot_count or self.process_count * 2)
+
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()    # key -> True
+        self.rendering = {}             # key -> (slot index, generation)
+        self.images = OrderedDict()     # key -> (slot index, width, height, stride)
+        self.taken = {}                 # key -> slot index
+        self.failed_keys = set()        # keys failed to render, not requested again before reset
+        self.free_slots = list(range(self.slot_count))
+        self.memories = [None] * self.slot_count
+        self.slot_size = 0
+        self.page_size = None
+        self.layout_args = None
+        self.generation = 0
+        self.is_stopped = False
+
+        # Spawn worker, fork is not safe with MuPDF and Qt state of parent.
+        context = multiprocessing.get_context("spawn")
+        self.ready_count = context.Value("i", 0)
+        self.pool = context.Pool(self.process_count, initializer=_init_worker, initargs=(url, self.ready_count))
+
+    def is_ready(self):
+        '''Return True when all worker processes started.'''
+        return self.ready_count.value >= self.process_count
+
+    def wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        while not self.is_ready() and time.time() < deadline:
+            time.sleep(0.01)
+        return self.is_ready()
+
+    def reset(self, page_size=None, layout_args=None):
+        '''
+        Drop pending requests and rendered images, workers open document again.
+        Call it when document changed, page_size is max (width, height) of pages to allocate slot before render,
+        layout_args is layout of reflowable document.
+        '''
+        with self.condition:
+            self.generation += 1
+            self.page_size = page_size
+            self.layout_args = layout_args
+            self.pending.clear()
+            for (slot_index, _, _, _) in self.images.values():
+                self.free_slots.append(slot_index)
+            self.images.clear()
+            self.failed_keys.clear()
+            self.condition.notify_all()
+
+    def request(self, indexes, scale, rotation, invert, invert_image=False, clip=None, replace=True):
+        '''
+        Request render pages, pending requests that not start yet are superseded if replace is True.
+        '''
+        keys = [(index, scale, rotation, invert, invert_image, clip) for index in indexes]
+        with self.condition:
+            if replace:
+                self.pending.clear()
+            for key in keys:
+                # Page rendering with document before reset is rendered again.
+                if (key not in self.images and not self._is_rendering(key) and key not in self.taken and
+                    key not in self.failed_keys):
+                    self.pending[key] = True
+            self._dispatch()
+        return keys
+
+    def wait(self, keys, timeout):
+        '''
+        Wait keys rendered, return False if timeout.
+        '''
+        deadline = time.time() + timeout
+        with self.condition:
+            while any(key in self.pending or self._is_rendering(key) for key in keys):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def is_failed(self, key):
+        with self.condition:
+            return key in self.failed_keys
+
+    def take(self, key):
+        '''
+        Return QImage of key that refer to slot memory, None if it's not rendered.
+        Call release(key) after image is converted to QPixmap or saved, image is invalid after that.
+        '''
+        with self.condition:
+            item = self.images.pop(key, None)
+            if item is None:
+                return None
+            slot_index, width, height, stride = item
+            self.taken[key] = slot_index
+            memory = self.memories[slot_index]
+        return QImage(sip.voidptr(memory.buf), width, height, stride, QImage.Format.Format_RGBA8888)
+
+    def release(self, key):
+        with self.condition:
+            slot_index = self.taken.pop(key, None)
+            if slot_index is not None:
+                self.free_slots.append(slot_index)
+                self._dispatch()
+
+    def stop(self):
+        with self.condition:
+            self.is_stopped = True
+            self.pending.clear()
+            self.images.clear()
+            self.condition.notify_all()
+        self.pool.terminate()
+        for memory in self.memories:
+            if memory is not None:
+                self._close_memory(memory)
+        self.memories = [None] * self.slot_count
+
+    def _is_rendering(self, key):
+        # Called with condition locked.
+        item = self.rendering.get(key)
+        return item is not None and item[1] == self.generation
+
+    def _pop_rendering(self, key, generation):
+        # Called with condition locked, newer render of same key is kept.
+        item = self.rendering.get(key)
+        if item is not None and item[1] == generation:
+            self.rendering.pop(key)
+
+    def _get_free_slot(self):
+        if self.free_slots:
+            return self.free_slots.pop()
+        if self.images:
+            _, (slot_index, _, _, _) = self.images.popitem(last=False)
+            return slot_index
+        return None
+
+    def _get_slot_size(self, scale):
+        if self.page_size is None:
+            return self.slot_size
+        # Rendered pixmap is page size * scale rounded out, RGBA is 4 bytes.
+        width, height = self.page_size
+        return max(self.slot_size, (math.ceil(width * scale) + 2) * (math.ceil(height * scale) + 2) * 4)
+
+    def _get_slot_memory(self, slot_index, size):
+        memory = self.memories[slot_index]
+        if memory is None or memory.size < size:
+            if memory is not None:
+                self._close_memory(memory)
+            memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self.memories[slot_index] = memory
+        return memory
+
+    def _close_memory(self, memory):
+        try:
+            memory.close()
+        except BufferError:
+            pass
+        try:
+            memory.unlink()
+        except OSError:
+            pass
+
+    def _dispatch(self):
+        # Called with condition locked.
+        while self.pending and not self.is_stopped:
+            slot_index = self._get_free_slot()
+            if slot_index is None:
+                return
+
+            key, _ = self.pending.popitem(last=False)
+            memory = self._get_slot_memory(slot_index, self._get_slot_size(key[1]))
+            self.rendering[key] = (slot_index, self.generation)
+            self.pool.apply_async(
+                _render_to_slot,
+                (slot_index, memory.name, memory.size, key, self.generation, self.layout_args),
+                callback=functools.partial(self._handle_rendered, key, slot_index, self.generation),
+                error_callback=functools.partial(self._handle_render_error, key, slot_index, self.generation))
+
+    def _handle_rendered(self, key, slot_index, generation, result):
+        width, height, stride, size = result
+        is_valid = False
+        with self.condition:
+            self._pop_rendering(key, generation)
+            if self.is_stopped or generation != self.generation:
+                self.free_slots.append(slot_index)
+            elif size > self.memories[slot_index].size:
+                # Slot is smaller than page, render again with bigger slot.
+                self.slot_size = max(self.slot_size, size)
+                self.free_slots.append(slot_index)
+                self.pending[key] = True
+                self.pending.move_to_end(key, last=False)
+            else:
+                self.images[key] = (slot_index, width, height, stride)
+                is_valid = True
+            self._dispatch()
+            self.condition.notify_all()
+
+        if is_valid and self.on_rendered is not None:
+            self.on_rendered(key)
+
+    def _handle_render_error(self, key, slot_index, generation, error):
+        print("Failed to render page {} in worker process: {}".format(key[0], error))
+        with self.condition:
+            self._pop_rendering(key, generation)
+            if generation == self.generation:
+                self.failed_keys.add(key)
+            self.free_slots.append(slot_index)
+            self._dispatch()
+            self.condition.notify_all()
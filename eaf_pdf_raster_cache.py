@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from PyQt6.QtGui import QImage
+
+# Process-wide raster caches, key is cache directory.
+_raster_caches = {}
+
+def get_raster_cache(cache_dir, max_bytes):
+    '''
+    Return raster cache of cache_dir shared by all buffers, return None if max_bytes is 0.
+    '''
+    if max_bytes <= 0:
+        return None
+
+    raster_cache = _raster_caches.get(cache_dir)
+    if raster_cache is None:
+        raster_cache = RasterCache(cache_dir, max_bytes)
+        _raster_caches[cache_dir] = raster_cache
+    else:
+        raster_cache.set_max_bytes(max_bytes)
+    return raster_cache
+
+
+class RasterCache():
+    '''
+    Disk cache of rendered page images, second level of pixmap cache in SharedDocument.
+
+    Image is saved as raw rows after a small header, load it don't need decode.
+    File name is "<file fingerprint>-<page index>-<hash of render options>.raster",
+    file mtime is last used time, least recently used files are removed when total size over max_bytes.
+    Files are written and removed in worker thread, GUI thread only read file when page is not in memory.
+    '''
+    header = struct.Struct("<4sIIII")
+    magic = b"EAFR"
+    suffix = ".raster"
+    max_pending = 8
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        # File name to size, oldest first, scanned in worker thread before first write.
+        self.files = None
+        self.total_bytes = 0
+        self.thread = None
+
+    def set_max_bytes(self, max_bytes):
+        with self.condition:
+            if max_bytes != self.max_bytes:
+                self.max_bytes = max_bytes
+                self._start_worker()
+                self.condition.notify_all()
+
+    def get_file_name(self, fingerprint, page_index, options):
+        options_hash = hashlib.sha1(repr(options).encode()).hexdigest()[:16]
+        return "{}-{}-{}{}".format(fingerprint, page_index, options_hash, self.suffix)
+
+    def get(self, fingerprint, page_index, options):
+        '''
+        Return QImage of page rendered with options, None if it's not cached.
+        '''
+        name = self.get_file_name(fingerprint, page_index, options)
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, "rb") as f:
+                magic, width, height, stride, image_format = self.header.unpack(f.read(self.header.size))
+                data = f.read()
+            # Touch file, it's used recently.
+            os.utime(path)
+        except (OSError, struct.error):
+            return None
+
+        if magic != self.magic or len(data) != stride * height:
+            return None
+
+        with self.condition:
+            if self.files is not None and name in self.files:
+                self.files.move_to_end(name)
+
+        # QImage keep reference of data, don't need copy.
+        return QImage(data, width, height, stride, QImage.Format(image_format))
+
+    def put(self, fingerprint, page_index, options, image):
+        '''
+        Save image in worker thread, oldest pending images are dropped when disk is slower than render.
+        '''
+        name = self.get_file_name(fingerprint, page_index, options)
+        with self.condition:
+            self.pending[name] = image
+            self.pending.move_to_end(name)
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+            self._start_worker()
+            self.condition.notify_all()
+
+    def _start_worker(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        self._scan_files()
+
+        while True:
+            with self.condition:
+                while not self.pending and self.total_bytes <= self.max_bytes:
+                    self.condition.wait()
+                item = self.pending.popitem(last=False) if self.pending else None
+
+            if item is not None:
+                try:
+                    self._write(*item)
+                except OSError:
+                    import traceback
+                    traceback.print_exc()
+
+            self._evict()
+
+    def _scan_files(self):
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self.suffix):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        except OSError:
+            pass
+
+        with self.condition:
+            self.files = OrderedDict((name, size) for (_, name, size) in sorted(files))
+            self.total_bytes = sum(self.files.values())
+
+    def _write(self, name, image):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, name)
+        # Write to temp file first, other Emacs may read cache at same time.
+        temp_file = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_file, "wb") as f:
+            f.write(self.header.pack(self.magic, image.width(), image.height(), image.bytesPerLine(),
+                                     image.format().value))
+            f.write(image.constBits().asstring(image.sizeInBytes()))
+        os.replace(temp_file, path)
+
+        size = self.header.size + image.sizeInBytes()
+        with self.condition:
+            self.total_bytes += size - self.files.pop(name, 0)
+            self.files[name] = size
+
+    def _evict(self):
+        while True:
+            with self.condition:
+                if self.total_bytes <= self.max_bytes or not self.files:
+                    return
+                name, size = self.files.popitem(last=False)
+                self.total_bytes -= size
+
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
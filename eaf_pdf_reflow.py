@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import threading
+from bisect import bisect_right
+from itertools import accumulate
+
+import fitz
+
+from eaf_pdf_utils import get_file_fingerprint
+
+# Same page size as MuPDF default layout, reflowed page look same as before.
+REFLOW_PAGE_WIDTH = 400
+REFLOW_PAGE_HEIGHT = 600
+REFLOW_FONT_SIZE = 11
+
+
+class ReflowLayout():
+    '''
+    Page layout of reflowable document (EPUB, MOBI, FB2...), map page index to (chapter, page) location.
+
+    MuPDF lays out whole book when page count or page index is used, so chapter page counts
+    are counted in worker thread and saved in cache_dir, keyed by (file fingerprint, width, height, font size).
+    Before counting finished, only chapters counted in GUI thread are known,
+    first chapter is enough to show first page.
+    '''
+    def __init__(self, url, document, cache_dir, font_size=None):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.width = REFLOW_PAGE_WIDTH
+        self.height = REFLOW_PAGE_HEIGHT
+        self.font_size = font_size or REFLOW_FONT_SIZE
+
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.thread = None
+        self.apply(document)
+
+    def get_layout_args(self):
+        return dict(width=self.width, height=self.height, fontsize=self.font_size)
+
+    def apply(self, document):
+        '''
+        Layout document with current size, and load chapter page counts from cache if exists.
+        Call it when document opened again or layout changed.
+        '''
+        document.layout(**self.get_layout_args())
+        counts = self._load_cache(document.chapter_count)
+        with self.lock:
+            self.generation += 1
+            self.thread = None
+            self.document = document
+            self.chapter_count = document.chapter_count
+            self.is_ready = counts is not None
+            self._set_counts(counts or [])
+            if not self.is_ready:
+                self._count_until(lambda: self.page_count > 0)
+
+    @property
+    def page_count(self):
+        return self._chapter_starts[-1]
+
+    def _set_counts(self, counts):
+        self.chapter_page_counts = counts
+        self._chapter_starts = [0] + list(accumulate(counts))
+
+    def _count_until(self, is_done):
+        '''Count chapters in GUI document until is_done return True or all chapters counted.'''
+        counts = list(self.chapter_page_counts)
+        while not is_done() and len(counts) < self.chapter_count:
+            counts.append(self.document.chapter_page_count(len(counts)))
+            self._set_counts(counts)
+
+    def location_from_page_number(self, page_index):
+        with self.lock:
+            self._count_until(lambda: page_index < self.page_count)
+            chapter = bisect_right(self._chapter_starts, page_index) - 1
+            if chapter >= len(self.chapter_page_counts):
+                raise IndexError("page {} not in document".format(page_index))
+            return (chapter, page_index - self._chapter_starts[chapter])
+
+    def page_number_from_location(self, location):
+        chapter, page = location
+        with self.lock:
+            self._count_until(lambda: chapter < len(self.chapter_page_counts))
+            return self._chapter_starts[min(chapter, len(self.chapter_page_counts) - 1)] + page
+
+    def load_page(self, page_index):
+        '''Load page by location, only chapters before page_index need layout.'''
+        return self.document.load_page(self.location_from_page_number(page_index))
+
+    def relayout(self, font_size, page_indexes):
+        '''
+        Layout document with new font size.
+        Return dict that map page index in page_indexes of old layout to page index that show same text in new layout,
+        only chapters before these pages need layout.
+        '''
+        # MuPDF bookmark is text position in chapter, still valid after document layout changed.
+        bookmarks = {}
+        for page_index in page_indexes:
+            try:
+                bookmarks[page_index] = self.document.make_bookmark(self.location_from_page_number(page_index))
+            except IndexError:
+                pass
+        self.font_size = font_size
+        self.apply(self.document)
+
+        return {page_index: self.page_number_from_location(self.document.find_bookmark(bookmark))
+                for (page_index, bookmark) in bookmarks.items()}
+
+    def count_pages(self, callback):
+        '''
+        Count pages of all chapters in worker thread, callback is called when counting finished,
+        also when counting failed, is_ready is still False then.
+        '''
+        with self.lock:
+            if self.is_ready or self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._count_pages, args=(self.generation, callback), daemon=True)
+            self.thread.start()
+
+    def _count_pages(self, generation, callback):
+        try:
+            # fitz document is not thread safe, use standalone document.
+            document = fitz.open(self.url)
+            document.layout(**self.get_layout_args())
+            counts = []
+            for chapter in range(document.chapter_count):
+                if generation != self.generation:
+                    return
+                counts.append(document.chapter_page_count(chapter))
+            document.close()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            # Don't let caller wait forever, it can fall back to count pages itself.
+            callback()
+            return
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._set_counts(counts)
+            self.is_ready = True
+        self._save_cache(counts)
+        callback()
+
+    def _get_cache_file(self):
+        key = "{}:{}:{}:{}".format(get_file_fingerprint(self.url), self.width, self.height, self.font_size)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _load_cache(self, chapter_count):
+        try:
+            with open(self._get_cache_file(), encoding="utf-8") as f:
+                counts = json.load(f)["chapter_page_counts"]
+            if len(counts) == chapter_count:
+                return counts
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _save_cache(self, counts):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_file = self._get_cache_file()
+            # Write to temp file first, other Emacs may read cache at same time.
+            temp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump({"chapter_page_counts": counts}, f)
+            os.replace(temp_file, cache_file)
+        except OSError:
+            import traceback
+            traceback.print_exc()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+
+import fitz
+from eaf_pdf_document import open_document
+from eaf_pdf_page import PdfPage
+from PyQt6.QtGui import QImage
+
+
+class BackgroundRenderer():
+    '''
+    Render pages to QImage in a worker thread.
+
+    fitz document is not thread safe, worker use standalone document of the same file.
+    Render key is (page_index, scale, rotation, inverted, inverted_image, clip), clip is tuple or None,
+    on_rendered(key) is called in worker thread, GUI side should take the image in GUI thread
+    and convert it to QPixmap.
+    '''
+    max_images = 16
+
+    def __init__(self, url, on_rendered=None):
+        self.url = url
+        self.on_rendered = on_rendered
+
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()    # key -> True
+        self.images = OrderedDict()     # key -> QImage
+        self.rendering_key = None
+        self.generation = 0
+        self.is_stopped = False
+        self.thread = None
+
+        # Only access in worker thread.
+        self._document = None
+        self._document_generation = -1
+
+    @staticmethod
+    def get_key(index, scale, rotation, invert, invert_image=False, clip=None):
+        return (index, scale, rotation, invert, invert_image, tuple(clip) if clip is not None else None)
+
+    def request(self, indexes, scale, rotation, invert, invert_image=False, clip=None, replace=True):
+        '''
+        Request render pages, pending requests that not start yet are superseded if replace is True.
+        '''
+        keys = [self.get_key(index, scale, rotation, invert, invert_image, clip) for index in indexes]
+        with self.condition:
+            if replace:
+                self.pending.clear()
+            for key in keys:
+                if key not in self.images and key != self.rendering_key:
+                    self.pending[key] = True
+            self.condition.notify_all()
+            self._start_thread()
+        return keys
+
+    def _start_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def wait(self, keys, timeout):
+        '''
+        Wait keys rendered, return False if timeout.
+        '''
+        deadline = time.time() + timeout
+        with self.condition:
+            while any(key in self.pending or key == self.rendering_key for key in keys):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def has(self, key):
+        with self.condition:
+            return key in self.images or key in self.pending or key == self.rendering_key
+
+    def take(self, key):
+        with self.condition:
+            return self.images.pop(key, None)
+
+    def reset(self):
+        '''
+        Drop pending requests and rendered images, call it when document changed.
+        '''
+        with self.condition:
+            self.generation += 1
+            self.pending.clear()
+            self.images.clear()
+
+    def stop(self):
+        with self.condition:
+            self.is_stopped = True
+            self.pending.clear()
+            self.images.clear()
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.is_stopped:
+                    self.condition.wait()
+                if self.is_stopped:
+                    return
+                key, _ = self.pending.popitem(last=False)
+                self.rendering_key = key
+                generation = self.generation
+
+            image = None
+            try:
+                image = self._render(key, generation)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+            with self.condition:
+                self.rendering_key = None
+                is_valid = image is not None and generation == self.generation and not self.is_stopped
+                if is_valid:
+                    self._store(key, image)
+                self.condition.notify_all()
+
+            if is_valid and self.on_rendered is not None:
+                self.on_rendered(key)
+
+    def _store(self, key, image):
+        self.images[key] = image
+        while len(self.images) > self.max_images:
+            self.images.popitem(last=False)
+
+    def _get_document(self, generation):
+        if self._document is None or self._document_generation != generation:
+            self._document = open_document(self.url)
+            self._document_generation = generation
+        return self._document
+
+    def _render(self, key, generation):
+        self._get_document(generation)
+
+        index, scale, rotation, invert, invert_image, clip = key
+        page = PdfPage(self._document[index], index, self._document.is_pdf,
+                       fitz.Rect(clip) if clip is not None else None)
+        if self._document.is_pdf:
+            page.set_rotation(rotation)
+        return page.get_qimage(scale, invert, invert_image)
+
+
+class PreviewRenderer(BackgroundRenderer):
+    '''
+    Render small crop around link target for hover preview.
+
+    Preview key is (page_index, target_y, inverted), target_y is top-down page coordinate.
+    Previews have their own cache with memory budget, they don't evict rendered pages.
+    '''
+    max_bytes = 16 * 1024 * 1024
+    preview_width = 480
+    preview_height = 200
+
+    def request_preview(self, key):
+        '''
+        Only latest preview request is rendered, mouse already left older links.
+        '''
+        with self.condition:
+            self.pending.clear()
+            if key not in self.images and key != self.rendering_key:
+                self.pending[key] = True
+            self.condition.notify_all()
+            self._start_thread()
+
+    def get(self, key):
+        with self.condition:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
+
+    def _store(self, key, image):
+        self.images[key] = image
+        cache_bytes = sum(image.sizeInBytes() for image in self.images.values())
+        while cache_bytes > self.max_bytes and len(self.images) > 1:
+            _, old_image = self.images.popitem(last=False)
+            cache_bytes -= old_image.sizeInBytes()
+
+    def _render(self, key, generation):
+        document = self._get_document(generation)
+
+        index, target_y, invert = key
+        page = document[index]
+        page_rect = page.rect
+        top = min(max(page_rect.y0, target_y - 20), max(page_rect.y0, page_rect.y1 - self.preview_height))
+        crop = fitz.Rect(page_rect.x0, top, page_rect.x1, min(page_rect.y1, top + self.preview_height))
+
+        scale = self.preview_width / page_rect.width
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=crop, alpha=False)
+        if invert:
+            pixmap.invert_irect(pixmap.irect)
+
+        # Copy it, cached image must not refer to pixmap samples.
+        return QImage(pixmap.samples, pixmap.width, pixmap.height, pixmap.stride, QImage.Format.Format_RGB888).copy()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import gzip
+import os
+import threading
+
+# Box records have width, height and depth, others are points.
+SYNCTEX_BOX_TYPES = "[(vh"
+SYNCTEX_POINT_TYPES = "xkg$"
+
+def get_synctex_file(pdf_file):
+    '''Return *.synctex.gz (or *.synctex) next to pdf_file, None if not exists.'''
+    base = os.path.splitext(pdf_file)[0]
+    for path in (base + ".synctex.gz", base + ".synctex"):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class SynctexIndex():
+    '''
+    In-memory index of SyncTeX file, answer both direction without synctex tool.
+
+    Coordinates are PDF points from top-left of page, same as `synctex view/edit' output.
+    Record is (x, y, width, height, depth, tag, line), y is baseline.
+    '''
+    def __init__(self, pdf_file):
+        self.pdf_file = pdf_file
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.synctex_file = None
+        self.mtime = None
+        self.inputs = {}            # tag -> tex file
+        self.page_records = {}      # page_num -> list of record
+        self.line_records = {}      # tag -> {line: list of (page_num, x, y)}
+        self.line_keys = {}         # tag -> sorted lines
+
+    def preload(self):
+        if get_synctex_file(self.pdf_file) is not None:
+            threading.Thread(target=self.ensure_loaded, daemon=True).start()
+
+    def ensure_loaded(self):
+        '''
+        Load synctex file if it's not loaded or changed since last load, return False if no synctex file.
+        '''
+        with self.lock:
+            synctex_file = get_synctex_file(self.pdf_file)
+            if synctex_file is None:
+                self.reset()
+                return False
+
+            mtime = os.path.getmtime(synctex_file)
+            if synctex_file != self.synctex_file or mtime != self.mtime:
+                self._load(synctex_file)
+                self.synctex_file = synctex_file
+                self.mtime = mtime
+            return True
+
+    def _load(self, synctex_file):
+        inputs = {}
+        page_records = {}
+        line_records = {}
+
+        unit = 1.0
+        magnification = 1000.0
+        x_offset = y_offset = 0.0
+        page_num = None
+        last_values = []
+
+        opener = gzip.open if synctex_file.endswith(".gz") else open
+        synctex_dir = os.path.dirname(synctex_file)
+        with opener(synctex_file, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+
+                head = line[0]
+                if head == "{":
+                    page_num = int(line[1:])
+                    continue
+                elif head == "}":
+                    page_num = None
+                    continue
+                elif page_num is not None and (head in SYNCTEX_BOX_TYPES or head in SYNCTEX_POINT_TYPES):
+                    fields = line[1:].split(":")
+                    if len(fields) < 2:
+                        continue
+                    tag_line = fields[0].split(",")
+                    values = ",".join(fields[1:]).split(",")
+                    # "=" means same value as previous record.
+                    values = [last_values[i] if value == "=" and i < len(last_values) else value
+                              for i, value in enumerate(values)]
+                    last_values = values
+                    try:
+                        tag, line_num = int(tag_line[0]), int(tag_line[1])
+                        # Scaled point to PDF point, 1bp = 65781.76sp.
+                        factor = unit * magnification / 1000 / 65781.76
+                        numbers = [float(value) * factor for value in values]
+                    except ValueError:
+                        continue
+
+                    x = numbers[0] + x_offset
+                    y = numbers[1] + y_offset
+                    if head in SYNCTEX_BOX_TYPES and len(numbers) >= 5:
+                        record = (x, y, numbers[2], numbers[3], numbers[4], tag, line_num)
+                    else:
+                        record = (x, y, 0.0, 0.0, 0.0, tag, line_num)
+                    page_records.setdefault(page_num, []).append(record)
+                    line_records.setdefault(tag, {}).setdefault(line_num, []).append((page_num, x, y))
+                    continue
+
+                # Preamble and input lines.
+                name, sep, value = line.partition(":")
+                if not sep:
+                    continue
+                if name == "Input":
+                    tag, sep, path = value.partition(":")
+                    inputs[int(tag)] = os.path.normpath(os.path.join(synctex_dir, path))
+                elif name == "Unit":
+                    unit = float(value)
+                elif name == "Magnification":
+                    magnification = float(value)
+                elif name == "X Offset":
+                    x_offset = float(value) / 65781.76
+                elif name == "Y Offset":
+                    y_offset = float(value) / 65781.76
+
+        self.inputs = inputs
+        self.page_records = page_records
+        self.line_records = line_records
+        self.line_keys = {tag: sorted(lines.keys()) for tag, lines in line_records.items()}
+
+    def find_tag(self, tex_file):
+        tex_file = os.path.realpath(tex_file)
+        for tag, path in self.inputs.items():
+            if os.path.realpath(path) == tex_file:
+                return tag
+        # Fallback to match file name, tex file maybe moved with pdf.
+        name = os.path.basename(tex_file)
+        for tag, path in self.inputs.items():
+            if os.path.basename(path) == name:
+                return tag
+        return None
+
+    def forward(self, tex_file, line_num):
+        '''
+        Return (page_num, x, y) of line_num in tex_file, page_num is 1-based, None if not found.
+        Use nearest line after line_num when the line has no record (e.g. comment or blank line).
+        '''
+        if not self.ensure_loaded():
+            return None
+
+        tag = self.find_tag(tex_file)
+        if tag is None or tag not in self.line_keys:
+            return None
+
+        lines = self.line_keys[tag]
+        index = bisect.bisect_left(lines, line_num)
+        if index == len(lines):
+            index -= 1
+        return min(self.line_records[tag][lines[index]])
+
+    def backward(self, page_num, x, y):
+        '''
+        Return (tex_file, line_num) at point of page_num (1-based), None if not found.
+        Use smallest box contain the point, or nearest record if no box contain it.
+        '''
+        if not self.ensure_loaded():
+            return None
+
+        records = self.page_records.get(page_num)
+        if not records:
+            return None
+
+        best_record = None
+        best_area = None
+        for record in records:
+            rx, ry, width, height, depth, tag, line_num = record
+            if width > 0 and rx <= x <= rx + width and ry - height <= y <= ry + depth:
+                area = width * (height + depth)
+                if best_area is None or area < best_area:
+                    best_record, best_area = record, area
+
+        if best_record is None:
+            best_record = min(records, key=lambda r: (r[0] - x) ** 2 + (r[1] - y) ** 2)
+
+        tex_file = self.inputs.get(best_record[5])
+        if tex_file is None:
+            return None
+        return tex_file, best_record[6]
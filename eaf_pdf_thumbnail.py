@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import math
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import fitz
+from eaf_pdf_document import open_document
+from eaf_pdf_utils import get_file_fingerprint
+from PyQt6.QtGui import QImage
+
+
+class ThumbnailGrid():
+    '''
+    Geometry of thumbnail grid, only rows in view are drawn.
+
+    Cell is thumbnail box and page number label, coordinates are relative to top-left of view.
+    '''
+    thumbnail_width = 160
+    padding = 16
+    label_height = 20
+
+    def __init__(self):
+        self.scroll_offset = 0
+        self.selected_index = 0
+        self.update_geometry(0, 0, 0, 1.0)
+
+    def update_geometry(self, view_width, view_height, page_count, page_ratio):
+        '''page_ratio is max height / width of pages, cell is high enough for every page.'''
+        self.view_width = view_width
+        self.view_height = view_height
+        self.page_count = page_count
+        self.thumbnail_height = int(self.thumbnail_width * page_ratio)
+        self.cell_width = self.thumbnail_width + self.padding
+        self.cell_height = self.thumbnail_height + self.label_height + self.padding
+        self.columns = max(1, int(view_width // self.cell_width))
+        self.rows = math.ceil(page_count / self.columns)
+        self.left = max(0, (view_width - self.columns * self.cell_width) / 2)
+        self.scroll_offset = max(0, min(self.scroll_offset, self.max_scroll_offset()))
+        self.selected_index = max(0, min(self.selected_index, page_count - 1))
+
+    def max_scroll_offset(self):
+        return max(0, self.rows * self.cell_height + self.padding - self.view_height)
+
+    def scroll_to(self, offset):
+        self.scroll_offset = max(0, min(offset, self.max_scroll_offset()))
+
+    def visible_range(self, extra_rows=0):
+        '''Return range of page index in view, and extra_rows after view.'''
+        first_row = int(self.scroll_offset // self.cell_height)
+        last_row = math.ceil((self.scroll_offset + self.view_height) / self.cell_height) + extra_rows
+        return range(first_row * self.columns, min(last_row * self.columns, self.page_count))
+
+    def cell_rect(self, index):
+        '''Return (x, y, width, height) of thumbnail box of page index.'''
+        row, column = divmod(index, self.columns)
+        x = self.left + column * self.cell_width + self.padding / 2
+        y = row * self.cell_height + self.padding - self.scroll_offset
+        return x, y, self.thumbnail_width, self.thumbnail_height
+
+    def index_at(self, x, y):
+        '''Return page index of cell at point, None if point is not in any cell.'''
+        column = int((x - self.left) // self.cell_width)
+        row = int((y + self.scroll_offset - self.padding / 2) // self.cell_height)
+        if x < self.left or not 0 <= column < self.columns or row < 0:
+            return None
+        index = row * self.columns + column
+        return index if index < self.page_count else None
+
+    def select(self, index):
+        '''Select page index and scroll to make it visible.'''
+        self.selected_index = max(0, min(index, self.page_count - 1))
+        _, y, _, height = self.cell_rect(self.selected_index)
+        if y < 0:
+            self.scroll_to(self.scroll_offset + y - self.padding)
+        elif y + height + self.label_height > self.view_height:
+            self.scroll_to(self.scroll_offset + y + height + self.label_height - self.view_height + self.padding / 2)
+
+
+class ThumbnailCache():
+    '''
+    Low resolution page images of thumbnail grid.
+
+    Thumbnails are rendered by a pool of worker threads with standalone documents,
+    and saved as PNG under cache_dir, in a directory keyed by document fingerprint, width and layout,
+    so next open of document load them from disk. Loaded images are kept in a LRU.
+    Directory mtime is last used time, least recently used directories are removed when total size over max_bytes,
+    e.g. directories of old fingerprint after annots saved.
+    on_ready(page_index) is called in worker thread.
+    '''
+    max_images = 512
+    max_bytes = 256 * 1024 * 1024
+    worker_count = 2
+
+    def __init__(self, url, cache_dir, on_ready=None):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready
+        self.width = None
+        self.layout = None
+        self.thumbnail_dir = None
+
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.images = OrderedDict()
+        self.working_indexes = set()
+        self.generation = 0
+        self.is_stopped = False
+        self.threads = []
+
+    def configure(self, width, layout=None):
+        '''
+        Set thumbnail pixel width and layout of reflowable document, drop thumbnails if they changed.
+        '''
+        if (width, layout) != (self.width, self.layout):
+            self.width = width
+            self.layout = layout
+            self.reset()
+
+    def reset(self):
+        '''
+        Drop thumbnails in memory, call it when document changed, thumbnail directory is computed again.
+        '''
+        with self.condition:
+            self.generation += 1
+            self.pending.clear()
+            self.images.clear()
+            self.thumbnail_dir = None
+
+    def stop(self):
+        with self.condition:
+            self.is_stopped = True
+            self.pending.clear()
+            self.images.clear()
+            self.condition.notify_all()
+
+    def get(self, page_index, inverted=False):
+        with self.condition:
+            image = self.images.get((page_index, inverted))
+            if image is not None:
+                self.images.move_to_end((page_index, inverted))
+                return image
+
+            image = self.images.get((page_index, False))
+            if image is None or not inverted:
+                return image
+
+            # Thumbnail is saved without inverted, invert it when dark mode.
+            image = image.copy()
+            image.invertPixels()
+            self._store((page_index, True), image)
+            return image
+
+    def request(self, page_indexes):
+        '''
+        Request thumbnails of page_indexes, pending requests that not start yet are superseded.
+        '''
+        with self.condition:
+            self.pending.clear()
+            for page_index in page_indexes:
+                if (page_index, False) not in self.images and page_index not in self.working_indexes:
+                    self.pending[page_index] = True
+            self.condition.notify_all()
+
+            if self.pending and not self.threads:
+                for _ in range(self.worker_count):
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+
+    def _store(self, key, image):
+        self.images[key] = image
+        self.images.move_to_end(key)
+        while len(self.images) > self.max_images:
+            self.images.popitem(last=False)
+
+    def _get_thumbnail_dir(self):
+        is_new = False
+        with self.condition:
+            if self.thumbnail_dir is None:
+                key = "{}:{}:{}".format(get_file_fingerprint(self.url), self.width, self.layout)
+                self.thumbnail_dir = os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest())
+                is_new = True
+            thumbnail_dir = self.thumbnail_dir
+
+        if is_new:
+            self._evict(thumbnail_dir)
+        return thumbnail_dir
+
+    def _evict(self, current_dir):
+        '''Touch current_dir and remove least recently used directories when cache is too big.'''
+        dirs = []
+        total_bytes = 0
+        try:
+            if os.path.isdir(current_dir):
+                os.utime(current_dir)
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+                    with os.scandir(entry.path) as files:
+                        size = sum(f.stat().st_size for f in files if f.is_file())
+                    total_bytes += size
+                    if entry.path != current_dir:
+                        dirs.append((entry.stat().st_mtime_ns, entry.path, size))
+        except OSError:
+            return
+
+        for (_, path, size) in sorted(dirs):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_bytes -= size
+
+    def _run(self):
+        # Only access in this worker thread, fitz document is not thread safe.
+        document = None
+        document_generation = -1
+
+        while True:
+            with self.condition:
+                while not self.pending and not self.is_stopped:
+                    self.condition.wait()
+                if self.is_stopped:
+                    return
+                page_index, _ = self.pending.popitem(last=False)
+                self.working_indexes.add(page_index)
+                generation = self.generation
+                width = self.width
+
+            image = None
+            try:
+                thumbnail_file = os.path.join(self._get_thumbnail_dir(), "{}.png".format(page_index))
+                if os.path.exists(thumbnail_file):
+                    image = QImage(thumbnail_file)
+                if image is None or image.isNull():
+                    if document is None or document_generation != generation:
+                        document = open_document(self.url)
+                        document_generation = generation
+                    image = self._render(document, page_index, width, thumbnail_file)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+            with self.condition:
+                self.working_indexes.discard(page_index)
+                is_valid = image is not None and generation == self.generation and not self.is_stopped
+                if is_valid:
+                    self._store((page_index, False), image)
+
+            if is_valid and self.on_ready is not None:
+                self.on_ready(page_index)
+
+    def _render(self, document, page_index, width, thumbnail_file):
+        page = document[page_index]
+        scale = width / page.rect.width
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+
+        os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
+        # Write to temp file first, other worker or Emacs may read thumbnail at same time.
+        temp_file = "{}.{}.tmp".format(thumbnail_file, threading.get_ident())
+        pixmap.save(temp_file, output="png")
+        os.replace(temp_file, thumbnail_file)
+
+        return QImage(pixmap.samples, pixmap.width, pixmap.height, pixmap.stride, QImage.Format.Format_RGB888).copy()
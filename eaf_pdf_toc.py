@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Andy Stewart
+#
+# Author:     Andy Stewart <lazycat.manatee@gmail.com>
+# Maintainer: Andy Stewart <lazycat.manatee@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_right
+from itertools import accumulate
+
+from eaf_pdf_utils import use_new_doc_name
+
+
+class TocModel():
+    '''
+    Table of contents of document, read once per document revision.
+
+    Entry is [level, title, page] like fitz get_toc, page is 1-based.
+    Formatted outputs are memoized until toc changed.
+    '''
+    def __init__(self, document):
+        self.document = document
+        self._toc = None
+        self._section_pages = []
+        self._outputs = {}
+
+    def reset(self, document=None):
+        if document is not None:
+            self.document = document
+        self._toc = None
+        self._section_pages = []
+        self._outputs = {}
+
+    @property
+    def toc(self):
+        if self._toc is None:
+            self.set_toc(self.document.get_toc() if use_new_doc_name else self.document.getToC())
+        return self._toc
+
+    def set_toc(self, toc):
+        '''
+        Update model with new toc, e.g. after outline edited, no need to read outline again.
+        '''
+        self._toc = [list(line[:3]) for line in toc]
+        # Outline page numbers may go backward, use prefix max to keep them sorted for bisect.
+        self._section_pages = list(accumulate((line[2] for line in self._toc), max))
+        self._outputs = {}
+
+    def find_section(self, page):
+        '''
+        Return index of toc entry that page (1-based) belongs to, 0 if page is before first entry.
+        '''
+        if not self.toc:
+            return 0
+        return max(bisect_right(self._section_pages, page) - 1, 0)
+
+    def _memoize(self, name, build):
+        if name not in self._outputs:
+            self._outputs[name] = build()
+        return self._outputs[name]
+
+    def get_outline_text(self):
+        return self._memoize("outline", lambda: "".join(
+            "{0}{1} {2}\n".format("    " * (level - 1), title, page) for level, title, page in self.toc))
+
+    def get_edit_text(self):
+        return self._memoize("edit", lambda: "".join(
+            "{0} {1} {2}\n".format("*" * level, title, page) for level, title, page in self.toc))
+
+    def get_search_list(self):
+        return self._memoize("search", lambda: [
+            f"{page}:{level*' '}{title}" for level, title, page in self.toc])
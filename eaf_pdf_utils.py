@@ -35,28 +35,89 @@ def convert_hex_to_qcolor(color, inverted=False):
     col.setRgbF(r, g, b)
     return col
 
-def generate_random_key(count, letters):
-    import math
-    import random
-    
-    random.seed(123)
-
-    key_list = []
-    key_len = 1 if count == 1 else math.ceil(math.log(count) / math.log(len(letters)))
-    while count > 0:
-        key = ''.join(random.choices(letters, k=key_len))
-        if key not in key_list:
-            key_list.append(key)
-            count -= 1
-    return key_list
+def generate_prefix_free_keys(count, letters):
+    '''
+    Generate shortest keys for count targets, no key is prefix of another key.
+
+    Keys are expanded breadth first: a single letter key is replaced by its
+    letter children only when more keys are needed, so every key is unique by construction.
+    '''
+    from collections import deque
+
+    if count <= 0 or not letters:
+        return []
+    if len(letters) == 1:
+        # Only one target can be selected with one letter.
+        return [letters[0]]
+
+    keys = deque(letters)
+    while len(keys) < count:
+        prefix = keys.popleft()
+        keys.extend(prefix + letter for letter in letters)
+    return list(keys)[:count]
+
+def get_file_fingerprint(path, sample_size=65536):
+    '''
+    Return hash of file size, mtime and content of file head and tail.
+
+    Sample head and tail instead of hash whole file, big scanned book take seconds to read.
+    '''
+    import hashlib
+    import os
+
+    stat = os.stat(path)
+    digest = hashlib.sha1("{}:{}".format(stat.st_size, stat.st_mtime_ns).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(sample_size))
+        if stat.st_size > sample_size:
+            f.seek(max(stat.st_size - sample_size, sample_size))
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+def parse_version(v):
+    '''
+    Parse version string like "1.18.2" to tuple (1, 18, 2).
+
+    Use it instead of packaging.version, import packaging slow down open buffer.
+    '''
+    import re
+
+    parts = []
+    for part in v.split("."):
+        match = re.match(r"\d+", part)
+        parts.append(int(match.group()) if match else 0)
+    while len(parts) < 3:
+        parts.append(0)
+    return tuple(parts)
 
 def is_old_version(v, v_bound='1.18.2'):
-    from packaging import version
-    return version.parse(v) < version.parse(v_bound)
+    return parse_version(v) < parse_version(v_bound)
 
 def is_doc_new_name(v, v_bound='1.19.0'):
-    from packaging import version
-    return version.parse(v) >= version.parse(v_bound)
+    return parse_version(v) >= parse_version(v_bound)
+
+class StartupTimer():
+    '''
+    Record duration of each startup stage, to track time-to-first-pixel of buffer.
+    '''
+    def __init__(self):
+        import time
+        self.start_time = self.last_time = time.perf_counter()
+        self.stages = []
+
+    def mark(self, stage):
+        import time
+        now = time.perf_counter()
+        self.stages.append((stage, (now - self.last_time) * 1000))
+        self.last_time = now
+
+    def elapsed(self):
+        return (self.last_time - self.start_time) * 1000
+
+    def report(self):
+        stages = ["{}: {:.1f}ms".format(stage, duration) for (stage, duration) in self.stages]
+        stages.append("total: {:.1f}ms".format(self.elapsed()))
+        return ", ".join(stages)
 
 import fitz
 
@@ -19,20 +19,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import io
 import math
+import tempfile
+import threading
 import time
-import webbrowser
 
 import fitz
 from core.utils import *
-from eaf_pdf_annot import AnnotAction
-from eaf_pdf_document import PdfDocument
-from eaf_pdf_utils import support_hit_max
-from PyQt6.QtCore import QEvent, QPoint, QRect, Qt, QTimer, pyqtSignal
-from PyQt6.QtGui import QColor, QCursor, QFont, QPainter, QPalette, QBrush
-from PyQt6.QtWidgets import QApplication, QToolTip, QWidget
+from eaf_pdf_annot import AnnotAction, AnnotActionBatch
+from eaf_pdf_document import PdfDocument, acquire_shared_document, open_document
+from eaf_pdf_ipc import EmacsCallBatcher
+from eaf_pdf_layout import PageLayout
+from eaf_pdf_page import PdfPage, write_select_text
+from eaf_pdf_raster_cache import get_raster_cache
+from eaf_pdf_render import BackgroundRenderer, PreviewRenderer
+from eaf_pdf_synctex import SynctexIndex, get_synctex_file
+from eaf_pdf_thumbnail import ThumbnailCache, ThumbnailGrid
+from eaf_pdf_utils import generate_prefix_free_keys, support_hit_max
+from PyQt6.QtCore import QEvent, QPoint, QRect, QRectF, Qt, QTimer, pyqtSignal
+from PyQt6.QtGui import QColor, QCursor, QFont, QPainter, QPalette, QBrush, QPen, QPixmap
+from PyQt6.QtWidgets import QApplication, QLabel, QToolTip, QWidget
 import os
-from pathlib import Path
 from itertools import accumulate
 
 
@@ -48,36 +56,21 @@ class PdfViewerWidget(QWidget):
         self.background_color = background_color
         self.buffer = buffer
         self.buffer_id = buffer_id
-        self.user_name = get_emacs_var("user-full-name")
 
         self.is_button_press = False
 
+        # Merge position/message calls that send to Emacs when scrolling.
+        self.emacs_call_batcher = EmacsCallBatcher(self)
+
         self.synctex_info = synctex_info
 
         self.installEventFilter(self)
         self.setMouseTracking(True)
 
-        (self.marker_letters,
-         self.pdf_dark_mode,
-         self.pdf_dark_exclude_image,
-         self.pdf_default_zoom,
-         self.pdf_zoom_step,
-         self.pdf_scroll_ratio,
-         self.text_highlight_annot_color,
-         self.text_underline_annot_color,
-         self.inline_text_annot_color,
-         self.inline_text_annot_fontsize) = get_emacs_vars([
-             "eaf-marker-letters",
-             "eaf-pdf-dark-mode",
-             "eaf-pdf-dark-exclude-image",
-             "eaf-pdf-default-zoom",
-             "eaf-pdf-zoom-step",
-             "eaf-pdf-scroll-ratio",
-             "eaf-pdf-text-highlight-annot-color",
-             "eaf-pdf-text-underline-annot-color",
-             "eaf-pdf-inline-text-annot-color",
-             "eaf-pdf-inline-text-annot-fontsize"
-             ])
+        # Emacs variables snapshot, refresh when Emacs notify variable changed.
+        self.emacs_config = buffer.emacs_config
+        self.load_emacs_config()
+        self.emacs_config.watch(self.handle_emacs_config_changed)
 
         self.theme_mode = get_emacs_theme_mode()
         self.theme_foreground_color = get_emacs_theme_foreground()
@@ -110,6 +103,7 @@ class PdfViewerWidget(QWidget):
         self.link_page_offset_x = None
         self.link_page_offset_y = None
         self.jump_link_key_cache_dict = {}
+        self.jump_link_hint_dict = {}
 
         # hover link
         self.is_hover_link = False
@@ -133,6 +127,9 @@ class PdfViewerWidget(QWidget):
         self.last_char_rect_index = None
         self.last_char_page_index = None
         self.select_area_annot_quad_cache_dict = {}
+        self.select_area_rect_cache_dict = {}
+        # Selection cross more pages than this is copied in thread.
+        self.select_sync_page_limit = 3
 
         # text annot
         self.is_hover_annot = False
@@ -183,6 +180,12 @@ class PdfViewerWidget(QWidget):
         # Padding between pages.
         self.page_padding = 10
 
+        # Pages in a row of continuous scroll, e.g. 2 for spread view.
+        # Geometry of rows is computed by PageLayout when columns > 1.
+        self.page_columns = max(1, self.pdf_page_columns)
+        self.page_layout = None
+        self.page_layout_key = None
+
         # Inverted mode.
         self.inverted_mode = False
 
@@ -203,6 +206,38 @@ class PdfViewerWidget(QWidget):
         self.page_cache_trans = None
         self.page_cache_context_delay = 1000
 
+        # Document and render cache shared with other buffers that show same file.
+        self.shared_document = None
+
+        # Render pages in background, e.g. restored session pages and presentation slides.
+        self.background_renderer = BackgroundRenderer(url, self.handle_page_prerendered)
+        self.synctex_index = SynctexIndex(url)
+
+        # Render pages in worker processes of shared document when eaf-pdf-render-processes > 0.
+        # Paint only wait a moment, page that is not rendered yet is drawn blank and repainted later.
+        self.process_render_wait = 0.03
+
+        # Hover preview of internal link target, shown when mouse rest on link.
+        self.preview_renderer = PreviewRenderer(url, self.handle_link_preview_rendered)
+        self.link_preview_key = None
+        self.link_preview_label = None
+        self.link_preview_timer = QTimer(self)
+        self.link_preview_timer.setInterval(300)
+        self.link_preview_timer.setSingleShot(True)
+        self.link_preview_timer.timeout.connect(self.show_link_preview)    # type: ignore
+        self.session_prerender_keys = None
+
+        # Thumbnail grid mode, thumbnails are rendered in background and cached on disk.
+        self.is_thumbnail_mode = False
+        self.thumbnail_grid = ThumbnailGrid()
+        self.thumbnail_cache = ThumbnailCache(url, os.path.join(self.config_dir, "pdf", "thumbnails"),
+                                              self.handle_thumbnail_ready)
+
+        # Presentation cache keep previous, current and next slides at fullscreen scale.
+        self.presentation_pixmap_dict = {}
+        self.presentation_cache_key = None
+        self.presentation_prerender_count = 3
+
         self.last_action_time = 0
 
         self.is_page_just_changed = False
@@ -223,12 +258,87 @@ class PdfViewerWidget(QWidget):
         self.last_page_index = 0
         self.top_y = 0 # y coordinate of scroll_offset relative to the start of the start_page_index
 
+        # Work that not need by first visible page, run it after first paint.
+        self.startup_timer = buffer.startup_timer
+        self.is_first_paint_done = False
+        self.deferred_startup_tasks = []
+        # Hidden buffer maybe not paint soon, run deferred tasks anyway.
+        # Timer is child of widget, it's stopped when buffer destroyed.
+        self.deferred_startup_timer = QTimer(self)
+        self.deferred_startup_timer.setSingleShot(True)
+        self.deferred_startup_timer.timeout.connect(self.run_deferred_startup_tasks)    # type: ignore
+        self.deferred_startup_timer.start(2000)
+
+        self.startup_timer.mark("widget init")
         self.load_document(url)
+        self.startup_timer.mark("load document")
 
         # synctex init page
         if self.synctex_info.page_num is not None:
             self.jump_to_page(self.synctex_info.page_num)    # type: ignore
 
+    def load_emacs_config(self):
+        self.user_name = self.emacs_config["user-full-name"]
+
+        (self.marker_letters,
+         self.pdf_dark_mode,
+         self.pdf_dark_exclude_image,
+         self.pdf_default_zoom,
+         self.pdf_zoom_step,
+         self.pdf_scroll_ratio,
+         self.text_highlight_annot_color,
+         self.text_underline_annot_color,
+         self.inline_text_annot_color,
+         self.inline_text_annot_fontsize,
+         self.reflow_font_size,
+         self.pdf_page_columns,
+         self.raster_cache_size,
+         self.render_process_count) = self.emacs_config.get_vars([
+             "eaf-marker-letters",
+             "eaf-pdf-dark-mode",
+             "eaf-pdf-dark-exclude-image",
+             "eaf-pdf-default-zoom",
+             "eaf-pdf-zoom-step",
+             "eaf-pdf-scroll-ratio",
+             "eaf-pdf-text-highlight-annot-color",
+             "eaf-pdf-text-underline-annot-color",
+             "eaf-pdf-inline-text-annot-color",
+             "eaf-pdf-inline-text-annot-fontsize",
+             "eaf-pdf-reflow-font-size",
+             "eaf-pdf-page-columns",
+             "eaf-pdf-raster-cache-size",
+             "eaf-pdf-render-processes"
+             ])
+
+    def handle_emacs_config_changed(self, names):
+        self.load_emacs_config()
+        self.scroll_ratio = self.pdf_scroll_ratio
+        if "eaf-pdf-dark-exclude-image" in names:
+            self.inverted_image_mode = not self.pdf_dark_exclude_image and self.document.is_pdf
+        if "eaf-pdf-reflow-font-size" in names and self.shared_document is not None:
+            self.shared_document.relayout(self.reflow_font_size)
+        if "eaf-pdf-page-columns" in names:
+            self.set_page_columns(self.pdf_page_columns)
+        if "eaf-pdf-raster-cache-size" in names and self.shared_document is not None:
+            self.shared_document.raster_cache = self.get_raster_cache()
+        if "eaf-pdf-render-processes" in names and self.shared_document is not None:
+            self.update_process_renderer()
+
+        self.page_cache_pixmap_dict.clear()
+        self.update()
+
+    def update_process_renderer(self):
+        '''
+        Start or stop worker processes of shared document with eaf-pdf-render-processes.
+        '''
+        self.shared_document.update_process_renderer(
+            self.render_process_count, (max(self.page_widths, default=0), max(self.page_heights, default=0)))
+
+    def get_raster_cache(self):
+        # Size is in MB, 0 disable disk cache of rendered pages.
+        return get_raster_cache(os.path.join(self.config_dir, "pdf", "rasters"),
+                                int((self.raster_cache_size or 0) * 1024 * 1024))
+
     def fill_background(self):
         pal = self.palette()
         pal.setColor(QPalette.ColorRole.Window, self.background_color)
@@ -239,33 +349,90 @@ class PdfViewerWidget(QWidget):
         if self.page_cache_pixmap_dict:
             self.page_cache_pixmap_dict.clear()
             self.document.reset_cache()
+        self.background_renderer.reset()
+        self.presentation_pixmap_dict.clear()
+        self.preview_renderer.reset()
+        self.thumbnail_cache.reset()
 
         # Load document first.
         try:
-            self.document = PdfDocument(fitz.open(url))    # type: ignore
+            if self.shared_document is None:
+                self.shared_document = acquire_shared_document(url, self.reflow_font_size,
+                                                               raster_cache=self.get_raster_cache())
+            self.document = PdfDocument(self.shared_document)    # type: ignore
         except Exception:
             message_to_emacs("Failed to load PDF file: " + url)
             return
 
         # recompute width, height, total number since the file might be modified
         self.document.watch_page_size_change(self.update_page_size)
+        self.update_page_geometry()
+        self.update_process_renderer()
+
+        # Register file watcher, when document is change, re-calling this function.
+        self.shared_document.add_reload_callback(self.load_document)
+        self.shared_document.add_relayout_callback(self.handle_reflow_relayout, lambda: self.start_page_index)
+        self.shared_document.add_page_count_callback(self.handle_page_count_changed)
+        self.shared_document.add_rendered_callback(self.handle_process_rendered)
+        self.defer_after_first_paint(self.shared_document.watch_file)
+        # Reflowable document only layout first chapter now, count other pages in background.
+        self.defer_after_first_paint(self.shared_document.count_reflow_pages)
+        self.defer_after_first_paint(self.document.link_graph.build)
+        # PDF changed, LaTeX maybe rebuilt synctex file too.
+        self.defer_after_first_paint(self.synctex_index.preload)
+
+        self.update()
+
+    def update_page_geometry(self):
         self.page_width = self.document.get_page_width()
         self.page_height = self.document.get_page_height()
         self.page_total_number = self.document.page_count
         self.page_widths, self.page_heights = self.document.get_all_widths_heights()
         self.page_heights_prefix_sum = list(accumulate(self.page_heights))
-        self.is_standard_doc = False
-        if len(set(self.page_widths)) == 1:
+        self.is_standard_doc = len(set(self.page_widths)) == 1
+        self.page_layout = None
+        self.update_offset_y_to_render_y()
+
+    def handle_page_count_changed(self):
+        '''
+        All pages of reflowable document are counted, pages before current page are not changed,
+        only update page arrays and keep scroll position.
+        '''
+        self.update_page_geometry()
+        self.update()
+
+    def handle_reflow_relayout(self, page_map):
+        '''
+        Reflowable document layout changed, keep reading position at same text.
+        '''
+        page_index = page_map.get(self.start_page_index, 0)
+        self.load_document(self.url)
+        self.update_vertical_offset(self.page_y_to_offset_y(page_index))
+
+    def defer_after_first_paint(self, task):
+        if self.is_first_paint_done:
+            task()
+        else:
+            self.deferred_startup_tasks.append(task)
+
+    def run_deferred_startup_tasks(self):
+        self.is_first_paint_done = True
+        tasks, self.deferred_startup_tasks = self.deferred_startup_tasks, []
+        if not tasks:
+            return
+
+        for task in tasks:
+            task()
+        self.startup_timer.mark("deferred tasks")
+
+    def update_offset_y_to_render_y(self):
+        if self.page_columns > 1:
+            self.offset_y_to_render_y = self.offset_y_to_render_y3
+        elif self.is_standard_doc:
             self.offset_y_to_render_y = self.offset_y_to_render_y1
-            self.is_standard_doc = True
         else:
             self.offset_y_to_render_y = self.offset_y_to_render_y2
 
-        # Register file watcher, when document is change, re-calling this function.
-        self.document.watch_file(url, self.load_document)
-
-        self.update()
-    
     def offset_y_to_render_y1(self, y):
         """
         Using simple algebra to convert global offset y coordinate to page_index and local y coordinate
@@ -315,6 +482,48 @@ class PdfViewerWidget(QWidget):
             accumulated_height = self.accumulate_page_heights(page_index - 1)
             return page_index, accumulated_height, y - accumulated_height
         
+    def offset_y_to_render_y3(self, y):
+        """
+        Using page layout to convert global offset y coordinate when several pages in a row,
+        page_index is first page of row at y.
+
+        Return: page_index, accumulated_y before page_index, local y
+        """
+        layout = self.get_page_layout()
+        row = layout.row_at(y)
+        accumulated_height = layout.row_tops[row] if layout.row_tops else 0
+        return row * layout.columns, accumulated_height, y - accumulated_height
+
+    def get_page_layout(self):
+        '''
+        Return PageLayout of current page sizes and scale, compute it again when they changed.
+        '''
+        key = (self.page_columns, self.scale, self.rotation, self.page_padding)
+        if self.page_layout is None or self.page_layout_key != key:
+            page_widths, page_heights = self.page_widths, self.page_heights
+            if self.rotation in [90, 270]:
+                page_widths, page_heights = page_heights, page_widths
+            self.page_layout = PageLayout(page_widths, page_heights, self.page_columns, self.scale, self.page_padding)
+            self.page_layout_key = key
+        return self.page_layout
+
+    def get_render_row_width(self):
+        if self.page_columns > 1:
+            return self.get_page_layout().max_row_width
+        return self.page_width * self.scale
+
+    def get_row_render_x(self, layout):
+        '''Return x coordinate of rows, all rows start at same x, then columns are aligned.'''
+        row_render_x = (self.rect().width() - layout.max_row_width) / 2
+        if self.read_mode == "fit_to_customize" and layout.max_row_width >= self.rect().width():
+            row_render_x = max(min(row_render_x + self.horizontal_offset, 0), self.rect().width() - layout.max_row_width)
+        return row_render_x
+
+    def get_document_render_height(self):
+        if self.page_columns > 1:
+            return self.get_page_layout().total_height()
+        return self.accumulate_page_heights()
+
     def window_y_to_page_y(self, y):
         """
         Given y coordinate relative to the top of the window (e.g. cursor position), 
@@ -335,6 +544,10 @@ class PdfViewerWidget(QWidget):
         Given page index and y coordinate relative to the page (e.g. quad.ul.y),
         return the global y offset, mainly used for jump.
         """
+        if self.page_columns > 1:
+            page_index = max(0, min(page_index, self.page_total_number - 1))
+            return self.get_page_layout().page_top(page_index) + y * self.scale
+
         accumulated_height = self.accumulate_page_heights(page_index - 1)
         offset_y = accumulated_height + y * self.scale
         return offset_y
@@ -362,7 +575,15 @@ class PdfViewerWidget(QWidget):
 
     @interactive
     def quit_presentation_mode(self):
+        if self.is_thumbnail_mode:
+            # Leave thumbnail grid without jump.
+            self.is_thumbnail_mode = False
+            self.update()
+            return
+
         self.presentation_mode = False
+        self.presentation_pixmap_dict.clear()
+        self.presentation_cache_key = None
 
         self.buffer.exit_fullscreen_request.emit()
 
@@ -387,6 +608,7 @@ class PdfViewerWidget(QWidget):
         Toggle presentation mode.
         '''
         self.presentation_mode = not self.presentation_mode
+        self.is_thumbnail_mode = False
         if self.presentation_mode:
             self.enter_presentation_mode()
         else:
@@ -456,7 +678,41 @@ class PdfViewerWidget(QWidget):
             self.page_cache_pixmap_dict.clear()
             self.page_cache_scale = scale
 
-        page = self.document[index]
+        # Use page that prerendered for restored session.
+        if self.session_prerender_keys is not None:
+            self.background_renderer.wait(self.session_prerender_keys, 1.0)
+            self.session_prerender_keys = None
+            self.startup_timer.mark("prerender wait")
+        image = self.background_renderer.take(self.get_background_render_key(index, scale, rotation))
+        if image is not None and not (self.is_mark_link or self.is_mark_search):
+            qpixmap = QPixmap.fromImage(image)
+            self.page_cache_pixmap_dict[index] = qpixmap
+            return qpixmap
+
+        has_marks = self.is_mark_link or self.is_mark_search
+        page = self.document.get_mark_page(index) if has_marks else self.document[index]
+
+        # Use pixmap rendered by other buffers that show same document.
+        is_plain_render = not has_marks and page.hovered_annot is None
+        render_key = (index, scale, rotation, self.get_inverted_mode(), self.inverted_image_mode, tuple(page.clip))
+        if is_plain_render:
+            qpixmap = self.shared_document.get_pixmap(render_key)
+            if qpixmap is not None:
+                self.page_cache_pixmap_dict[index] = qpixmap
+                self.document.cache_page(index, page)
+                return qpixmap
+
+        if is_plain_render:
+            qpixmap, is_rendering = self.get_process_rendered_pixmap(index, scale, rotation)
+            if is_rendering:
+                # Don't render page twice, handle_process_rendered repaint when worker finished it.
+                return self.get_placeholder_pixmap(page, scale, rotation)
+            if qpixmap is not None:
+                self.page_cache_pixmap_dict[index] = qpixmap
+                self.document.cache_page(index, page)
+                self.shared_document.cache_pixmap(render_key, qpixmap)
+                return qpixmap
+
         if self.document.is_pdf:
             page.set_rotation(rotation)
 
@@ -473,19 +729,185 @@ class PdfViewerWidget(QWidget):
             # this is the actual rendered quads, collect for cleanup
             self.rendered_searched_quads[index] = highlights
 
-        if self.is_jump_link:
-            self.jump_link_key_cache_dict.update(page.mark_jump_link_tips(self.marker_letters))
-        else:
-            page.cleanup_jump_link_tips()
-            self.jump_link_key_cache_dict.clear()
-
         qpixmap = page.get_qpixmap(scale, self.get_inverted_mode(), self.inverted_image_mode)
 
         self.page_cache_pixmap_dict[index] = qpixmap
         self.document.cache_page(index, page)
+        if is_plain_render:
+            self.shared_document.cache_pixmap(render_key, qpixmap)
 
         return qpixmap
 
+    def get_process_rendered_pixmap(self, index, scale, rotation):
+        '''
+        Render page with other missing pages in view at same time in worker processes.
+        Return (qpixmap, is_rendering), qpixmap is None if page is still rendering in worker,
+        or process renderer is not used or failed to render page, then page is rendered in GUI thread.
+        '''
+        process_renderer = self.shared_document.process_renderer
+        if process_renderer is None or not process_renderer.is_ready():
+            return None, False
+
+        view_indexes = range(self.start_page_index, min(self.last_page_index + 1, self.page_total_number))
+        indexes = [index] + [page_index for page_index in view_indexes
+                             if page_index != index and page_index not in self.page_cache_pixmap_dict]
+        clip = self.document.get_page_clip()
+        keys = process_renderer.request(indexes, scale, rotation, self.get_inverted_mode(), self.inverted_image_mode,
+                                        tuple(clip) if clip is not None else None)
+        process_renderer.wait(keys[:1], self.process_render_wait)
+        image = process_renderer.take(keys[0])
+        if image is None:
+            return None, not process_renderer.is_failed(keys[0])
+
+        # QImage refer to shared memory of worker, QPixmap copy it, then slot can be reused.
+        qpixmap = QPixmap.fromImage(image)
+        process_renderer.release(keys[0])
+        return qpixmap, False
+
+    def get_placeholder_pixmap(self, page, scale, rotation):
+        '''Blank page with size of rendered page, it's not cached.'''
+        width, height = page.clip.width * scale, page.clip.height * scale
+        if self.document.is_pdf and rotation in (90, 270):
+            width, height = height, width
+        qpixmap = QPixmap(math.ceil(width), math.ceil(height))
+        qpixmap.fill(QColor(0, 0, 0) if self.get_inverted_mode() else QColor(255, 255, 255))
+        return qpixmap
+
+    @PostGui()
+    def handle_process_rendered(self, key):
+        # Repaint page that was drawn blank when worker is rendering it.
+        if self.start_page_index <= key[0] <= self.last_page_index:
+            self.update()
+
+    def get_background_render_key(self, index, scale, rotation):
+        return self.background_renderer.get_key(index, scale, rotation, self.get_inverted_mode(),
+                                                self.inverted_image_mode, self.document.get_page_clip())
+
+    def prerender_session_pages(self):
+        '''
+        Render pages of restored viewport in background with standalone document,
+        make first paint after restore session hit the cache.
+        '''
+        if self.read_mode == "fit_to_presentation":
+            page_indexes = [self.start_page_index]
+        elif self.page_columns > 1:
+            page_indexes = list(self.get_page_layout().visible_pages(
+                min(self.scroll_offset, self.max_scroll_offset()), self.rect().height()))
+        else:
+            index, _, top_y = self.offset_y_to_render_y(min(self.scroll_offset, self.max_scroll_offset()))
+            page_indexes = []
+            render_height = -top_y
+            while index < self.page_total_number and render_height < self.rect().height():
+                page_indexes.append(index)
+                render_height += self.page_heights[index] * self.scale + self.page_padding
+                index += 1
+
+        self.session_prerender_keys = self.background_renderer.request(
+            page_indexes, self.scale * self.devicePixelRatioF(), self.rotation,
+            self.get_inverted_mode(), self.inverted_image_mode, self.document.get_page_clip())
+
+    def prefetch_link_target(self, link):
+        '''
+        Render target page of internal link in background, jump to it will land on a ready pixmap.
+        '''
+        target_page = link.get("page")
+        if target_page is None or target_page < 0 or target_page >= self.page_total_number:
+            return
+        if target_page in self.page_cache_pixmap_dict:
+            return
+
+        scale = self.scale * self.devicePixelRatioF()
+        if not self.background_renderer.has(self.get_background_render_key(target_page, scale, self.rotation)):
+            self.background_renderer.request([target_page], scale, self.rotation, self.get_inverted_mode(),
+                                             self.inverted_image_mode, self.document.get_page_clip(), replace=False)
+
+    def schedule_link_preview(self, link):
+        '''
+        Show preview of internal link target after mouse rest on link.
+        '''
+        self.hide_link_preview()
+
+        target_page = link.get("page")
+        if target_page is None or target_page < 0 or target_page >= self.page_total_number:
+            return
+
+        target_point = link.get("to")
+        target_y = 0
+        if target_point is not None:
+            target_y = self.page_heights[target_page] - target_point.y if self.document.is_pdf else target_point.y
+        self.link_preview_key = (target_page, int(target_y), self.get_inverted_mode())
+        self.link_preview_timer.start()
+
+    def show_link_preview(self):
+        if self.link_preview_key is None:
+            return
+
+        image = self.preview_renderer.get(self.link_preview_key)
+        if image is None:
+            self.preview_renderer.request_preview(self.link_preview_key)
+            return
+
+        if self.link_preview_label is None:
+            self.link_preview_label = QLabel(self, Qt.WindowType.ToolTip)
+        QToolTip.hideText()
+        self.link_preview_label.setPixmap(QPixmap.fromImage(image))
+        self.link_preview_label.adjustSize()
+        self.link_preview_label.move(QCursor.pos() + QPoint(16, 16))
+        self.link_preview_label.show()
+
+    def hide_link_preview(self):
+        self.link_preview_key = None
+        self.link_preview_timer.stop()
+        if self.link_preview_label is not None:
+            self.link_preview_label.hide()
+
+    @PostGui()
+    def handle_link_preview_rendered(self, key):
+        if key == self.link_preview_key and not self.link_preview_timer.isActive():
+            self.show_link_preview()
+
+    @PostGui()
+    def handle_page_prerendered(self, key):
+        index, scale, rotation, invert, invert_image, clip = key
+        if (self.read_mode == "fit_to_presentation" and
+            (scale, rotation, invert, invert_image) == self.presentation_cache_key):
+            image = self.background_renderer.take(key)
+            if image is not None:
+                self.presentation_pixmap_dict[index] = QPixmap.fromImage(image)
+
+    def update_presentation_cache(self):
+        '''
+        Keep previous, current and next K slides rendered, refill them in background after slide changed.
+        '''
+        scale = self.scale * self.devicePixelRatioF()
+        cache_key = (scale, self.rotation, self.get_inverted_mode(), self.inverted_image_mode)
+        if cache_key != self.presentation_cache_key:
+            self.presentation_pixmap_dict.clear()
+            self.presentation_cache_key = cache_key
+
+        slide_indexes = range(max(0, self.start_page_index - 1),
+                              min(self.page_total_number, self.start_page_index + self.presentation_prerender_count + 1))
+        for index in list(self.presentation_pixmap_dict.keys()):
+            if index not in slide_indexes:
+                self.presentation_pixmap_dict.pop(index)
+
+        missing_indexes = [index for index in slide_indexes if index not in self.presentation_pixmap_dict]
+        if missing_indexes:
+            self.background_renderer.request(missing_indexes, scale, self.rotation,
+                                             self.get_inverted_mode(), self.inverted_image_mode,
+                                             self.document.get_page_clip())
+
+    def get_presentation_cache_pixmap(self, index):
+        # Slide need extra marks can't use cache, selection and jump link hints are drawn as overlay.
+        if self.is_mark_link or self.is_mark_search or self.is_hover_annot:
+            return None
+
+        scale = self.scale * self.devicePixelRatioF()
+        if self.presentation_cache_key != (scale, self.rotation, self.get_inverted_mode(), self.inverted_image_mode):
+            return None
+
+        return self.presentation_pixmap_dict.get(index)
+
     def get_page_render_info(self, index):
         # Get HiDPI scale factor.
         # Note:
@@ -576,7 +998,9 @@ class PdfViewerWidget(QWidget):
         painter.setPen(color)
 
         # Draw page.
-        if self.read_mode == "fit_to_presentation":
+        if self.is_thumbnail_mode:
+            self.draw_thumbnail_grid(painter)
+        elif self.read_mode == "fit_to_presentation":
             self.draw_presentation_page(painter, self.start_page_index)
         else:
             self.draw_scroll_pages(painter)
@@ -591,13 +1015,20 @@ class PdfViewerWidget(QWidget):
         painter.setPen(QColor(self.get_render_foreground_color()))
         self.update_page_progress(painter)
 
-    def draw_presentation_page(self, painter, index):
-        # Get page render information.
-        (qpixmap, self.page_render_width, self.page_render_height) = self.get_page_render_info(index)
+        if not self.is_first_paint_done:
+            self.is_first_paint_done = True
+            self.startup_timer.mark("first paint")
+            self.deferred_startup_timer.start(0)
 
-        # Select char area when is_select_mode is True.
-        if self.is_select_mode:
-            qpixmap = self.mark_select_obj_area(index, qpixmap)
+    def draw_presentation_page(self, painter, index):
+        # Get page render information, use prerendered slide if it's ready.
+        qpixmap = self.get_presentation_cache_pixmap(index)
+        if qpixmap is not None:
+            hidpi_scale_factor = self.devicePixelRatioF()
+            self.page_render_width = qpixmap.width() / hidpi_scale_factor
+            self.page_render_height = qpixmap.height() / hidpi_scale_factor
+        else:
+            (qpixmap, self.page_render_width, self.page_render_height) = self.get_page_render_info(index)
 
         # Init x and y coordinate.
         page_render_x = (self.rect().width() - self.page_render_width) / 2
@@ -624,7 +1055,106 @@ class PdfViewerWidget(QWidget):
         painter.drawRect(rect)
         painter.drawPixmap(rect, qpixmap)
 
+        # Select char area when is_select_mode is True.
+        if self.is_select_mode:
+            self.draw_select_area(painter, index, rect)
+
+        if self.is_jump_link:
+            self.draw_jump_link_hints(painter, index, rect)
+
+        self.update_presentation_cache()
+
+    def update_thumbnail_grid(self):
+        page_ratio = max(height / width for width, height in zip(self.page_widths, self.page_heights))
+        self.thumbnail_grid.update_geometry(self.rect().width(), self.rect().height(), self.page_total_number, page_ratio)
+
+    def draw_thumbnail_grid(self, painter):
+        grid = self.thumbnail_grid
+        self.update_thumbnail_grid()
+        self.current_page_index1 = grid.selected_index + 1
+
+        # Render visible thumbnails first, then next row.
+        visible_range = grid.visible_range()
+        self.thumbnail_cache.request(list(visible_range) + list(grid.visible_range(1))[len(visible_range):])
+
+        inverted = self.get_inverted_mode()
+        foreground_color = QColor(self.get_render_foreground_color())
+        for index in visible_range:
+            x, y, width, height = grid.cell_rect(index)
+            # Keep page ratio in cell, cell is high enough for page with max ratio.
+            box_height = width * self.page_heights[index] / self.page_widths[index]
+            rect = QRectF(x, y + (height - box_height) / 2, width, box_height)
+
+            image = self.thumbnail_cache.get(index, inverted)
+            if image is not None:
+                painter.drawImage(rect, image)
+            else:
+                # Placeholder before thumbnail is rendered.
+                painter.save()
+                painter.setBrush(Qt.BrushStyle.NoBrush)
+                painter.setPen(foreground_color)
+                painter.drawRect(rect)
+                painter.restore()
+
+            if index == grid.selected_index:
+                painter.save()
+                painter.setBrush(Qt.BrushStyle.NoBrush)
+                painter.setPen(QPen(QColor(self.theme_foreground_color), 3))
+                painter.drawRect(rect.adjusted(-3, -3, 3, 3))
+                painter.restore()
+
+            painter.save()
+            painter.setPen(foreground_color)
+            painter.drawText(QRectF(x, y + height, width, grid.label_height),
+                             Qt.AlignmentFlag.AlignCenter, str(index + 1))
+            painter.restore()
+
+    @PostGui()
+    def handle_thumbnail_ready(self, page_index):
+        if self.is_thumbnail_mode and page_index in self.thumbnail_grid.visible_range():
+            self.update()
+
+    @interactive
+    def toggle_thumbnail_mode(self):
+        '''
+        Toggle thumbnail grid, leave grid jump to selected page.
+        '''
+        if self.is_thumbnail_mode:
+            self.open_thumbnail_page(self.thumbnail_grid.selected_index)
+            return
+
+        layout = None
+        if self.shared_document.reflow_layout is not None:
+            layout = tuple(self.shared_document.reflow_layout.get_layout_args().values())
+        self.thumbnail_cache.configure(int(self.thumbnail_grid.thumbnail_width * self.devicePixelRatioF()), layout)
+
+        self.is_thumbnail_mode = True
+        self.update_thumbnail_grid()
+        self.thumbnail_grid.select(self.current_page_index1 - 1)
+        self.update()
+
+    def open_thumbnail_page(self, page_index):
+        self.is_thumbnail_mode = False
+        if self.read_mode == "fit_to_presentation":
+            self.start_page_index = page_index
+            self.update()
+        else:
+            self.update_vertical_offset(self.page_y_to_offset_y(page_index))
+        self.update()
+
+    def move_thumbnail_selection(self, delta):
+        self.thumbnail_grid.select(self.thumbnail_grid.selected_index + delta)
+        self.update()
+
+    def scroll_thumbnail_grid(self, delta):
+        self.thumbnail_grid.scroll_to(self.thumbnail_grid.scroll_offset + delta)
+        self.update()
+
     def draw_scroll_pages(self, painter):
+        if self.page_columns > 1:
+            self.draw_column_pages(painter)
+            return
+
         max_scroll_offset = self.max_scroll_offset()
         top_offset = min(self.scroll_offset, max_scroll_offset)
         window_height = self.rect().height()
@@ -648,25 +1178,57 @@ class PdfViewerWidget(QWidget):
             index += 1
         self.last_page_index = index
 
-    def draw_scroll_page(self, painter, index):
+    def draw_column_pages(self, painter):
+        '''
+        Draw rows of pages when several pages in a row, only pages in view are rendered.
+        '''
+        layout = self.get_page_layout()
+        max_scroll_offset = self.max_scroll_offset()
+        top_offset = min(self.scroll_offset, max_scroll_offset)
+        window_height = self.rect().height()
+        middle_offset = min(self.scroll_offset + window_height*0.3, max_scroll_offset)
+
+        self.start_page_index, _, self.top_y = self.offset_y_to_render_y(top_offset)
+        middle_page_index, _, _ = self.offset_y_to_render_y(middle_offset)
+
+        self.current_page_index1 = middle_page_index + 1
+
+        row_render_x = self.get_row_render_x(layout)
+        visible_pages = layout.visible_pages(top_offset, window_height)
+        for index in visible_pages:
+            painter.save()
+            painter.translate(0, layout.page_top(index) - top_offset)
+            self.draw_scroll_page(painter, index, row_render_x + layout.page_x(index))
+            painter.restore()
+        self.last_page_index = visible_pages.stop
+
+        # Progress is drawn at right of rows.
+        self.page_render_width = layout.max_row_width
+
+    def draw_scroll_page(self, painter, index, page_render_x=None):
         # Get page render information.
         (qpixmap, self.page_render_width, self.page_render_height) = self.get_page_render_info(index)
 
-        # Select char area when is_select_mode is True.
-        if self.is_select_mode:
-            qpixmap = self.mark_select_obj_area(index, qpixmap.copy())
-
         # Init x coordinate.
-        page_render_x = (self.rect().width() - self.page_render_width) / 2
+        if page_render_x is None:
+            page_render_x = (self.rect().width() - self.page_render_width) / 2
 
-        # Adjust x coordinate coordinate of render page.
-        if self.read_mode == "fit_to_customize" and self.page_render_width >= self.rect().width():
-            # limit the visiable area size
-            page_render_x = max(min(page_render_x + self.horizontal_offset, 0), self.rect().width() - self.page_render_width)
+            # Adjust x coordinate coordinate of render page.
+            if self.read_mode == "fit_to_customize" and self.page_render_width >= self.rect().width():
+                # limit the visiable area size
+                page_render_x = max(min(page_render_x + self.horizontal_offset, 0), self.rect().width() - self.page_render_width)
 
         rect = QRect(int(page_render_x), 0, int(self.page_render_width), int(self.page_render_height))
         painter.drawRect(rect)
         painter.drawPixmap(rect, qpixmap)
+
+        # Select char area when is_select_mode is True.
+        if self.is_select_mode:
+            self.draw_select_area(painter, index, rect)
+
+        if self.is_jump_link:
+            self.draw_jump_link_hints(painter, index, rect)
+
         self.draw_page_extra(painter, index, page_render_x)
         return self.page_render_height + self.page_padding
         
@@ -710,12 +1272,12 @@ class PdfViewerWidget(QWidget):
 
     def update_page_progress(self, painter):
         # Show in mode-line-position
-        eval_in_emacs("eaf--pdf-update-position", [self.buffer_id,
-                                                   self.current_page_index1,
-                                                   self.page_total_number])
+        self.emacs_call_batcher.post("eaf--pdf-update-position",
+                                     [self.buffer_id, self.current_page_index1, self.page_total_number],
+                                     skip_unchanged=True)
 
         # Draw progress on page.
-        show_progress_on_page, = get_emacs_vars(["eaf-pdf-show-progress-on-page"])
+        show_progress_on_page = self.emacs_config["eaf-pdf-show-progress-on-page"]
         if show_progress_on_page:
             bottom = int(self.rect().height() - self.page_annotate_padding_y)
             right = int(min((self.rect().width() + self.page_render_width)/2, self.rect().width()) - self.page_annotate_padding_x)
@@ -768,6 +1330,10 @@ class PdfViewerWidget(QWidget):
     @build_context_wrap    # type: ignore
     def wheelEvent(self, event):
         if not event.accept():
+            if self.is_thumbnail_mode:
+                self.scroll_thumbnail_grid(-event.angleDelta().y() / 120 * self.thumbnail_grid.cell_height / 2)
+                return
+
             if event.angleDelta().y():
                 numSteps = event.angleDelta().y()
                 if self.presentation_mode:
@@ -786,7 +1352,7 @@ class PdfViewerWidget(QWidget):
 
             if event.angleDelta().x():
                 new_pos = (self.horizontal_offset + event.angleDelta().x() / 120 * self.scroll_step_horizontal)
-                max_pos = (self.page_width * self.scale - self.rect().width())
+                max_pos = (self.get_render_row_width() - self.rect().width())
                 self.update_horizontal_offset(max(min(new_pos , max_pos), -max_pos))    # type: ignore
 
     def update_page_size(self, rect):
@@ -808,7 +1374,12 @@ class PdfViewerWidget(QWidget):
         self.scale = new_scale
 
     def scale_to_width(self):
-        self.scale_to(self.rect().width() * 1.0 / self.page_width)
+        if self.page_columns > 1:
+            # Fit row of pages to width, padding between pages is not scaled.
+            row_width = self.rect().width() - self.page_padding * (self.page_columns - 1)
+            self.scale_to(row_width * 1.0 / (self.page_width * self.page_columns))
+        else:
+            self.scale_to(self.rect().width() * 1.0 / self.page_width)
 
     def scale_to_presentation(self):
         self.scale_to(min(self.rect().width() * 1.0 / self.page_width,
@@ -821,7 +1392,7 @@ class PdfViewerWidget(QWidget):
             self.scale_to_presentation()
         
     def max_scroll_offset(self):
-        full_accumulate_heights = self.accumulate_page_heights()
+        full_accumulate_heights = self.get_document_render_height()
         max_scroll_offset = full_accumulate_heights - self.rect().height()
         if max_scroll_offset < 0:
             return 0
@@ -830,7 +1401,8 @@ class PdfViewerWidget(QWidget):
     @interactive
     def reload_document(self):
         message_to_emacs("Reloaded PDF file!")
-        self.load_document(self.url)
+        # Reload shared document, all buffers that show this file are refreshed.
+        self.shared_document.reload_document(self.url)
 
     @interactive
     def toggle_read_mode(self):
@@ -844,6 +1416,32 @@ class PdfViewerWidget(QWidget):
         self.update_scale()
         self.update()
 
+    def set_page_columns(self, columns):
+        '''
+        Show columns pages in a row, keep current page in view.
+        '''
+        columns = max(1, int(columns))
+        if columns == self.page_columns:
+            return
+
+        current_page_index = self.start_page_index
+        self.page_columns = columns
+        self.update_offset_y_to_render_y()
+        self.horizontal_offset = 0
+        self.update_scale()
+        self.update_vertical_offset(self.page_y_to_offset_y(current_page_index))
+        self.update()
+
+    @interactive
+    def toggle_page_columns(self):
+        '''
+        Toggle between single page and multi-column mode, columns is eaf-pdf-page-columns or 2.
+        '''
+        if self.page_columns > 1:
+            self.set_page_columns(1)
+        else:
+            self.set_page_columns(max(2, self.pdf_page_columns))
+
     def next_page(self):
         if self.start_page_index < self.page_total_number - 1:
             self.start_page_index = self.start_page_index + 1
@@ -865,21 +1463,27 @@ class PdfViewerWidget(QWidget):
 
     @interactive
     def scroll_up(self):
-        if self.read_mode == "fit_to_presentation":
+        if self.is_thumbnail_mode:
+            self.move_thumbnail_selection(self.thumbnail_grid.columns)
+        elif self.read_mode == "fit_to_presentation":
             self.next_page()
         else:
             self.update_vertical_offset(self.scroll_offset + self.scroll_step_vertical)    # type: ignore
 
     @interactive
     def scroll_down(self):
-        if self.read_mode == "fit_to_presentation":
+        if self.is_thumbnail_mode:
+            self.move_thumbnail_selection(-self.thumbnail_grid.columns)
+        elif self.read_mode == "fit_to_presentation":
             self.prev_page()
         else:
             self.update_vertical_offset(self.scroll_offset - self.scroll_step_vertical)    # type: ignore
 
     @interactive
     def scroll_up_page(self):
-        if self.presentation_mode:
+        if self.is_thumbnail_mode:
+            self.scroll_thumbnail_grid(self.rect().height())
+        elif self.presentation_mode:
             self.next_page()
         else:
             # Adjust scroll step to make users continue reading fluently.
@@ -887,7 +1491,9 @@ class PdfViewerWidget(QWidget):
 
     @interactive
     def scroll_down_page(self):
-        if self.presentation_mode:
+        if self.is_thumbnail_mode:
+            self.scroll_thumbnail_grid(-self.rect().height())
+        elif self.presentation_mode:
             self.prev_page()
         else:
             # Adjust scroll step to make users continue reading fluently.
@@ -895,11 +1501,17 @@ class PdfViewerWidget(QWidget):
 
     @interactive
     def scroll_right(self):
-        self.update_horizontal_offset(max(self.horizontal_offset - self.scroll_step_horizontal, (self.rect().width() - self.page_width * self.scale) / 2))    # type: ignore
+        if self.is_thumbnail_mode:
+            self.move_thumbnail_selection(1)
+            return
+        self.update_horizontal_offset(max(self.horizontal_offset - self.scroll_step_horizontal, (self.rect().width() - self.get_render_row_width()) / 2))    # type: ignore
 
     @interactive
     def scroll_left(self):
-        self.update_horizontal_offset(min(self.horizontal_offset + self.scroll_step_horizontal, (self.page_width * self.scale - self.rect().width()) / 2))    # type: ignore
+        if self.is_thumbnail_mode:
+            self.move_thumbnail_selection(-1)
+            return
+        self.update_horizontal_offset(min(self.horizontal_offset + self.scroll_step_horizontal, (self.get_render_row_width() - self.rect().width()) / 2))    # type: ignore
 
     @interactive
     def scroll_center_horizontal(self):
@@ -907,11 +1519,17 @@ class PdfViewerWidget(QWidget):
 
     @interactive
     def scroll_to_begin(self):
+        if self.is_thumbnail_mode:
+            self.move_thumbnail_selection(-self.thumbnail_grid.selected_index)
+            return
         self.mark_position()
         self.update_vertical_offset(0)    # type: ignore
 
     @interactive
     def scroll_to_end(self):
+        if self.is_thumbnail_mode:
+            self.move_thumbnail_selection(self.page_total_number)
+            return
         self.mark_position()
         self.update_vertical_offset(self.max_scroll_offset())    # type: ignore
 
@@ -958,6 +1576,9 @@ class PdfViewerWidget(QWidget):
         current_page_index = self.start_page_index
         self.document.toggle_trim_margin()
         self.page_cache_pixmap_dict.clear()
+        # Background rendered pages are rendered with old clip.
+        self.background_renderer.reset()
+        self.presentation_pixmap_dict.clear()
         self.update()
         self.jump_to_page(current_page_index)    # type: ignore
 
@@ -1041,14 +1662,27 @@ class PdfViewerWidget(QWidget):
         if new_annot:
             new_annot.set_info(title=annot_action.annot_title)
             new_annot.parent = page
-            self.save_annot()
+            # New annot has new id, update action to make later redo/undo can find it.
+            annot_action.annot_id = new_annot.info["id"]
+            self.document.annot_index.add(annot_action.page_index, new_annot)
 
     def delete_annot_of_action(self, annot_action):
-        page = self.document[annot_action.page_index]
-        annot = AnnotAction.find_annot_of_annot_action(page, annot_action)
+        annot = self.find_annot_by_id(annot_action.annot_id, annot_action.page_index)
         if annot:
-            page.delete_annot(annot)
-            self.save_annot()
+            annot.parent.delete_annot(annot)
+            self.document.annot_index.remove(annot_action.annot_id)
+
+    def do_annot_action(self, annot_action, reverse=False):
+        '''
+        Do annot action (or undo it if reverse is True), batch action only save document once.
+        '''
+        annot_actions = AnnotActionBatch.unpack(annot_action)
+        for action in annot_actions:
+            if (action.action_type == "Add") != reverse:
+                self.add_annot_of_action(action)
+            else:
+                self.delete_annot_of_action(action)
+        self.save_annot([action.page_index for action in annot_actions])
 
     @interactive
     def rotate_counterclockwise(self):
@@ -1062,11 +1696,8 @@ class PdfViewerWidget(QWidget):
             annot_action = self.annot_action_sequence[self.annot_action_index]
             self.annot_action_index = self.annot_action_index - 1
             if annot_action:
-                self.jump_to_page(annot_action.page_index)    # type: ignore
-                if annot_action.action_type == "Add":
-                    self.delete_annot_of_action(annot_action)
-                elif annot_action.action_type == "Delete":
-                    self.add_annot_of_action(annot_action)
+                self.jump_to_page(annot_action.page_index + 1)    # type: ignore
+                self.do_annot_action(annot_action, reverse=True)
                 message_to_emacs("Undo last action!")
             else:
                 message_to_emacs("Invalid annot action.")
@@ -1078,21 +1709,64 @@ class PdfViewerWidget(QWidget):
         else:
             self.annot_action_index = self.annot_action_index + 1
             annot_action = self.annot_action_sequence[self.annot_action_index]
-            self.jump_to_page(annot_action.page_index)    # type: ignore
-
-            if annot_action.action_type == "Add":
-                self.add_annot_of_action(annot_action)
-            elif annot_action.action_type == "Delete":
-                self.delete_annot_of_action(annot_action)
+            self.jump_to_page(annot_action.page_index + 1)    # type: ignore
+            self.do_annot_action(annot_action)
 
             message_to_emacs("Redo last action!")
 
 
     def add_mark_jump_link_tips(self):
-        self.is_jump_link = True and self.document.is_pdf
-        self.page_cache_pixmap_dict.clear()
+        '''
+        Assign keys to links of visible pages, hints are drawn as overlay, page pixmap is not re-rendered.
+        '''
+        if not self.document.is_pdf:
+            return
+
+        if self.read_mode == "fit_to_presentation":
+            page_indexes = [self.start_page_index]
+        else:
+            page_indexes = range(self.start_page_index, min(self.last_page_index, self.page_total_number))
+
+        page_links = [(page_index, link) for page_index in page_indexes for link in self.document[page_index].get_links()]
+        keys = generate_prefix_free_keys(len(page_links), self.marker_letters)
+
+        self.jump_link_key_cache_dict.clear()
+        self.jump_link_hint_dict.clear()
+        for key, (page_index, link) in zip(keys, page_links):
+            self.jump_link_key_cache_dict[key] = link
+            self.jump_link_hint_dict.setdefault(page_index, []).append((key, link["from"]))
+
+        self.is_jump_link = True
         self.update()
 
+    def draw_jump_link_hints(self, painter, page_index, rect):
+        hints = self.jump_link_hint_dict.get(page_index)
+        if not hints:
+            return
+
+        # Page coordinate to widget coordinate, same as draw_select_area.
+        factor = rect.width() / self.document[page_index].clip.width
+        fontsize = self.emacs_config["eaf-pdf-marker-fontsize"] * factor
+        # Link rect is page coordinate, page is drawn from top-left of clip when trim white margin.
+        clip = self.document.get_page_clip()
+        (offset_x, offset_y) = (clip.x0, clip.y0) if clip is not None else (0, 0)
+
+        painter.save()
+        font = QFont()
+        font.setPixelSize(max(int(fontsize), 1))
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        for key, link_rect in hints:
+            hint_rect = QRectF(rect.x() + (link_rect.x0 - offset_x) * factor, rect.y() + (link_rect.y0 - offset_y) * factor,
+                               fontsize / 1.2 * len(key) + fontsize / 2, fontsize * 1.2)
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(255, 197, 36))
+            painter.drawRoundedRect(hint_rect, 2, 2)
+            painter.setPen(QColor(0, 0, 0))
+            painter.drawText(hint_rect, Qt.AlignmentFlag.AlignCenter, key)
+        painter.restore()
+
     def jump_to_link(self, key):
         key = key.upper()
         if key in self.jump_link_key_cache_dict:
@@ -1117,6 +1791,7 @@ class PdfViewerWidget(QWidget):
             self.cleanup_links()
 
             if external_browser:
+                import webbrowser
                 webbrowser.open(link["uri"])
                 message_to_emacs("Open in external browser: " + link["uri"])
             else:
@@ -1124,9 +1799,19 @@ class PdfViewerWidget(QWidget):
                 open_url_in_new_tab(link["uri"])
                 message_to_emacs("Open in EAF: " + link["uri"])
 
+    def get_back_references(self, page_index):
+        '''
+        Return pages that link to page_index, None if link graph is still building.
+        '''
+        link_graph = self.document.link_graph
+        link_graph.build()
+        if not link_graph.is_ready:
+            return None
+        return link_graph.get_back_references(page_index)
+
     def cleanup_links(self):
         self.is_jump_link = False
-        self.page_cache_pixmap_dict.clear()
+        self.jump_link_hint_dict.clear()
         self.update()
 
     def _search_in_pages(self, text, page_list):
@@ -1235,9 +1920,9 @@ class PdfViewerWidget(QWidget):
         """
         self.page_cache_pixmap_dict.clear()
         for page_num, annot_list in self.rendered_searched_quads.items():
-            raw_page = self.document.document[page_num]
             for annot in annot_list:
-                raw_page.delete_annot(annot)
+                # Annot may be on private document, see PdfDocument.get_mark_page.
+                annot.parent.delete_annot(annot)
             annot_list.clear() # make sure we don't have any dangling references
                 
         self.rendered_searched_quads.clear()
@@ -1271,36 +1956,34 @@ class PdfViewerWidget(QWidget):
 
         return page_dict
 
-    def get_select_obj_list(self):
-        page_dict = {}
-        if self.start_char_rect_index and self.last_char_rect_index:
-            # start and last page
-            sp_index = min(self.start_char_page_index, self.last_char_page_index)    # type: ignore
-            lp_index = max(self.start_char_page_index, self.last_char_page_index)    # type: ignore
-            for page_index in range(sp_index, lp_index + 1):    # type: ignore
-                # handle forward select and backward select on multi page.
-                # backward select on multi page.
-                if self.start_char_page_index > self.last_char_page_index:    # type: ignore
-                    sc = self.last_char_rect_index if page_index == sp_index else (0, 0, 0, 0)
-                    lc = self.start_char_rect_index if page_index == lp_index else (-1, -1, -1, -1)
-                else:
-                    # forward select on multi page.
-                    sc = self.start_char_rect_index if page_index == sp_index else (0, 0, 0, 0)
-                    lc = self.last_char_rect_index if page_index == lp_index else (-1, -1, -1, -1)
-
-                # handle forward select and backward select on same page.
-                
-                if -1 in sc:
-                    sc_index, lc_index = lc, sc
-                elif -1 in lc:
-                    sc_index, lc_index = sc, lc
-                else:
-                    sc_index = min(sc, lc)
-                    lc_index = max(sc, lc)
+    def get_select_page_range(self, page_index):
+        '''Return (start, end) obj index of selection on page_index, None if page not selected.'''
+        if not (self.start_char_rect_index and self.last_char_rect_index):
+            return None
 
-                page_dict[page_index] = self.document[page_index].get_obj_from_range(sc_index, lc_index)
+        # start and last page
+        sp_index = min(self.start_char_page_index, self.last_char_page_index)    # type: ignore
+        lp_index = max(self.start_char_page_index, self.last_char_page_index)    # type: ignore
+        if page_index < sp_index or page_index > lp_index:
+            return None
 
-        return page_dict
+        # handle forward select and backward select on multi page.
+        # backward select on multi page.
+        if self.start_char_page_index > self.last_char_page_index:    # type: ignore
+            sc = self.last_char_rect_index if page_index == sp_index else (0, 0, 0, 0)
+            lc = self.start_char_rect_index if page_index == lp_index else (-1, -1, -1, -1)
+        else:
+            # forward select on multi page.
+            sc = self.start_char_rect_index if page_index == sp_index else (0, 0, 0, 0)
+            lc = self.last_char_rect_index if page_index == lp_index else (-1, -1, -1, -1)
+
+        # handle forward select and backward select on same page.
+        if -1 in sc:
+            return lc, sc
+        elif -1 in lc:
+            return sc, lc
+        else:
+            return min(sc, lc), max(sc, lc)
 
     def parse_select_char_list(self):
         string = ""
@@ -1313,13 +1996,56 @@ class PdfViewerWidget(QWidget):
                     string += "\n\n"    # add new line on page end.
         return string
 
+    def get_select_ranges(self):
+        '''Return list of (page_index, start, end) of selection.'''
+        select_ranges = []
+        if self.start_char_rect_index and self.last_char_rect_index:
+            sp_index = min(self.start_char_page_index, self.last_char_page_index)    # type: ignore
+            lp_index = max(self.start_char_page_index, self.last_char_page_index)    # type: ignore
+            for page_index in range(sp_index, lp_index + 1):    # type: ignore
+                select_ranges.append((page_index, *self.get_select_page_range(page_index)))    # type: ignore
+        return select_ranges
+
     def parse_select_obj_list(self):
-        strings = []
-        page_dict = self.get_select_obj_list()
-        for index, obj_list in enumerate(page_dict.values()):
-            if obj_list:
-                strings.append(self.document[index].parse_obj_list(obj_list))
-        return "".join(strings)
+        output = io.StringIO()
+        write_select_text(lambda page_index: self.document[page_index], self.get_select_ranges(), output)
+        return output.getvalue()
+
+    def copy_select(self, show_message=False):
+        '''
+        Copy selection to kill ring, then cleanup select.
+        Large selection is extracted in thread with standalone document, and pass to Emacs with temp file.
+        '''
+        select_ranges = self.get_select_ranges()
+        if len(select_ranges) <= self.select_sync_page_limit:
+            content = self.parse_select_obj_list()
+            if content:
+                eval_in_emacs('kill-new', [content])
+                if show_message:
+                    message_to_emacs(content)
+        else:
+            threading.Thread(target=self.extract_select_text,
+                             args=(self.url, select_ranges, self.document.get_page_clip()),
+                             daemon=True).start()
+            message_to_emacs("Copying text of {} pages...".format(len(select_ranges)))
+
+        self.cleanup_select()
+
+    def extract_select_text(self, url, select_ranges, clip):
+        try:
+            # Use standalone document in thread, fitz document is not thread safe.
+            document = open_document(url)
+            get_page = lambda page_index: PdfPage(document[page_index], page_index, document.is_pdf, clip)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", prefix="eaf-pdf-select-",
+                                             suffix=".txt", delete=False) as f:
+                write_select_text(get_page, select_ranges, f)
+            document.close()
+
+            eval_in_emacs("eaf--pdf-kill-new-from-file", [f.name])
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            message_to_emacs("Failed to copy selection.")
 
     def record_new_annot_action(self, annot_action):
         num_action_removed = len(self.annot_action_sequence) - (self.annot_action_index + 1)
@@ -1329,8 +2055,18 @@ class PdfViewerWidget(QWidget):
         self.annot_action_index += 1
 
     def annot_select_char_area(self, annot_type="highlight", text=None):
-        self.cleanup_select()   # needs first cleanup select highlight mark.
-        for page_index, quads in self.select_area_annot_quad_cache_dict.items():
+        # Collect quads of all selected pages before cleanup select.
+        self.update_select_obj_area()
+        page_quads = {page_index: [fitz.Rect(rect).quad for rect in rects]
+                      for page_index, rects in self.select_area_annot_quad_cache_dict.items() if rects}
+        self.select_area_annot_quad_cache_dict.clear()
+
+        # Cleanup select highlight mark, only pages of selection need re-render.
+        self.is_select_mode = False
+        self.delete_all_mark_select_area()
+
+        annot_actions = []
+        for page_index, quads in page_quads.items():
             page = self.document[page_index]
 
             if annot_type == "highlight":
@@ -1353,12 +2089,16 @@ class PdfViewerWidget(QWidget):
 
             new_annot.set_info(title=self.user_name)
             new_annot.parent = page
+            self.document.annot_index.add(page_index, new_annot)
 
-            annot_action = AnnotAction.create_annot_action("Add", page_index, new_annot)
-            self.record_new_annot_action(annot_action)
+            annot_actions.append(AnnotAction.create_annot_action("Add", page_index, new_annot))
 
-        self.document.saveIncr()
-        self.select_area_annot_quad_cache_dict.clear()
+        if annot_actions:
+            # One selection is one undo step, whatever how many pages it cross.
+            self.record_new_annot_action(AnnotActionBatch(annot_actions))
+            self.save_annot(list(page_quads.keys()))
+        else:
+            self.update()
 
     def annot_popup_text_annot(self, text=None):
         (point, page_index) = self.popup_text_annot_pos
@@ -1369,6 +2109,7 @@ class PdfViewerWidget(QWidget):
         new_annot = page.add_text_annot(point, text, icon="Note")
         new_annot.set_info(title=self.user_name)
         new_annot.parent = page
+        self.document.annot_index.add(page_index, new_annot)
 
         annot_action = AnnotAction.create_annot_action("Add", page_index, new_annot)
         self.record_new_annot_action(annot_action)
@@ -1405,6 +2146,7 @@ class PdfViewerWidget(QWidget):
                                           text_color=text_color, align = 0)
         new_annot.set_info(title=self.user_name)
         new_annot.parent = page
+        self.document.annot_index.add(page_index, new_annot)
 
         annot_action = AnnotAction.create_annot_action("Add", page_index, new_annot)
         self.record_new_annot_action(annot_action)
@@ -1415,7 +2157,6 @@ class PdfViewerWidget(QWidget):
     def cleanup_select(self):
         self.is_select_mode = False
         self.delete_all_mark_select_area()
-        self.page_cache_pixmap_dict.clear()
         self.update()
 
     def update_select_char_area(self):
@@ -1459,32 +2200,28 @@ class PdfViewerWidget(QWidget):
             # refresh select quad
             self.select_area_annot_quad_cache_dict[page_index] = quad_list
             
+    def get_select_page_rects(self, page_index):
+        '''
+        Line rects of selection on page_index.
+        Rects are cached with selection range, dragging only recompute the page where range changed.
+        '''
+        select_range = self.get_select_page_range(page_index)
+        if select_range is None:
+            return []
+
+        cache = self.select_area_rect_cache_dict.get(page_index)
+        if cache is None or cache[0] != select_range:
+            cache = (select_range, self.document[page_index].get_range_line_rects(*select_range))
+            self.select_area_rect_cache_dict[page_index] = cache
+        return cache[1]
+
     def update_select_obj_area(self):
-        page_dict = self.get_select_obj_list()
-        rectify = lambda x0, y0, x1, y1: fitz.Rect(x0-1, y0-1, x1+1, y1+1)
-        for page_index, chars_list in page_dict.items():         
-            rect_list = []
-            if not chars_list:
-                continue
-            
-            line_rect_list = []
-            line_x0, line_y0, line_x1, line_y1 = chars_list[0]["bbox"]
-            for obj in chars_list:
-                x0, y0, x1, y1 = obj["bbox"]
-                if abs(y0-line_y0) < 3 or abs(y1-line_y1) < 3 or \
-                    abs((y0+y1) / 2 - (line_y0 + line_y1)/2) < 3:
-                    # The same line
-                    line_x0 = min(line_x0, x0)
-                    line_y0 = min(line_y0, y0)
-                    line_x1 = max(line_x1, x1)
-                    line_y1 = max(line_y1, y1)
-                else:
-                    # The next line
-                    line_rect_list.append(rectify(line_x0, line_y0, line_x1, line_y1))
-                    line_x0, line_y0, line_x1, line_y1 = x0, y0, x1, y1
-            line_rect_list.append(rectify(line_x0, line_y0, line_x1, line_y1))  
-            # refresh select quad
-            self.select_area_annot_quad_cache_dict[page_index] = line_rect_list
+        self.select_area_annot_quad_cache_dict.clear()
+        if self.start_char_rect_index and self.last_char_rect_index:
+            sp_index = min(self.start_char_page_index, self.last_char_page_index)    # type: ignore
+            lp_index = max(self.start_char_page_index, self.last_char_page_index)    # type: ignore
+            for page_index in range(sp_index, lp_index + 1):    # type: ignore
+                self.select_area_annot_quad_cache_dict[page_index] = self.get_select_page_rects(page_index)
 
     def mark_select_char_area(self, page_index, pixmap):
         def quad_to_qrect(quad):
@@ -1511,32 +2248,30 @@ class PdfViewerWidget(QWidget):
         self.select_area_annot_quad_cache_dict.clear()
         return pixmap
 
-    def mark_select_obj_area(self, page_index, pixmap):
-        def rect_to_qrect(rect):
-            scaled =  rect * self.scale * self.devicePixelRatioF()
-            return QRect(int(scaled.x0), int(scaled.y0), int(scaled.width), int(scaled.height))
-
-        qp = QPainter(pixmap)
-        qp.setRenderHint(QPainter.RenderHint.Antialiasing)
-        color = QColor(252, 240, 3, 60) if self.get_inverted_mode() else QColor(11, 120, 250, 60)
-        qp.setBrush(color)
-        qp.setPen(Qt.PenStyle.NoPen)
-        qp.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-
-        # update select area quad list
-        self.update_select_obj_area()
+    def draw_select_area(self, painter, page_index, rect):
+        '''
+        Draw selection highlight over page drawn in rect, page pixmap is not changed.
+        '''
+        rects = self.get_select_page_rects(page_index)
+        if not rects:
+            return
 
-        # draw new highlight
-        if page_index in self.select_area_annot_quad_cache_dict:
-            rects = self.select_area_annot_quad_cache_dict[page_index]
-            for rect in rects:
-                # qp.fillRect(rect_to_qrect(rect), QColor(self.text_highlight_annot_color))
-                qp.drawRoundedRect(rect_to_qrect(rect), 2.5, 2.5)
+        # Page coordinate to widget coordinate, rect maybe not drawn with self.scale (e.g. presentation mode).
+        factor = rect.width() / self.document[page_index].clip.width
+        def rect_to_qrectf(r):
+            return QRectF(rect.x() + r.x0 * factor, rect.y() + r.y0 * factor, r.width * factor, r.height * factor)
 
-        self.select_area_annot_quad_cache_dict.clear()
-        return pixmap
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setBrush(QColor(252, 240, 3, 60) if self.get_inverted_mode() else QColor(11, 120, 250, 60))
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        for r in rects:
+            painter.drawRoundedRect(rect_to_qrectf(r), 2.5, 2.5)
+        painter.restore()
 
     def delete_all_mark_select_area(self):
+        self.select_area_rect_cache_dict.clear()
         self.last_char_page_index = None
         self.last_char_rect_index = None
         self.start_char_page_index = None
@@ -1550,13 +2285,18 @@ class PdfViewerWidget(QWidget):
         page = self.document[page_index]
         return page.annots(types)
 
-    def find_annot_by_id(self, page, annot_id):
-        annot = page.first_annot
-        if not annot:
-            return None
+    def find_annot_by_id(self, annot_id, page_index=None):
+        annot = self.document.annot_index.find(annot_id)
+        if annot is not None or page_index is None:
+            return annot
 
+        # Fallback to walk annots of page, annot maybe not in index if file changed outside.
+        page = self.document.document[int(page_index)]
+        annot = page.first_annot
         while annot:
             if annot.info["id"] == annot_id:
+                annot.parent = page
+                self.document.annot_index.reset()
                 return annot
             annot = annot.next
 
@@ -1580,9 +2320,26 @@ class PdfViewerWidget(QWidget):
         self.update()
         return True
 
-    def save_annot(self):
+    def save_annot(self, page_indexes=None):
         self.document.saveIncr()
-        self.page_cache_pixmap_dict.clear()
+        # Worker documents are opened before save, render pages with saved file again.
+        self.background_renderer.reset()
+        self.shared_document.reset_process_renderer()
+        # Link annots may be changed, prefetch target of hovered link again from saved file.
+        self.document.link_graph.reset()
+        self.last_hover_link = None
+        self.preview_renderer.reset()
+        self.hide_link_preview()
+        self.presentation_pixmap_dict.clear()
+        self.shared_document.remove_pixmaps(page_indexes)
+        self.document.reset_private_document()
+        if page_indexes is None:
+            self.page_cache_pixmap_dict.clear()
+        else:
+            # Only re-render pages that annots changed.
+            for page_index in page_indexes:
+                self.page_cache_pixmap_dict.pop(page_index, None)
+                self.document.remove_cache(page_index)
         self.update()
 
     def annot_handler(self, action=None, annot=None):
@@ -1593,6 +2350,7 @@ class PdfViewerWidget(QWidget):
             if action == "delete":
                 annot_action = AnnotAction.create_annot_action("Delete", annot.parent.number, annot)
                 self.record_new_annot_action(annot_action)
+                self.document.annot_index.remove(annot.info["id"])
                 annot.parent.delete_annot(annot)
                 self.save_annot()
             elif action == "edit":
@@ -1630,6 +2388,7 @@ class PdfViewerWidget(QWidget):
                 new_rect = fitz.Rect(point, point.x + rect.width, point.y + rect.height)    # type: ignore
                 annot.set_rect(new_rect)    # type: ignore
                 annot.update()    # type: ignore
+                self.document.annot_index.update(annot)
                 self.save_annot()
 
         self.moved_annot_page = (None, None)
@@ -1665,6 +2424,9 @@ class PdfViewerWidget(QWidget):
             (current_link is not None and current_link != self.last_hover_link)):
 
             if current_link:
+                if current_link != self.last_hover_link:
+                    self.prefetch_link_target(current_link)
+                    self.schedule_link_preview(current_link)
                 self.last_hover_link = current_link
                 if current_link != self.last_hover_link or not QToolTip.isVisible():
                     tooltip_text = ""
@@ -1679,6 +2441,7 @@ class PdfViewerWidget(QWidget):
             else:
                 if QToolTip.isVisible():
                     QToolTip.hideText()
+                self.hide_link_preview()
 
             self.is_hover_link = is_hover_link
 
@@ -1702,7 +2465,7 @@ class PdfViewerWidget(QWidget):
                 self.update_vertical_offset(self.max_scroll_offset())
 
     def jump_to_percent(self, percent):
-        accumulated_height = self.accumulate_page_heights()
+        accumulated_height = self.get_document_render_height()
         offset = percent * accumulated_height / 100.0
         self.update_vertical_offset(offset)
 
@@ -1716,10 +2479,12 @@ class PdfViewerWidget(QWidget):
 
     def delete_pdf_page (self, page):
         self.document.delete_page(page)
+        self.document.annot_index.reset()
         self.save_annot()
 
     def delete_pdf_pages (self, start_page, end_page):
         self.document.delete_pages(start_page, end_page)
+        self.document.annot_index.reset()
         self.save_annot()
 
     def current_percent(self):
@@ -1727,16 +2492,15 @@ class PdfViewerWidget(QWidget):
 
     def update_vertical_offset(self, new_offset):
         new_offset = max(0, min(new_offset, self.max_scroll_offset()))
-        eval_in_emacs("eaf--clear-message", [])
+        self.emacs_call_batcher.throttle("eaf--clear-message", [])
         if self.scroll_offset != new_offset:
             self.scroll_offset = new_offset
+            if self.link_preview_key is not None:
+                self.hide_link_preview()
             self.update()
-            eval_in_emacs("eaf--pdf-update-position", [self.buffer_id,
-                                            self.current_page_index1,
-                                            self.page_total_number])
             
     def update_horizontal_offset(self, new_offset):
-        eval_in_emacs("eaf--clear-message", [])
+        self.emacs_call_batcher.throttle("eaf--clear-message", [])
         if self.horizontal_offset != new_offset:
             self.horizontal_offset = new_offset
             self.update()
@@ -1744,19 +2508,29 @@ class PdfViewerWidget(QWidget):
     def get_cursor_absolute_position(self):
         pos = self.mapFromGlobal(QCursor.pos()) # map global coordinate to widget coordinate.
         ex, ey = pos.x(), pos.y()
-        # set page coordinate
-        render_width = self.page_width * self.scale
-        render_height = self.page_height * self.scale
-        render_x = int((self.rect().width() - render_width) / 2)
-        if self.read_mode == "fit_to_customize" and render_width >= self.rect().width():
-            render_x = max(min(render_x + self.horizontal_offset, 0), self.rect().width() - render_width)
-        if (ex < render_x or ex > render_x + render_width or ey > render_height):
-            return 0, 0, None
-
-        # computer absolute coordinate of page
-        x = (ex - render_x) * 1.0 / self.scale
-        
-        page_index, y = self.window_y_to_page_y(ey)
+        if self.page_columns > 1:
+            # Find page of cursor in row, same coordinate as draw_column_pages.
+            layout = self.get_page_layout()
+            top_offset = min(self.scroll_offset, self.max_scroll_offset())
+            position = layout.page_at(ex - self.get_row_render_x(layout), ey + top_offset)
+            if position is None:
+                return 0, 0, None
+            page_index, x, y = position
+            x, y = x / self.scale, y / self.scale
+        else:
+            # set page coordinate
+            render_width = self.page_width * self.scale
+            render_height = self.page_height * self.scale
+            render_x = int((self.rect().width() - render_width) / 2)
+            if self.read_mode == "fit_to_customize" and render_width >= self.rect().width():
+                render_x = max(min(render_x + self.horizontal_offset, 0), self.rect().width() - render_width)
+            if (ex < render_x or ex > render_x + render_width or ey > render_height):
+                return 0, 0, None
+
+            # computer absolute coordinate of page
+            x = (ex - render_x) * 1.0 / self.scale
+
+            page_index, y = self.window_y_to_page_y(ey)
         # print(ey, y, page_index)
         temp = x
         if self.rotation == 90:
@@ -1788,15 +2562,8 @@ class PdfViewerWidget(QWidget):
         ex, ey, page_index = self.get_cursor_absolute_position()
         if page_index is None:
             return None
-        page = self.document[page_index]
-        word_offset = 10 # 10 pixel is enough for word intersect operation
-        draw_rect = fitz.Rect(ex, ey, ex + word_offset, ey + word_offset)
-
-        page.set_cropbox(page.rect)
-        page_words = page.get_text_words()
-        rect_words = [w for w in page_words if fitz.Rect(w[:4]).intersects(draw_rect)]
-        if rect_words:
-            return rect_words[0][4]
+        # 10 pixel is enough for word intersect operation
+        return self.document[page_index].get_word_at_point(ex, ey, offset=10)
 
     def eventFilter(self, obj, event):
         if event.type() in [QEvent.Type.MouseButtonPress]:
@@ -1804,6 +2571,15 @@ class PdfViewerWidget(QWidget):
         elif event.type() in [QEvent.Type.MouseButtonRelease]:
             self.is_button_press = False
 
+        # Thumbnail grid only handle click, cursor is not on page.
+        if self.is_thumbnail_mode and event.type() in [QEvent.Type.MouseMove, QEvent.Type.MouseButtonPress,
+                                                       QEvent.Type.MouseButtonRelease, QEvent.Type.MouseButtonDblClick]:
+            if event.type() == QEvent.Type.MouseButtonPress and event.button() == Qt.MouseButton.LeftButton:
+                page_index = self.thumbnail_grid.index_at(event.position().x(), event.position().y())
+                if page_index is not None:
+                    self.open_thumbnail_page(page_index)
+            return False
+
         if event.type() == QEvent.Type.MouseMove:
             shape = Qt.CursorShape.ArrowCursor
             ex, ey, page_index = self.get_cursor_absolute_position()
@@ -1823,12 +2599,10 @@ class PdfViewerWidget(QWidget):
 
             # cleanup select mode on another click
             if self.is_select_mode:
-                click_to_copy, = get_emacs_vars(["eaf-pdf-click-to-copy"])
-                if click_to_copy:
-                    content = self.parse_select_obj_list()
-                    eval_in_emacs('kill-new', [content])
-                    message_to_emacs(content)
-                self.cleanup_select()   
+                if self.emacs_config["eaf-pdf-click-to-copy"]:
+                    self.copy_select(show_message=True)
+                else:
+                    self.cleanup_select()
 
             if self.is_popup_text_annot_mode:
                 if event.button() != Qt.MouseButton.LeftButton:
@@ -1963,6 +2737,7 @@ class PdfViewerWidget(QWidget):
                 new_annot = page.add_rect_annot(annot_rect)
                 new_annot.set_info(title=self.user_name)
                 new_annot.parent = page
+                self.document.annot_index.add(page_index, new_annot)
 
                 annot_action = AnnotAction.create_annot_action("Add", page_index, new_annot)
                 self.record_new_annot_action(annot_action)
@@ -2005,7 +2780,8 @@ class PdfViewerWidget(QWidget):
         if rect_index:
             if self.start_char_rect_index is None or self.start_char_page_index is None:
                 self.start_char_rect_index, self.start_char_page_index = rect_index, page_index
-            else:
+            elif (rect_index, page_index) != (self.last_char_rect_index, self.last_char_page_index):
+                # Only repaint when selection end moved to another char.
                 self.last_char_rect_index, self.last_char_page_index = rect_index, page_index
                 self.update()
                 
@@ -2031,14 +2807,14 @@ class PdfViewerWidget(QWidget):
         ex, ey, page_index = self.get_cursor_absolute_position()
         if page_index is None:
             return
-        folder = Path(self.url).parent
-        # chech if ".synctex.gz" file exist
-        file_name_without_ext = Path(self.url).stem
-        synctex_gz = Path(file_name_without_ext + ".synctex.gz")
-        synctex_file = folder / synctex_gz
-
-        if os.path.exists(synctex_file) and self.document.is_pdf:
-            eval_in_emacs("eaf-pdf-synctex-backward-edit", [self.url, page_index + 1, ex, ey])
+
+        if get_synctex_file(self.url) is not None and self.document.is_pdf:
+            # Lookup in-memory synctex index first, fallback to synctex tool in Emacs.
+            tex_and_line = self.synctex_index.backward(page_index + 1, ex, ey)
+            if tex_and_line is not None:
+                eval_in_emacs("eaf-pdf-synctex-open-tex", list(tex_and_line))
+            else:
+                eval_in_emacs("eaf-pdf-synctex-backward-edit", [self.url, page_index + 1, ex, ey])
         else:
             page_text = self.buffer.get_page_text(page_index)
             all_lines = page_text.splitlines()
@@ -2052,6 +2828,7 @@ class PdfViewerWidget(QWidget):
 
     def edit_outline_confirm(self, payload):
         self.document.set_toc(payload)
+        self.document.toc_model.set_toc(payload)
         self.document.saveIncr()
         message_to_emacs("Updated PDF Table of Contents successfully.")
 